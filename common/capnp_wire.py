@@ -0,0 +1,125 @@
+"""
+Reads batches of serialized Cap'n Proto messages with numpy.
+
+The messages are joined into one array of words, and pointers are followed for many structs or
+lists at once, through landing pads for far pointers. Every target is checked against the segment
+it's in, so a malformed message can't read words from the next one. The field layout comes from
+the schema, see https://capnproto.org/encoding.html for the wire format.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+STRUCT_POINTER = 0
+LIST_POINTER = 1
+FAR_POINTER = 2
+
+# bits per element of each list element size, 7 is a composite list of structs with a tag word
+LIST_ELEMENT_BITS = np.array([0, 1, 8, 16, 32, 64, 64, 0], dtype=np.int64)
+LIST_COMPOSITE = 7
+
+
+def pointer_offset(pointer):
+  """Signed 30 bit word offset of struct and list pointers"""
+  return ((pointer & 0xFFFFFFFF) >> 2).astype(np.int64) - (((pointer >> 31) & 1) << 30).astype(np.int64)
+
+
+def struct_sizes(pointer):
+  """Data section words and pointer count of struct pointers, or of the tag word of a composite list"""
+  return ((pointer >> 32) & 0xFFFF).astype(np.int64), (pointer >> 48).astype(np.int64)
+
+
+def list_sizes(pointer):
+  """Element size and element count of list pointers, the count is in words for composite lists"""
+  return ((pointer >> 32) & 7).astype(np.int64), (pointer >> 35).astype(np.int64)
+
+
+def read_field(words: np.ndarray, struct_words: np.ndarray, offset: int, size: int) -> np.ndarray:
+  """Little endian field of size bytes at byte offset into the data section of each struct"""
+  return (words[struct_words + offset // 8] >> np.uint64(8 * (offset % 8))) & np.uint64((1 << (8 * size)) - 1)
+
+
+class Messages(NamedTuple):
+  """Serialized messages back to back, as one array of words"""
+  words: np.ndarray
+  segment_starts: np.ndarray  # first word of every segment of every message
+  segment_ends: np.ndarray
+  first_segment: np.ndarray  # index in segment_starts of each message's first segment
+  n_segments: np.ndarray
+
+  @property
+  def roots(self) -> np.ndarray:
+    """Word of each message's root pointer"""
+    return self.segment_starts[self.first_segment]
+
+  def resolve(self, pointer_words: np.ndarray, messages: np.ndarray):
+    """
+    Follow pointers at the given words of the given messages, through landing pads for far pointers. Returns the
+    word each pointer's content starts at, the pointer describing it and the end of the segment the content is in,
+    None if any of them point out of their segment.
+    """
+    words = self.words
+    segments = np.searchsorted(self.segment_starts, pointer_words, side='right') - 1
+    if np.any(pointer_words >= self.segment_ends[segments]):
+      return None
+    pointers = words[pointer_words]
+    starts = pointer_words + 1 + pointer_offset(pointers)
+
+    far = pointers & 3 == FAR_POINTER
+    if np.any(far):
+      messages = messages[far]
+      segment = (pointers[far] >> 32).astype(np.int64)
+      if np.any(segment >= self.n_segments[messages]):
+        return None
+      segment += self.first_segment[messages]
+      pads = self.segment_starts[segment] + ((pointers[far] & 0xFFFFFFFF) >> 3).astype(np.int64)
+      double_far = (pointers[far] >> 2) & 1 == 1
+      if np.any(pads + 1 + double_far > self.segment_ends[segment]):
+        return None
+      pads_pointers = words[pads]
+      far_starts = pads + 1 + pointer_offset(pads_pointers)
+
+      # a double far pad is a far pointer to the content followed by the pointer describing it
+      if np.any(double_far):
+        content = pads_pointers[double_far]
+        content_segment = (content >> 32).astype(np.int64)
+        if np.any((content & 3 != FAR_POINTER) | (content_segment >= self.n_segments[messages[double_far]])):
+          return None
+        content_segment += self.first_segment[messages[double_far]]
+        far_starts[double_far] = self.segment_starts[content_segment] + ((content & 0xFFFFFFFF) >> 3).astype(np.int64)
+        pads_pointers[double_far] = words[pads[double_far] + 1]
+        segment[double_far] = content_segment
+      starts[far], pointers[far], segments[far] = far_starts, pads_pointers, segment
+
+    ends = self.segment_ends[segments]
+    if np.any((starts < self.segment_starts[segments]) | (starts > ends)):
+      return None
+    return starts, pointers, ends
+
+
+def read_messages(strings) -> Messages | None:
+  """Messages with their segment tables checked, None if any of them is malformed"""
+  lengths = np.array([len(s) for s in strings], dtype=np.int64)
+  if np.any((lengths < 8) | (lengths % 8 != 0)):
+    return None
+  buf = np.frombuffer(b''.join(strings), dtype=np.uint8)
+  offsets = np.cumsum(lengths) - lengths
+
+  # segment tables: segment count - 1, then the size of each segment in words
+  n_segments = buf[offsets[:, None] + np.arange(4)].copy().view('<u4')[:, 0].astype(np.int64) + 1
+  header_lengths = (4 * (n_segments + 1) + 7) // 8 * 8
+  if np.any(header_lengths > lengths):
+    return None
+  first_segment = np.cumsum(n_segments) - n_segments
+  segment_message = np.repeat(np.arange(len(strings)), n_segments)
+  segment_idx = np.arange(len(segment_message)) - first_segment[segment_message]
+  size_bytes = offsets[segment_message] + 4 + 4 * segment_idx
+  segment_sizes = buf[size_bytes[:, None] + np.arange(4)].copy().view('<u4')[:, 0].astype(np.int64)
+  ends = np.cumsum(segment_sizes)
+  message_words = ends[first_segment + n_segments - 1] - ends[first_segment] + segment_sizes[first_segment]
+  if np.any(header_lengths + 8 * message_words != lengths):
+    return None
+
+  starts_in_message = ends - segment_sizes - (ends - segment_sizes)[first_segment][segment_message]
+  segment_starts = (offsets + header_lengths)[segment_message] // 8 + starts_in_message
+  return Messages(buf.view('<u8'), segment_starts, segment_starts + segment_sizes, first_segment, n_segments)
@@ -0,0 +1,90 @@
+import ctypes
+import os
+import select
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+def _libc():
+  return ctypes.CDLL(None, use_errno=True)
+
+
+class Inotify:
+  """
+  Minimal inotify(7) wrapper, for following a directory tree without rescanning it.
+  Events are (wd, mask, cookie, name) tuples, name is empty for events on the watched path itself.
+  """
+  def __init__(self):
+    self._libc = _libc()
+    self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+
+  @staticmethod
+  def available() -> bool:
+    return sys.platform.startswith("linux") and hasattr(_libc(), "inotify_init1")
+
+  def add_watch(self, path: str, mask: int) -> int:
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return wd
+
+  def rm_watch(self, wd: int) -> None:
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def fileno(self) -> int:
+    return self.fd
+
+  def read(self, timeout: float | None = 0) -> list[tuple[int, int, int, str]]:
+    """Returns the pending events, waiting up to timeout seconds (forever if None) for the first one"""
+    if timeout != 0:
+      r, _, _ = select.select([self.fd], [], [], timeout)
+      if not r:
+        return []
+
+    events = []
+    while True:
+      try:
+        buf = os.read(self.fd, _READ_SIZE)
+      except BlockingIOError:
+        break
+
+      offset = 0
+      while offset < len(buf):
+        wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+        offset += _EVENT.size
+        name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+        offset += length
+        events.append((wd, mask, cookie, name))
+    return events
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
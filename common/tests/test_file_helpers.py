@@ -1,7 +1,11 @@
 import os
 from uuid import uuid4
 
-from openpilot.common.utils import atomic_write
+import pytest
+import requests
+import zstandard as zstd
+
+from openpilot.common.utils import CallbackReader, atomic_write, get_upload_stream
 
 
 class TestFileHelpers:
@@ -17,3 +21,30 @@ class TestFileHelpers:
 
   def test_atomic_write(self):
     self.run_atomic_write_func(atomic_write)
+
+  @pytest.mark.parametrize("compress", [True, False])
+  def test_upload_stream(self, tmp_path, compress):
+    data = b"".join(os.urandom(64) + b"\x00" * 1024 for _ in range(4096))
+    path = tmp_path / "rlog"
+    path.write_bytes(data)
+
+    progress = []
+    stream, length = get_upload_stream(str(path), compress)
+    # the body is sent with a Content-Length rather than chunked
+    assert requests.utils.super_len(stream) == length
+    # compressed data is kept in a temporary file without a name next to the log
+    assert os.listdir(tmp_path) == ["rlog"]
+    reader = CallbackReader(stream, lambda total: progress.append(total))
+    try:
+      chunks = []
+      while chunk := reader.read(8192):
+        chunks.append(chunk)
+    finally:
+      reader.close()
+
+    body = b"".join(chunks)
+    assert len(body) == length
+    assert progress[-1] == length
+    assert (zstd.ZstdDecompressor().decompressobj().decompress(body) if compress else body) == data
+    if compress:
+      assert length < len(data)
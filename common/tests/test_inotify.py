@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from openpilot.common.inotify import IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, \
+                                     IN_ONLYDIR, Inotify
+
+MASK = IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+
+pytestmark = pytest.mark.skipif(not Inotify.available(), reason="inotify is only available on linux")
+
+
+def names(events, mask):
+  return [name for _, m, _, name in events if m & mask]
+
+
+class TestInotify:
+  def test_events(self, tmp_path):
+    with Inotify() as inotify:
+      wd = inotify.add_watch(str(tmp_path), MASK)
+      assert inotify.read() == []
+
+      (tmp_path / "a").write_bytes(b"1")
+      (tmp_path / "dir").mkdir()
+      events = inotify.read()
+      assert all(w == wd for w, _, _, _ in events)
+      assert names(events, IN_CREATE) == ["a", "dir"]
+      assert names(events, IN_CLOSE_WRITE) == ["a"]
+      assert names(events, IN_ISDIR) == ["dir"]
+
+      # both halves of a rename share a cookie
+      os.rename(tmp_path / "a", tmp_path / "b")
+      events = inotify.read()
+      assert names(events, IN_MOVED_FROM) == ["a"]
+      assert names(events, IN_MOVED_TO) == ["b"]
+      assert len({cookie for _, _, cookie, _ in events}) == 1 and events[0][2] != 0
+
+      os.unlink(tmp_path / "b")
+      os.rmdir(tmp_path / "dir")
+      assert names(inotify.read(), IN_DELETE) == ["b", "dir"]
+
+      # removing the watched directory itself ends the watch
+      os.rmdir(tmp_path)
+      events = inotify.read()
+      assert [(w, m & (IN_DELETE_SELF | IN_IGNORED), name) for w, m, _, name in events] == [(wd, IN_DELETE_SELF, ""), (wd, IN_IGNORED, "")]
+
+  def test_read_timeout(self, tmp_path):
+    with Inotify() as inotify:
+      inotify.add_watch(str(tmp_path), MASK)
+      assert inotify.read(timeout=0.01) == []
+      (tmp_path / "a").write_bytes(b"")
+      assert names(inotify.read(timeout=None), IN_CREATE) == ["a"]
+
+  def test_many_events(self, tmp_path):
+    # more events than fit in a single read of the inotify fd
+    with Inotify() as inotify:
+      inotify.add_watch(str(tmp_path), IN_CREATE)
+      expected = [f"{i:0100}" for i in range(1000)]
+      for name in expected:
+        (tmp_path / name).write_bytes(b"")
+      assert names(inotify.read(), IN_CREATE) == expected
+
+  def test_errors(self, tmp_path):
+    with Inotify() as inotify:
+      with pytest.raises(FileNotFoundError):
+        inotify.add_watch(str(tmp_path / "missing"), MASK)
+      (tmp_path / "file").write_bytes(b"")
+      with pytest.raises(NotADirectoryError):
+        inotify.add_watch(str(tmp_path / "file"), MASK | IN_ONLYDIR)
+    assert inotify.fd == -1
@@ -1,18 +1,29 @@
 import numpy as np
 from collections.abc import Callable
 
-from openpilot.common.transformations.transformations import (ecef_euler_from_ned_single,
+from openpilot.common.transformations.transformations import (ecef_euler_from_ned_batch,
+                                                    ecef_euler_from_ned_single,
+                                                    euler2quat_batch,
                                                     euler2quat_single,
+                                                    euler2rot_batch,
                                                     euler2rot_single,
+                                                    ned_euler_from_ecef_batch,
                                                     ned_euler_from_ecef_single,
+                                                    quat2euler_batch,
                                                     quat2euler_single,
+                                                    quat2rot_batch,
                                                     quat2rot_single,
+                                                    rot2euler_batch,
                                                     rot2euler_single,
+                                                    rot2quat_batch,
                                                     rot2quat_single)
 
 
-def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]:
-  """Wrap a function to take either an input or list of inputs and return the correct shape"""
+def numpy_wrap(function, input_shape, output_shape, batch_function=None) -> Callable[..., np.ndarray]:
+  """
+  Wrap a function to take either an input or list of inputs and return the correct shape.
+  A list of inputs goes through batch_function in one call if there is one, otherwise function is called per input.
+  """
   def f(*inps):
     *args, inp = inps
     inp = np.array(inp)
@@ -26,6 +37,10 @@ def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]
     # Add empty dimension if inputs is not a list
     if len(shape) == len(input_shape):
       inp.shape = (1, ) + inp.shape
+    elif batch_function is not None:
+      result = np.asarray(batch_function(*args, inp))
+      result.shape = out_shape
+      return result
 
     result = np.asarray([function(*args, i) for i in inp])
     result.shape = out_shape
@@ -33,14 +48,14 @@ def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]
   return f
 
 
-euler2quat = numpy_wrap(euler2quat_single, (3,), (4,))
-quat2euler = numpy_wrap(quat2euler_single, (4,), (3,))
-quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3))
-rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,))
-euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3))
-rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,))
-ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,))
-ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,))
+euler2quat = numpy_wrap(euler2quat_single, (3,), (4,), euler2quat_batch)
+quat2euler = numpy_wrap(quat2euler_single, (4,), (3,), quat2euler_batch)
+quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3), quat2rot_batch)
+rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,), rot2quat_batch)
+euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3), euler2rot_batch)
+rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,), rot2euler_batch)
+ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,), ecef_euler_from_ned_batch)
+ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,), ned_euler_from_ecef_batch)
 
 quats_from_rotations = rot2quat
 quat_from_rot = rot2quat
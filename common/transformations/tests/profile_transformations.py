@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from openpilot.common.transformations import coordinates, orientation, transformations
+from openpilot.common.transformations.orientation import numpy_wrap
+
+
+def reference_wrap(function, input_shape, output_shape):
+  """The per row loop every vectorized call used to go through, for comparison"""
+  return numpy_wrap(function, input_shape, output_shape)
+
+
+def conversions(rng: np.random.Generator, n: int):
+  rpy = rng.uniform(-np.pi, np.pi, (n, 3))
+  geodetic = np.column_stack([rng.uniform(-80, 80, n), rng.uniform(-180, 180, n), rng.uniform(-100, 3000, n)])
+  ecef = coordinates.geodetic2ecef(geodetic)
+  local = coordinates.LocalCoord.from_geodetic(geodetic[0])
+  ned = local.ecef2ned(ecef[:1] + rng.normal(0, 100, (n, 3)))
+  t = transformations
+  return [
+    ("euler2quat", orientation.euler2quat, reference_wrap(t.euler2quat_single, (3,), (4,)), (rpy,)),
+    ("quat2rot", orientation.quat2rot, reference_wrap(t.quat2rot_single, (4,), (3, 3)), (orientation.euler2quat(rpy),)),
+    ("euler2rot", orientation.euler2rot, reference_wrap(t.euler2rot_single, (3,), (3, 3)), (rpy,)),
+    ("rot2euler", orientation.rot2euler, reference_wrap(t.rot2euler_single, (3, 3), (3,)), (orientation.euler2rot(rpy),)),
+    ("ned_euler_from_ecef", orientation.ned_euler_from_ecef, reference_wrap(t.ned_euler_from_ecef_single, (3,), (3,)), (ecef[0], rpy)),
+    ("geodetic2ecef", coordinates.geodetic2ecef, reference_wrap(t.geodetic2ecef_single, (3,), (3,)), (geodetic,)),
+    ("ecef2geodetic", coordinates.ecef2geodetic, reference_wrap(t.ecef2geodetic_single, (3,), (3,)), (ecef,)),
+    ("LocalCoord.ned2geodetic", local.ned2geodetic, reference_wrap(local.ned2geodetic_single, (3,), (3,)), (ned,)),
+  ]
+
+
+def time_call(function, args, repeat: int = 3) -> float:
+  times = []
+  for _ in range(repeat):
+    start = time.monotonic()
+    function(*args)
+    times.append(time.monotonic() - start)
+  return min(times)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark batched orientation and coordinate conversions against converting row by row")
+  parser.add_argument("--rows", type=int, default=20000, help="rows per conversion")
+  args = parser.parse_args()
+
+  print(f"{args.rows} rows, per row cost:")
+  for name, batched, reference, inputs in conversions(np.random.default_rng(0), args.rows):
+    np.testing.assert_allclose(batched(*inputs), reference(*inputs), rtol=1e-6, atol=1e-6)
+    reference_time = time_call(reference, inputs, repeat=1)
+    batched_time = time_call(batched, inputs)
+    reference_us, batched_us = reference_time / args.rows * 1e6, batched_time / args.rows * 1e6
+    print(f"  {name:24s} loop {reference_us:7.2f} us, batched {batched_us:6.3f} us, speedup {reference_time / batched_time:.0f}x")
@@ -103,6 +103,18 @@ class TestNED:
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
 
+  def test_batch_matches_single(self):
+    rng = np.random.default_rng(0)
+    geodetic = np.column_stack([rng.uniform(-80, 80, 1000), rng.uniform(-180, 180, 1000), rng.uniform(-100, 3000, 1000)])
+    ecef = coord.geodetic2ecef(geodetic)
+    np.testing.assert_allclose(ecef, [coord.geodetic2ecef(g) for g in geodetic], rtol=1e-12)
+    np.testing.assert_allclose(coord.ecef2geodetic(ecef), [coord.ecef2geodetic(e) for e in ecef], rtol=1e-12, atol=1e-6)
+
+    converter = coord.LocalCoord.from_geodetic(geodetic[0])
+    ned = converter.geodetic2ned(geodetic[:10])
+    np.testing.assert_allclose(ned, [converter.geodetic2ned(g) for g in geodetic[:10]], rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(converter.ned2geodetic(ned), [converter.ned2geodetic(n) for n in ned], rtol=1e-9, atol=1e-6)
+
   def test_errors(self):
     # Test wrong shape/type for geodetic2ecef
     # numpy_wrap raises IndexError for scalar input
@@ -3,7 +3,8 @@ import pytest
 
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
-                                               ned_euler_from_ecef
+                                               ecef_euler_from_ned, ned_euler_from_ecef
+from openpilot.common.transformations import transformations
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -59,7 +60,30 @@ class TestOrientation:
     for i in range(len(eulers)):
       np.testing.assert_allclose(ned_eulers[i], ned_euler_from_ecef(ecef_positions[i], eulers[i]), rtol=1e-7)
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
-    # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+    np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+
+  @pytest.mark.parametrize("function, single, in_shape", [
+    (euler2quat, transformations.euler2quat_single, (3,)),
+    (quat2euler, transformations.quat2euler_single, (4,)),
+    (euler2rot, transformations.euler2rot_single, (3,)),
+    (quat2rot, transformations.quat2rot_single, (4,)),
+    (rot2quat, transformations.rot2quat_single, (3, 3)),
+    (rot2euler, transformations.rot2euler_single, (3, 3)),
+  ])
+  def test_batch_matches_single(self, function, single, in_shape):
+    rng = np.random.default_rng(0)
+    rpy = rng.uniform(-np.pi, np.pi, (1000, 3))
+    inputs = {(3,): rpy, (4,): euler2quat(rpy), (3, 3): euler2rot(rpy)}[in_shape]
+    np.testing.assert_allclose(function(inputs), [single(i) for i in inputs], rtol=1e-12, atol=1e-12)
+
+  def test_euler_ned_batch_matches_single(self):
+    rng = np.random.default_rng(0)
+    poses = rng.uniform(-np.pi, np.pi, (200, 3))
+    origins = ecef_positions[rng.integers(len(ecef_positions), size=len(poses))]
+    for function, single in [(ned_euler_from_ecef, transformations.ned_euler_from_ecef_single),
+                             (ecef_euler_from_ned, transformations.ecef_euler_from_ned_single)]:
+      np.testing.assert_allclose(function(origins, poses), [single(o, p) for o, p in zip(origins, poses, strict=True)], atol=1e-7)
+      np.testing.assert_allclose(function(origins[0], poses), [single(origins[0], p) for p in poses], atol=1e-7)
 
   def test_inputs(self):
     with pytest.raises(ValueError):
@@ -247,6 +247,30 @@ class LocalCoord:
     ecef = self.ned2ecef_single(ned)
     return ecef2geodetic_single(ecef)
 
+  def ecef2ned_batch(self, ecef):
+    """
+    Convert an array of ECEF points to NED coordinates relative to the origin.
+    """
+    return (np.asarray(ecef) - self.init_ecef) @ self.ecef2ned_matrix.T
+
+  def ned2ecef_batch(self, ned):
+    """
+    Convert an array of NED points to ECEF coordinates.
+    """
+    return np.asarray(ned) @ self.ned2ecef_matrix.T + self.init_ecef
+
+  def geodetic2ned_batch(self, geodetic):
+    """
+    Convert an array of geodetic points to NED coordinates.
+    """
+    return self.ecef2ned_batch(geodetic2ecef_batch(geodetic))
+
+  def ned2geodetic_batch(self, ned):
+    """
+    Convert an array of NED points to geodetic coordinates.
+    """
+    return ecef2geodetic_batch(self.ned2ecef_batch(ned))
+
   @property
   def ned_from_ecef_matrix(self):
     """
@@ -340,3 +364,233 @@ def ned_euler_from_ecef_single(ecef_init, ecef_pose):
   phi_out = np.arctan2(np.dot(y3, z2), np.dot(y3, y2))
 
   return np.array([phi_out, theta_out, psi_out])
+
+
+# Batched versions of the conversions above, taking arrays of inputs stacked along the first axis
+# and computing every row at once. They agree with the single versions to floating point precision.
+
+def _stack(*columns):
+  return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+
+def _unstack(v):
+  return np.moveaxis(np.asarray(v), -1, 0)
+
+
+def _dot(u, v):
+  return np.sum(u * v, axis=-1)
+
+
+def _matvec(mat, v):
+  return np.einsum('...ij,...j->...i', mat, v)
+
+
+def geodetic2ecef_batch(g):
+  """
+  Convert an array of geodetic coordinates (latitude, longitude, altitude) to ECEF.
+  """
+  g = np.asarray(g)
+  if g.shape[-1:] != (3,):
+    raise ValueError("Geodetic must be size 3")
+
+  lat, lon, alt = _unstack(g)
+  lat = np.radians(lat)
+  lon = np.radians(lon)
+  xi = np.sqrt(1.0 - esq * np.sin(lat)**2)
+  x = (a / xi + alt) * np.cos(lat) * np.cos(lon)
+  y = (a / xi + alt) * np.cos(lat) * np.sin(lon)
+  z = (a / xi * (1.0 - esq) + alt) * np.sin(lat)
+  return _stack(x, y, z)
+
+
+def ecef2geodetic_batch(e):
+  """
+  Convert an array of ECEF positions to geodetic coordinates using Ferrari's solution.
+  """
+  x, y, z = _unstack(e)
+  r = np.sqrt(x**2 + y**2)
+  Esq = a**2 - b**2
+  F = 54 * b**2 * z**2
+  G = r**2 + (1 - esq) * z**2 - esq * Esq
+  C = (esq**2 * F * r**2) / (G**3)
+  S = np.cbrt(1 + C + np.sqrt(C**2 + 2 * C))
+  P = F / (3 * (S + 1 / S + 1)**2 * G**2)
+  Q = np.sqrt(1 + 2 * esq**2 * P)
+  r_0 = -(P * esq * r) / (1 + Q) + np.sqrt(0.5 * a**2 * (1 + 1.0 / Q) - P * (1 - esq) * z**2 / (Q * (1 + Q)) - 0.5 * P * r**2)
+  U = np.sqrt((r - esq * r_0)**2 + z**2)
+  V = np.sqrt((r - esq * r_0)**2 + (1 - esq) * z**2)
+  Z_0 = b**2 * z / (a * V)
+  h = U * (1 - b**2 / (a * V))
+  lat = np.arctan((z + e1sq * Z_0) / r)
+  lon = np.arctan2(y, x)
+  return _stack(np.degrees(lat), np.degrees(lon), h)
+
+
+def _positive_w(q):
+  return np.where(q[..., :1] < 0, -q, q)
+
+
+def euler2quat_batch(eulers):
+  """
+  Convert an array of Euler angles (roll, pitch, yaw) to quaternions.
+  """
+  phi, theta, psi = _unstack(eulers)
+
+  c_phi, s_phi = np.cos(phi / 2), np.sin(phi / 2)
+  c_theta, s_theta = np.cos(theta / 2), np.sin(theta / 2)
+  c_psi, s_psi = np.cos(psi / 2), np.sin(psi / 2)
+
+  w = c_phi * c_theta * c_psi + s_phi * s_theta * s_psi
+  x = s_phi * c_theta * c_psi - c_phi * s_theta * s_psi
+  y = c_phi * s_theta * c_psi + s_phi * c_theta * s_psi
+  z = c_phi * c_theta * s_psi - s_phi * s_theta * c_psi
+  return _positive_w(_stack(w, x, y, z))
+
+
+def quat2euler_batch(quats):
+  """
+  Convert an array of quaternions to Euler angles (roll, pitch, yaw).
+  """
+  w, x, y, z = _unstack(quats)
+  gamma = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x**2 + y**2))
+  sin_arg = np.clip(2 * (w * y - z * x), -1.0, 1.0)
+  theta = np.arcsin(sin_arg)
+  psi = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y**2 + z**2))
+  return _stack(gamma, theta, psi)
+
+
+def quat2rot_batch(quats):
+  """
+  Convert an array of quaternions to 3x3 rotation matrices.
+  """
+  w, x, y, z = _unstack(quats)
+  xx, yy, zz = x * x, y * y, z * z
+  xy, xz, yz = x * y, x * z, y * z
+  wx, wy, wz = w * x, w * y, w * z
+
+  return np.stack([
+    _stack(1 - 2 * (yy + zz), 2 * (xy - wz), 2 * (xz + wy)),
+    _stack(2 * (xy + wz), 1 - 2 * (xx + zz), 2 * (yz - wx)),
+    _stack(2 * (xz - wy), 2 * (yz + wx), 1 - 2 * (xx + yy)),
+  ], axis=-2)
+
+
+def rot2quat_batch(rots):
+  """
+  Convert an array of 3x3 rotation matrices to quaternions, picking the same
+  numerically stable branch as rot2quat_single for each matrix.
+  """
+  rots = np.asarray(rots)
+  r = {(i, j): rots[..., i, j] for i in range(3) for j in range(3)}
+  trace = r[0, 0] + r[1, 1] + r[2, 2]
+
+  branches = [trace > 0]
+  branches.append(~branches[0] & (r[0, 0] > r[1, 1]) & (r[0, 0] > r[2, 2]))
+  branches.append(~branches[0] & ~branches[1] & (r[1, 1] > r[2, 2]))
+  branches.append(~branches[0] & ~branches[1] & ~branches[2])
+
+  q = np.zeros(trace.shape + (4,))
+  m = branches[0]
+  s = 0.5 / np.sqrt(trace[m] + 1.0)
+  q[m] = _stack(0.25 / s, (r[2, 1][m] - r[1, 2][m]) * s, (r[0, 2][m] - r[2, 0][m]) * s, (r[1, 0][m] - r[0, 1][m]) * s)
+  m = branches[1]
+  s = 2.0 * np.sqrt(1.0 + r[0, 0][m] - r[1, 1][m] - r[2, 2][m])
+  q[m] = _stack((r[2, 1][m] - r[1, 2][m]) / s, 0.25 * s, (r[0, 1][m] + r[1, 0][m]) / s, (r[0, 2][m] + r[2, 0][m]) / s)
+  m = branches[2]
+  s = 2.0 * np.sqrt(1.0 + r[1, 1][m] - r[0, 0][m] - r[2, 2][m])
+  q[m] = _stack((r[0, 2][m] - r[2, 0][m]) / s, (r[0, 1][m] + r[1, 0][m]) / s, 0.25 * s, (r[1, 2][m] + r[2, 1][m]) / s)
+  m = branches[3]
+  s = 2.0 * np.sqrt(1.0 + r[2, 2][m] - r[0, 0][m] - r[1, 1][m])
+  q[m] = _stack((r[1, 0][m] - r[0, 1][m]) / s, (r[0, 2][m] + r[2, 0][m]) / s, (r[1, 2][m] + r[2, 1][m]) / s, 0.25 * s)
+  return _positive_w(q)
+
+
+def euler2rot_batch(eulers):
+  """
+  Convert an array of Euler angles (roll, pitch, yaw) to 3x3 rotation matrices.
+  """
+  phi, theta, psi = _unstack(eulers)
+
+  cx, sx = np.cos(phi), np.sin(phi)
+  cy, sy = np.cos(theta), np.sin(theta)
+  cz, sz = np.cos(psi), np.sin(psi)
+  zero, one = np.zeros_like(cx), np.ones_like(cx)
+
+  Rx = np.stack([_stack(one, zero, zero), _stack(zero, cx, -sx), _stack(zero, sx, cx)], axis=-2)
+  Ry = np.stack([_stack(cy, zero, sy), _stack(zero, one, zero), _stack(-sy, zero, cy)], axis=-2)
+  Rz = np.stack([_stack(cz, -sz, zero), _stack(sz, cz, zero), _stack(zero, zero, one)], axis=-2)
+
+  return Rz @ Ry @ Rx
+
+
+def rot2euler_batch(rots):
+  """
+  Convert an array of 3x3 rotation matrices to Euler angles (roll, pitch, yaw).
+  """
+  return quat2euler_batch(rot2quat_batch(rots))
+
+
+def axis_angle_to_rot_batch(axes, angles):
+  """
+  Convert arrays of axes and angles to 3x3 rotation matrices.
+  """
+  c = np.cos(angles / 2)
+  s = np.sin(angles / 2)
+  axes = np.asarray(axes)
+  return quat2rot_batch(_stack(c, s * axes[..., 0], s * axes[..., 1], s * axes[..., 2]))
+
+
+def _ned2ecef_matrix_batch(ecef):
+  lat, lon, _ = _unstack(ecef2geodetic_batch(ecef))
+  lat = np.radians(lat)
+  lon = np.radians(lon)
+  zero = np.zeros_like(lat)
+  return np.stack([
+    _stack(-np.sin(lat) * np.cos(lon), -np.sin(lon), -np.cos(lat) * np.cos(lon)),
+    _stack(-np.sin(lat) * np.sin(lon), np.cos(lon), -np.cos(lat) * np.sin(lon)),
+    _stack(np.cos(lat), zero, -np.sin(lat)),
+  ], axis=-2)
+
+
+def _euler_in_frame(from_axes, to_axes, euler):
+  """
+  Euler angles (roll, pitch, yaw) relative to the from_axes frame, relative to the to_axes frame instead.
+  The axes are the x, y and z unit vectors of each frame, in a common frame.
+  """
+  x0, y0, z0 = from_axes
+  phi, theta, psi = _unstack(euler)
+
+  rot = axis_angle_to_rot_batch(z0, psi)
+  x1, y1 = _matvec(rot, x0), _matvec(rot, y0)
+
+  rot = axis_angle_to_rot_batch(y1, theta)
+  x2, y2 = _matvec(rot, x1), _matvec(rot, y1)
+
+  rot = axis_angle_to_rot_batch(x2, phi)
+  x3, y3 = _matvec(rot, x2), _matvec(rot, y2)
+
+  x0, y0, z0 = to_axes
+  psi_out = np.arctan2(_dot(x3, y0), _dot(x3, x0))
+  theta_out = np.arctan2(-_dot(x3, z0), np.sqrt(_dot(x3, x0)**2 + _dot(x3, y0)**2))
+
+  y2 = _matvec(axis_angle_to_rot_batch(z0, psi_out), y0)
+  z2 = _matvec(axis_angle_to_rot_batch(y2, theta_out), z0)
+
+  phi_out = np.arctan2(_dot(y3, z2), _dot(y3, y2))
+  return _stack(phi_out, theta_out, psi_out)
+
+
+def ecef_euler_from_ned_batch(ecef_init, ned_poses):
+  """
+  Convert arrays of NED Euler angles (roll, pitch, yaw) at ECEF origins
+  to equivalent ECEF Euler angles. ecef_init is one origin per pose, or a single one for all of them.
+  """
+  return _euler_in_frame(_unstack(_ned2ecef_matrix_batch(ecef_init)), _unstack(np.eye(3)), ned_poses)
+
+
+def ned_euler_from_ecef_batch(ecef_init, ecef_poses):
+  """
+  Convert arrays of ECEF Euler angles (roll, pitch, yaw) at ECEF origins
+  to equivalent NED Euler angles. ecef_init is one origin per pose, or a single one for all of them.
+  """
+  return _euler_in_frame(_unstack(np.eye(3)), _unstack(_ned2ecef_matrix_batch(ecef_init)), ecef_poses)
@@ -1,10 +1,10 @@
-import io
 import os
 import tempfile
 import contextlib
 import subprocess
 import time
 import functools
+from typing import BinaryIO
 from subprocess import Popen, PIPE, TimeoutExpired
 import zstandard as zstd
 
@@ -114,21 +114,26 @@ def atomic_write(path: str, mode: str = 'w', buffering: int = -1, encoding: str
   os.replace(tmp_file_name, path)
 
 
-def get_upload_stream(filepath: str, should_compress: bool) -> tuple[io.BufferedIOBase, int]:
+def get_upload_stream(filepath: str, should_compress: bool) -> tuple[BinaryIO, int]:
+  """
+  Returns a stream of the file's contents, zstd compressed if requested, and its length.
+  The file is compressed once into an unnamed temporary file next to it, so memory use doesn't grow with
+  the file, and the length is known up front for the Content-Length presigned upload URLs need.
+  """
   if not should_compress:
-    file_size = os.path.getsize(filepath)
-    file_stream = open(filepath, "rb")
-    return file_stream, file_size
-
-  # Compress the file on the fly
-  compressed_stream = io.BytesIO()
-  compressor = zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL)
-
-  with open(filepath, "rb") as f:
-    compressor.copy_stream(f, compressed_stream)
-    compressed_size = compressed_stream.tell()
-    compressed_stream.seek(0)
-    return compressed_stream, compressed_size
+    return open(filepath, "rb"), os.path.getsize(filepath)
+
+  # no directory entry, so the uploader and athena never list it
+  compressed = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filepath)))
+  try:
+    with open(filepath, "rb") as f:
+      zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL).copy_stream(f, compressed)
+    compressed_size = compressed.tell()
+    compressed.seek(0)
+  except BaseException:
+    compressed.close()
+    raise
+  return compressed, compressed_size
 
 
 # remove all keys that end in DEPRECATED
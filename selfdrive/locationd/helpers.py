@@ -52,19 +52,40 @@ def rotate_std(rot_matrix, std_in):
 
 
 class NPQueue:
+  """
+  Fixed size queue of rows, oldest first. Every row is written to a ring buffer and to a mirror
+  right after it, so the queue is always available as one contiguous view without shifting rows.
+  The second moments of the rows (arr.T @ arr) are kept up to date as rows are added and evicted,
+  and recomputed exactly each time the ring wraps around so rounding errors don't build up.
+  """
   def __init__(self, maxlen: int, rowsize: int) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((2 * maxlen, rowsize))
+    self.start = 0
+    self.size = 0
+    self.moments = np.zeros((rowsize, rowsize))
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.size
+
+  @property
+  def arr(self) -> np.ndarray:
+    return self.buf[self.start:self.start + self.size]
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    if self.size < self.maxlen:
+      idx = self.size
+      self.size += 1
+    else:
+      idx = self.start
+      self.start = (self.start + 1) % self.maxlen
+      self.moments -= np.outer(self.buf[idx], self.buf[idx])
+    self.buf[idx] = pt
+    self.buf[idx + self.maxlen] = self.buf[idx]
+    if idx == self.maxlen - 1:
+      self.moments = self.arr.T @ self.arr
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.moments += np.outer(self.buf[idx], self.buf[idx])
 
 
 class PointBuckets:
@@ -95,11 +116,15 @@ class PointBuckets:
     raise NotImplementedError
 
   def get_points(self, num_points: int | None = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
+    points = np.concatenate([x.arr for x in self.buckets.values()])
     if num_points is None:
       return points
     return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
 
+  def get_moments(self) -> np.ndarray:
+    """Second moments of all points, arr.T @ arr over every bucket"""
+    return np.sum([x.moments for x in self.buckets.values()], axis=0)
+
   def load_points(self, points: list[list[float]]) -> None:
     for point in points:
       self.add_point(*point)
@@ -2,7 +2,6 @@
 import os
 import numpy as np
 import capnp
-from collections import deque
 from functools import partial
 
 import cereal.messaging as messaging
@@ -41,41 +40,46 @@ def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np
   """
 
   eps = np.finfo(np.float64).eps
-  expected_sig = np.asarray(expected_sig, dtype=np.float64)
-  actual_sig = np.asarray(actual_sig, dtype=np.float64)
-
-  expected_sig[~mask] = 0.0
-  actual_sig[~mask] = 0.0
+  mask = np.asarray(mask, dtype=bool)
+  expected_sig = np.where(mask, expected_sig, 0.0)
+  actual_sig = np.where(mask, actual_sig, 0.0)
 
   rotated_expected_sig = expected_sig[::-1]
   rotated_mask = mask[::-1]
 
-  fft = partial(np.fft.fft, n=n)
+  # all signals are real, so half spectra are enough
+  fft = partial(np.fft.rfft, n=n)
+  ifft = partial(np.fft.irfft, n=n)
 
   actual_sig_fft = fft(actual_sig)
   rotated_expected_sig_fft = fft(rotated_expected_sig)
   actual_mask_fft = fft(mask.astype(np.float64))
   rotated_mask_fft = fft(rotated_mask.astype(np.float64))
 
-  number_overlap_masked_samples = np.fft.ifft(rotated_mask_fft * actual_mask_fft).real
+  number_overlap_masked_samples = ifft(rotated_mask_fft * actual_mask_fft)
   number_overlap_masked_samples[:] = np.round(number_overlap_masked_samples)
   number_overlap_masked_samples[:] = np.fmax(number_overlap_masked_samples, eps)
-  masked_correlated_actual_fft = np.fft.ifft(rotated_mask_fft * actual_sig_fft).real
-  masked_correlated_expected_fft = np.fft.ifft(actual_mask_fft * rotated_expected_sig_fft).real
+  masked_correlated_actual_fft = ifft(rotated_mask_fft * actual_sig_fft)
+  masked_correlated_expected_fft = ifft(actual_mask_fft * rotated_expected_sig_fft)
 
-  numerator = np.fft.ifft(rotated_expected_sig_fft * actual_sig_fft).real
+  numerator = ifft(rotated_expected_sig_fft * actual_sig_fft)
   numerator -= masked_correlated_actual_fft * masked_correlated_expected_fft / number_overlap_masked_samples
 
   actual_squared_fft = fft(actual_sig ** 2)
-  actual_sig_denom = np.fft.ifft(rotated_mask_fft * actual_squared_fft).real
+  actual_sig_denom = ifft(rotated_mask_fft * actual_squared_fft)
   actual_sig_denom -= masked_correlated_actual_fft ** 2 / number_overlap_masked_samples
   actual_sig_denom[:] = np.fmax(actual_sig_denom, 0.0)
 
   rotated_expected_squared_fft = fft(rotated_expected_sig ** 2)
-  expected_sig_denom = np.fft.ifft(actual_mask_fft * rotated_expected_squared_fft).real
+  expected_sig_denom = ifft(actual_mask_fft * rotated_expected_squared_fft)
   expected_sig_denom -= masked_correlated_expected_fft ** 2 / number_overlap_masked_samples
   expected_sig_denom[:] = np.fmax(expected_sig_denom, 0.0)
 
+  return normalized_correlation(numerator, actual_sig_denom, expected_sig_denom)
+
+
+def normalized_correlation(numerator: np.ndarray, actual_sig_denom: np.ndarray, expected_sig_denom: np.ndarray) -> np.ndarray:
+  eps = np.finfo(np.float64).eps
   denom = np.sqrt(actual_sig_denom * expected_sig_denom)
 
   # zero-out samples with very small denominators
@@ -89,29 +93,99 @@ def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np
   return ncc
 
 
+class SlidingMaskedCorrelation:
+  """
+  masked_normalized_cross_correlation of a sliding window of samples, for a fixed range of lags.
+  A lag k pairs actual[i + k] with expected[i]. Instead of transforming the whole window on every
+  estimate, the sums behind the correlation are updated as samples enter and leave the window,
+  and recomputed from the window each time it has been fully replaced, so rounding errors don't build up.
+  """
+  # per sample rows: mask, actual, actual ** 2, expected, expected ** 2, zeroed where masked out
+  # the sums are of products of an actual side row and an expected side row:
+  # overlap count, actual, expected, actual * expected, actual ** 2, expected ** 2
+  ACTUAL_ROWS = np.array([0, 1, 0, 1, 2, 0])
+  EXPECTED_ROWS = np.array([0, 0, 3, 3, 0, 4])
+
+  def __init__(self, num_points: int, lags: np.ndarray):
+    assert np.all(np.abs(lags) < num_points)
+    self.num_points = num_points
+    self.lags = np.asarray(lags)
+    # mirrored ring buffer, so the window is always buf[:, start:start + num_points]
+    self.buf = np.zeros((5, 2 * num_points))
+    self.start = 0
+    self.sums = np.zeros((len(self.ACTUAL_ROWS), len(self.lags)))
+
+    # flat buffer indices of the pairs with the newest and the oldest sample, relative to the window start
+    def flat_idx(rows, idx):
+      return rows[:, None] * self.buf.shape[1] + idx
+    self.new_idx = (flat_idx(self.ACTUAL_ROWS, num_points - 1 + np.minimum(self.lags, 0)),
+                    flat_idx(self.EXPECTED_ROWS, num_points - 1 - np.maximum(self.lags, 0)))
+    self.old_idx = (flat_idx(self.ACTUAL_ROWS, np.maximum(self.lags, 0)), flat_idx(self.EXPECTED_ROWS, np.maximum(-self.lags, 0)))
+
+  def _pairs(self, actual_idx: np.ndarray, expected_idx: np.ndarray) -> np.ndarray:
+    window = self.buf.reshape(-1)[self.start:]
+    return window.take(actual_idx) * window.take(expected_idx)
+
+  def recompute(self) -> None:
+    window = self.buf[:, self.start:self.start + self.num_points]
+    actual, expected = window[self.ACTUAL_ROWS], window[self.EXPECTED_ROWS]
+    n = self.num_points
+    for j, k in enumerate(self.lags):
+      if k >= 0:
+        self.sums[:, j] = np.sum(actual[:, k:] * expected[:, :n - k], axis=1)
+      else:
+        self.sums[:, j] = np.sum(actual[:, :n + k] * expected[:, -k:], axis=1)
+
+  def update(self, expected: float, actual: float, okay: bool) -> None:
+    self.sums -= self._pairs(*self.old_idx)
+
+    idx = self.start
+    self.start = (self.start + 1) % self.num_points
+    self.buf[:, idx] = (1.0, actual, actual ** 2, expected, expected ** 2) if okay else 0.0
+    self.buf[:, idx + self.num_points] = self.buf[:, idx]
+
+    if self.start == 0:
+      self.recompute()
+    else:
+      self.sums += self._pairs(*self.new_idx)
+
+  def get(self) -> np.ndarray:
+    """Normalized cross correlation for each lag"""
+    count, actual_sum, expected_sum, product_sum, actual_sq_sum, expected_sq_sum = self.sums
+    count = np.fmax(np.round(count), np.finfo(np.float64).eps)
+    numerator = product_sum - actual_sum * expected_sum / count
+    actual_sig_denom = np.fmax(actual_sq_sum - actual_sum ** 2 / count, 0.0)
+    expected_sig_denom = np.fmax(expected_sq_sum - expected_sum ** 2 / count, 0.0)
+    return normalized_correlation(numerator, actual_sig_denom, expected_sig_denom)
+
+
 class Points:
+  """The last num_points samples, oldest first, in mirrored ring buffers so each signal is a contiguous view"""
   def __init__(self, num_points: int):
-    self.times = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.okay = deque[bool]([False] * num_points, maxlen=num_points)
-    self.desired = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.actual = deque[float]([0.0] * num_points, maxlen=num_points)
+    self.buf = np.zeros((4, 2 * num_points))
+    self.start = 0
+    self.okay_count = 0
+    self._num_points = num_points
 
   @property
   def num_points(self):
-    return len(self.desired)
+    return self._num_points
 
   @property
   def num_okay(self):
-    return np.count_nonzero(self.okay)
+    return self.okay_count
 
   def update(self, t: float, desired: float, actual: float, okay: bool):
-    self.times.append(t)
-    self.okay.append(okay)
-    self.desired.append(desired)
-    self.actual.append(actual)
+    idx = self.start
+    self.start = (self.start + 1) % self._num_points
+    self.okay_count += bool(okay) - bool(self.buf[3, idx])
+    self.buf[:, idx] = (t, desired, actual, okay)
+    self.buf[:, idx + self._num_points] = self.buf[:, idx]
 
   def get(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    return np.array(self.times), np.array(self.desired), np.array(self.actual), np.array(self.okay)
+    """Views of the window, valid until the next update"""
+    window = self.buf[:, self.start:self.start + self._num_points]
+    return window[0], window[1], window[2], window[3].astype(bool)
 
 
 class BlockAverage:
@@ -196,6 +270,9 @@ class LateralLagEstimator:
   def reset(self, initial_lag: float, valid_blocks: int):
     window_len = int(self.window_sec / self.dt)
     self.points = Points(window_len)
+    # lags from 0 to MAX_LAG, with a border around them for the confidence
+    lags = np.arange(-CORR_BORDER_OFFSET, int(MAX_LAG / self.dt) + CORR_BORDER_OFFSET)
+    self.correlation = SlidingMaskedCorrelation(window_len, lags)
     self.block_avg = BlockAverage(self.block_count, self.block_size, valid_blocks, initial_lag)
 
   def get_msg(self, valid: bool, debug: bool = False) -> capnp._DynamicStructBuilder:
@@ -286,19 +363,20 @@ class LateralLagEstimator:
            fast and turning and has_recovered and calib_valid and sensors_valid and la_valid
 
     self.points.update(self.t, la_desired, la_actual_pose, okay)
+    self.correlation.update(la_desired, la_actual_pose, okay)
 
   def update_estimate(self):
     if not self.points_enough():
       return
 
-    times, desired, actual, okay = self.points.get()
+    times, _, _, okay = self.points.get()
     # check if there are any new valid data points since the last update
     is_valid = self.points_valid()
     if self.last_estimate_t != 0 and times[0] <= self.last_estimate_t:
-      new_values_start_idx = next(-i for i, t in enumerate(reversed(times)) if t <= self.last_estimate_t)
+      new_values_start_idx = np.searchsorted(times, self.last_estimate_t, side='right') - len(times)
       is_valid = is_valid and not (new_values_start_idx == 0 or not np.any(okay[new_values_start_idx:]))
 
-    delay, corr, confidence = self.actuator_delay(desired, actual, okay, self.dt, MAX_LAG)
+    delay, corr, confidence = self.delay_from_correlation(self.correlation.get(), self.dt)
     if corr < self.min_ncc or confidence < self.min_confidence or not is_valid:
       return
 
@@ -314,10 +392,13 @@ class LateralLagEstimator:
     ncc = masked_normalized_cross_correlation(expected_sig, actual_sig, mask, padded_size)
 
     # only consider lags from 0 to max_lag
-    roi = np.s_[len(expected_sig) - 1: len(expected_sig) - 1 + max_lag_samples]
-    extended_roi = np.s_[roi.start - CORR_BORDER_OFFSET: roi.stop + CORR_BORDER_OFFSET]
-    roi_ncc = ncc[roi]
-    extended_roi_ncc = ncc[extended_roi]
+    extended_roi_start = len(expected_sig) - 1 - CORR_BORDER_OFFSET
+    return LateralLagEstimator.delay_from_correlation(ncc[extended_roi_start:extended_roi_start + max_lag_samples + 2 * CORR_BORDER_OFFSET], dt)
+
+  @staticmethod
+  def delay_from_correlation(extended_roi_ncc: np.ndarray, dt: float) -> tuple[float, float, float]:
+    """Delay, correlation and confidence from the correlation at lags 0 to max_lag, with CORR_BORDER_OFFSET lags on either side"""
+    roi_ncc = extended_roi_ncc[CORR_BORDER_OFFSET:-CORR_BORDER_OFFSET]
 
     max_corr_index = np.argmax(roi_ncc)
     corr = roi_ncc[max_corr_index]
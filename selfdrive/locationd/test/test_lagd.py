@@ -4,8 +4,8 @@ import time
 import pytest
 
 from cereal import messaging, log, car
-from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, retrieve_initial_lag, masked_normalized_cross_correlation, \
-                                               BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
+from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, SlidingMaskedCorrelation, retrieve_initial_lag, \
+                                               masked_normalized_cross_correlation, BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
 from openpilot.selfdrive.test.process_replay.migration import migrate, migrate_carParams
 from openpilot.selfdrive.locationd.test.test_locationd_scenarios import TEST_ROUTE
 from openpilot.common.params import Params
@@ -86,6 +86,22 @@ class TestLagd:
     corr = masked_normalized_cross_correlation(desired_sig, actual_sig, mask, 200)[len(desired_sig) - 1:len(desired_sig) + 20]
     assert np.argmax(corr) in range(lag_frames - MAX_ERR_FRAMES, lag_frames + MAX_ERR_FRAMES + 1)
 
+  def test_sliding_ncc(self):
+    n, lags = 200, np.arange(-5, 25)
+    desired_sig = np.sin(np.arange(0.0, 50.0, 0.1)) + np.random.normal(0, 0.05, 500)
+    actual_sig = np.roll(desired_sig, 7) + np.random.normal(0, 0.05, 500)
+    mask = np.random.choice([True, False], size=500, p=[0.6, 0.4])
+
+    # updated sums match a full correlation of the window, before and after it wraps around
+    correlation = SlidingMaskedCorrelation(n, lags)
+    for i in range(500):
+      correlation.update(desired_sig[i], actual_sig[i], mask[i])
+      if i % 37 == 0 or i == 499:
+        window = np.s_[max(i + 1 - n, 0):i + 1]
+        expected, actual, okay = (np.pad(sig[window], (n - len(sig[window]), 0)) for sig in (desired_sig, actual_sig, mask))
+        corr = masked_normalized_cross_correlation(expected, actual, okay, 256)[n - 1 + lags]
+        np.testing.assert_allclose(correlation.get(), corr, atol=1e-9)
+
   def test_empty_estimator(self):
     mocked_CP = car.CarParams(steerActuatorDelay=0.8)
     estimator = LateralLagEstimator(mocked_CP, DT)
@@ -1,5 +1,7 @@
+import numpy as np
+
 from cereal import car
-from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+from openpilot.selfdrive.locationd.torqued import FRICTION_FACTOR, POINTS_PER_BUCKET, STEER_BUCKET_BOUNDS, TorqueEstimator, slope2rot
 
 
 def test_cal_percent():
@@ -23,3 +25,64 @@ def test_cal_percent():
 
   msg = est.get_msg()
   assert msg.liveTorqueParameters.calPerc == 100
+
+
+def test_points_order():
+  est = TorqueEstimator(car.CarParams())
+  points = []
+  for i in range(3 * POINTS_PER_BUCKET):
+    # most points go to one bucket, so it wraps around a few times
+    steer = 0.0625 if i % 4 else -0.375
+    est.filtered_points.add_point(steer, i)
+    points.append([steer, 1.0, i])
+
+  expected = []
+  for low, high in STEER_BUCKET_BOUNDS:
+    expected += [p for p in points if low <= p[0] < high][-POINTS_PER_BUCKET:]
+  assert est.filtered_points.get_points().tolist() == expected
+
+  # points are restored in the same order
+  msg = est.get_msg(with_points=True)
+  restored = TorqueEstimator(car.CarParams())
+  restored.filtered_points.load_points(msg.liveTorqueParameters.points)
+  assert restored.filtered_points.get_points().tolist() == expected
+
+
+def test_estimate_params():
+  est = TorqueEstimator(car.CarParams())
+  rng = np.random.default_rng(0)
+  for i in range(12 * POINTS_PER_BUCKET):
+    steer = rng.uniform(-0.5, 0.5)
+    est.filtered_points.add_point(steer, 2.5 * steer + 0.1 + rng.normal(0, 0.2))
+
+    if i % 5000 == 4999 or i == 12 * POINTS_PER_BUCKET - 1:
+      # same as a total least squares fit with an SVD over all points
+      points = est.filtered_points.get_points()
+      _, _, v = np.linalg.svd(points, full_matrices=False)
+      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
+      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
+      np.testing.assert_allclose(est.filtered_points.get_moments(), points.T @ points, rtol=1e-9)
+      np.testing.assert_allclose(est.estimate_params(), [slope, offset, np.std(spread) * FRICTION_FACTOR], rtol=1e-9)
+
+
+def test_estimate_params_matches_sampled_fit():
+  # the previous estimator fit 2000 randomly sampled points, so its estimates scatter around the fit over all of them
+  est = TorqueEstimator(car.CarParams())
+  rng = np.random.default_rng(1)
+  for i in range(12 * POINTS_PER_BUCKET):
+    steer = 0.48 * np.sin(0.05 * i) * rng.uniform(0.5, 1)
+    est.filtered_points.add_point(steer, 2.3 * steer + 0.05 + 0.12 * np.sign(np.cos(0.05 * i)) + rng.normal(0, 0.15))
+
+  sampled = []
+  np.random.seed(0)
+  for _ in range(50):
+    points = est.filtered_points.get_points(2000)
+    _, _, v = np.linalg.svd(points, full_matrices=False)
+    slope, offset = -v.T[0:2, 2] / v.T[2, 2]
+    _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
+    sampled.append([slope, offset, np.std(spread) * FRICTION_FACTOR])
+  sampled = np.array(sampled)
+
+  estimate = np.array(est.estimate_params())
+  assert np.all(np.abs(estimate - sampled.mean(axis=0)) < 2 * sampled.std(axis=0))
+  assert est.estimate_params() == tuple(estimate)
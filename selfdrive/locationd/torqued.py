@@ -16,8 +16,6 @@ HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
 MIN_POINTS_TOTAL = 4000
 MIN_POINTS_TOTAL_QLOG = 600
-FIT_POINTS_TOTAL = 2000
-FIT_POINTS_TOTAL_QLOG = 600
 MIN_VEL = 15  # m/s
 FRICTION_FACTOR = 1.5  # ~85% of data coverage
 FACTOR_SANITY = 0.3
@@ -58,14 +56,12 @@ class TorqueEstimator(ParameterEstimator):
     if decimated:
       self.min_bucket_points = MIN_BUCKET_POINTS / 10
       self.min_points_total = MIN_POINTS_TOTAL_QLOG
-      self.fit_points = FIT_POINTS_TOTAL_QLOG
       self.factor_sanity = FACTOR_SANITY_QLOG
       self.friction_sanity = FRICTION_SANITY_QLOG
 
     else:
       self.min_bucket_points = MIN_BUCKET_POINTS
       self.min_points_total = MIN_POINTS_TOTAL
-      self.fit_points = FIT_POINTS_TOTAL
       self.factor_sanity = FACTOR_SANITY
       self.friction_sanity = FRICTION_SANITY
 
@@ -143,14 +139,20 @@ class TorqueEstimator(ParameterEstimator):
     self.all_torque_points = []
 
   def estimate_params(self):
-    points = self.filtered_points.get_points(self.fit_points)
+    # second moments of the [x, 1, y] points, kept up to date by the buckets
+    moments = self.filtered_points.get_moments()
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
-      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
-      friction_coeff = np.std(spread) * FRICTION_FACTOR
+      # the eigenvector with the smallest eigenvalue is the last right singular vector of the points
+      _, v = np.linalg.eigh(moments)
+      slope, offset = -v[0:2, 0] / v[2, 0]
+      # spread of the points across the fitted line, from the moments of x and y
+      n = moments[1, 1]
+      mean = moments[[0, 2], 1] / n
+      cov = moments[np.ix_([0, 2], [0, 2])] / n - np.outer(mean, mean)
+      spread_dir = slope2rot(slope)[:, 1]
+      friction_coeff = np.sqrt(max(spread_dir @ cov @ spread_dir, 0.)) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
       cloudlog.exception(f"Error computing live torque params: {e}")
       slope = offset = friction_coeff = np.nan
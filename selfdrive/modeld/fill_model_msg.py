@@ -1,5 +1,6 @@
 import os
 import capnp
+from functools import cache
 import numpy as np
 from cereal import log
 from openpilot.selfdrive.modeld.constants import ModelConstants, Plan, Meta
@@ -8,6 +9,11 @@ SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
 
 ConfidenceClass = log.ModelDataV2.ConfidenceClass
 
+# disengagePredictions fields in the order of the Meta slices
+DISENGAGE_PROB_FIELDS = ('gasDisengageProbs', 'brakeDisengageProbs', 'steerOverrideProbs', 'brake3MetersPerSecondSquaredProbs',
+                         'brake4MetersPerSecondSquaredProbs', 'brake5MetersPerSecondSquaredProbs')
+PRESS_PROB_FIELDS = ('gasPressProbs', 'brakePressProbs')
+
 
 class PublishState:
   def __init__(self):
@@ -15,39 +21,32 @@ class PublishState:
     self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
     self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
 
-def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
+def fill_lists(builder, names, values: np.ndarray) -> None:
+  """Sets a float list field from each row of values, converting the whole array to lists at once"""
+  for name, row in zip(names, values.tolist(), strict=True):
+    setattr(builder, name, row)
+
+def fill_xyzt(builder, t, xyz, xyz_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.z = z.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if z_std is not None:
-    builder.zStd = z_std.tolist()
-
-def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std=None):
+  fill_lists(builder, ('x', 'y', 'z'), xyz.T)
+  if xyz_std is not None:
+    fill_lists(builder, ('xStd', 'yStd', 'zStd'), xyz_std.T)
+
+def fill_xyvat(builder, t, xyva, xyva_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.v = v.tolist()
-  builder.a = a.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if v_std is not None:
-    builder.vStd = v_std.tolist()
-  if a_std is not None:
-    builder.aStd = a_std.tolist()
+  fill_lists(builder, ('x', 'y', 'v', 'a'), xyva.T)
+  if xyva_std is not None:
+    fill_lists(builder, ('xStd', 'yStd', 'vStd', 'aStd'), xyva_std.T)
+
+@cache
+def poly_fit_matrix(degree: int) -> np.ndarray:
+  """Least squares fit of polynomial coefficients to values at T_IDXS, as one matrix"""
+  return np.linalg.pinv(np.polynomial.polynomial.polyvander(ModelConstants.T_IDXS, degree))
 
 def fill_xyz_poly(builder, degree, x, y, z):
   xyz = np.stack([x, y, z], axis=1)
-  coeffs = np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, xyz, deg=degree)
-  builder.xCoefficients = coeffs[:, 0].tolist()
-  builder.yCoefficients = coeffs[:, 1].tolist()
-  builder.zCoefficients = coeffs[:, 2].tolist()
+  coeffs = poly_fit_matrix(degree) @ xyz
+  fill_lists(builder, ('xCoefficients', 'yCoefficients', 'zCoefficients'), coeffs.T)
 
 def fill_lane_line_meta(builder, lane_lines, lane_line_probs):
   builder.leftY = lane_lines[1].y[0]
@@ -83,11 +82,11 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   modelV2.modelExecutionTime = model_execution_time
 
   # plan
-  fill_xyzt(modelV2.position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
-  fill_xyzt(modelV2.velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
-  fill_xyzt(modelV2.acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
-  fill_xyzt(modelV2.orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
-  fill_xyzt(modelV2.orientationRate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+  fill_xyzt(modelV2.position, ModelConstants.T_IDXS, net_output_data['plan'][0,:,Plan.POSITION], net_output_data['plan_stds'][0,:,Plan.POSITION])
+  fill_xyzt(modelV2.velocity, ModelConstants.T_IDXS, net_output_data['plan'][0,:,Plan.VELOCITY])
+  fill_xyzt(modelV2.acceleration, ModelConstants.T_IDXS, net_output_data['plan'][0,:,Plan.ACCELERATION])
+  fill_xyzt(modelV2.orientation, ModelConstants.T_IDXS, net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER])
+  fill_xyzt(modelV2.orientationRate, ModelConstants.T_IDXS, net_output_data['plan'][0,:,Plan.ORIENTATION_RATE])
 
   # poly path
   fill_xyz_poly(driving_model_data.path, ModelConstants.POLY_PATH_DEGREE, *net_output_data['plan'][0,:,Plan.POSITION].T)
@@ -99,28 +98,30 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   LINE_T_IDXS: list[float] = []
 
   # lane lines
-  modelV2.init('laneLines', 4)
-  for i in range(4):
-    lane_line = modelV2.laneLines[i]
-    fill_xyzt(lane_line, LINE_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
+  lane_lines = modelV2.init('laneLines', 4)
+  for lane_line, yz in zip(lane_lines, net_output_data['lane_lines'][0].transpose(0, 2, 1).tolist(), strict=True):
+    lane_line.t = LINE_T_IDXS
+    lane_line.x = ModelConstants.X_IDXS
+    lane_line.y, lane_line.z = yz
   modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
   modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
 
   fill_lane_line_meta(driving_model_data.laneLineMeta, modelV2.laneLines, modelV2.laneLineProbs)
 
   # road edges
-  modelV2.init('roadEdges', 2)
-  for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, LINE_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
+  road_edges = modelV2.init('roadEdges', 2)
+  for road_edge, yz in zip(road_edges, net_output_data['road_edges'][0].transpose(0, 2, 1).tolist(), strict=True):
+    road_edge.t = LINE_T_IDXS
+    road_edge.x = ModelConstants.X_IDXS
+    road_edge.y, road_edge.z = yz
   modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
 
   # leads
-  modelV2.init('leadsV3', 3)
-  for i in range(3):
-    lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
+  leads = modelV2.init('leadsV3', 3)
+  lead_probs = net_output_data['lead_prob'][0].tolist()
+  for i, lead in enumerate(leads):
+    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, net_output_data['lead'][0,i], net_output_data['lead_stds'][0,i])
+    lead.prob = lead_probs[i]
     lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
 
   # meta
@@ -131,14 +132,11 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   meta.init('disengagePredictions')
   disengage_predictions = meta.disengagePredictions
   disengage_predictions.t = ModelConstants.META_T_IDXS
-  disengage_predictions.brakeDisengageProbs = net_output_data['meta'][0,Meta.BRAKE_DISENGAGE].tolist()
-  disengage_predictions.gasDisengageProbs = net_output_data['meta'][0,Meta.GAS_DISENGAGE].tolist()
-  disengage_predictions.steerOverrideProbs = net_output_data['meta'][0,Meta.STEER_OVERRIDE].tolist()
-  disengage_predictions.brake3MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_3].tolist()
-  disengage_predictions.brake4MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_4].tolist()
-  disengage_predictions.brake5MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_5].tolist()
-  disengage_predictions.gasPressProbs = net_output_data['meta'][0,Meta.GAS_PRESS].tolist()
-  disengage_predictions.brakePressProbs = net_output_data['meta'][0,Meta.BRAKE_PRESS].tolist()
+  # the probs of each field are interleaved in meta, so they are the columns of a reshape
+  disengage_probs = net_output_data['meta'][0,Meta.GAS_DISENGAGE.start:Meta.GAS_DISENGAGE.stop].reshape(-1, Meta.GAS_DISENGAGE.step)
+  press_probs = net_output_data['meta'][0,Meta.GAS_PRESS.start:Meta.GAS_PRESS.stop].reshape(-1, Meta.GAS_PRESS.step)
+  fill_lists(disengage_predictions, DISENGAGE_PROB_FIELDS, disengage_probs.T)
+  fill_lists(disengage_predictions, PRESS_PROB_FIELDS, press_probs[:, :len(PRESS_PROB_FIELDS)].T)
 
   publish_state.prev_brake_5ms2_probs[:-1] = publish_state.prev_brake_5ms2_probs[1:]
   publish_state.prev_brake_5ms2_probs[-1] = net_output_data['meta'][0,Meta.HARD_BRAKE_5][0]
@@ -183,11 +181,9 @@ def fill_pose_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str, n
   cameraOdometry.frameId = vipc_frame_id
   cameraOdometry.timestampEof = timestamp_eof
 
-  cameraOdometry.trans = net_output_data['pose'][0,:3].tolist()
-  cameraOdometry.rot = net_output_data['pose'][0,3:].tolist()
+  fill_lists(cameraOdometry, ('trans', 'rot'), net_output_data['pose'][0].reshape(2, 3))
   cameraOdometry.wideFromDeviceEuler = net_output_data['wide_from_device_euler'][0,:].tolist()
   cameraOdometry.roadTransformTrans = net_output_data['road_transform'][0,:3].tolist()
-  cameraOdometry.transStd = net_output_data['pose_stds'][0,:3].tolist()
-  cameraOdometry.rotStd = net_output_data['pose_stds'][0,3:].tolist()
+  fill_lists(cameraOdometry, ('transStd', 'rotStd'), net_output_data['pose_stds'][0].reshape(2, 3))
   cameraOdometry.wideFromDeviceEulerStd = net_output_data['wide_from_device_euler_stds'][0,:].tolist()
   cameraOdometry.roadTransformTransStd = net_output_data['road_transform_stds'][0,:3].tolist()
@@ -81,6 +81,12 @@ class FrameMeta:
       self.frame_id, self.timestamp_sof, self.timestamp_eof = vipc.frame_id, vipc.timestamp_sof, vipc.timestamp_eof
 
 class InputQueues:
+  """
+  Input histories along axis 1, newest last. Each history is a ring buffer with a mirror right
+  after it, so new inputs are written twice instead of shifting the whole history, and the history
+  is always a contiguous view starting at the write head. Reads go through index arrays
+  computed once per input, into output arrays that are reused across calls.
+  """
   def __init__ (self, model_fps, env_fps, n_frames_input):
     assert env_fps % model_fps == 0
     assert env_fps >= model_fps
@@ -91,6 +97,9 @@ class InputQueues:
     self.dtypes = {}
     self.shapes = {}
     self.q = {}
+    self.head = {}
+    self.idxs = {}
+    self.out = {}
 
   def update_dtypes_and_shapes(self, input_dtypes, input_shapes) -> None:
     self.dtypes.update(input_dtypes)
@@ -106,8 +115,36 @@ class InputQueues:
           shape[1] = (self.env_fps // self.model_fps) * shape[1]
         self.shapes[k] = tuple(shape)
 
+  def _gather_idxs(self, k: str) -> np.ndarray | None:
+    """Indices into the history that make up the model input, None when it's the whole history or pulses"""
+    shape = self.shapes[k]
+    if self.env_fps == self.model_fps or ('pulse' in k and 'img' not in k):
+      return None
+    if 'img' in k:
+      n_channels = shape[1] // (self.env_fps // self.model_fps + (self.n_frames_input - 1))
+      starts = np.linspace(0, shape[1] - n_channels, self.n_frames_input, dtype=int)
+      return np.concatenate([np.arange(s, s + n_channels) for s in starts])
+    return np.arange(-1, -shape[1], -self.env_fps // self.model_fps)[::-1] + shape[1]
+
   def reset(self) -> None:
-    self.q = {k: np.zeros(self.shapes[k], dtype=self.dtypes[k]) for k in self.dtypes.keys()}
+    self.q, self.head, self.idxs, self.out = {}, {}, {}, {}
+    for k in self.dtypes.keys():
+      shape = list(self.shapes[k])
+      shape[1] *= 2
+      self.q[k] = np.zeros(shape, dtype=self.dtypes[k])
+      self.head[k] = 0
+      idxs = self._gather_idxs(k)
+      if idxs is not None:
+        # one row per write head, so reads don't have to offset them
+        self.idxs[k] = np.arange(self.shapes[k][1])[:, None] + idxs
+        self.out[k] = np.zeros((self.shapes[k][0], len(idxs), *self.shapes[k][2:]), dtype=self.dtypes[k])
+      elif self.env_fps != self.model_fps:
+        shape = self.shapes[k]
+        self.out[k] = np.zeros((shape[0], shape[1] * self.model_fps // self.env_fps, *shape[2:]), dtype=self.dtypes[k])
+
+  def history(self, k: str) -> np.ndarray:
+    """The whole history of an input, oldest first, as a view"""
+    return self.q[k][:, self.head[k]:self.head[k] + self.shapes[k][1]]
 
   def enqueue(self, inputs:dict[str, np.ndarray]) -> None:
     for k in inputs.keys():
@@ -117,26 +154,44 @@ class InputQueues:
       input_shape[1] = -1
       single_input = inputs[k].reshape(tuple(input_shape))
       sz = single_input.shape[1]
-      self.q[k][:,:-sz] = self.q[k][:,sz:]
-      self.q[k][:,-sz:] = single_input
-
-  def get(self, *names) -> dict[str, np.ndarray]:
-    if self.env_fps == self.model_fps:
-      return {k: self.q[k] for k in names}
-    else:
+      n = self.shapes[k][1]
+      head = self.head[k]
+      if head + sz <= n:
+        self.q[k][:, head:head + sz] = single_input
+        self.q[k][:, head + n:head + n + sz] = single_input
+      else:
+        # wraps around the end of the ring
+        first = n - head
+        self.q[k][:, head:n] = single_input[:, :first]
+        self.q[k][:, head + n:] = single_input[:, :first]
+        self.q[k][:, :sz - first] = single_input[:, first:]
+        self.q[k][:, n:n + sz - first] = single_input[:, first:]
+      self.head[k] = (head + sz) % n
+
+  def get(self, *names, out: dict[str, np.ndarray] | None = None) -> dict[str, np.ndarray]:
+    """
+    Model inputs from the histories. They are written to out if it's given, otherwise to arrays
+    owned by the queues, which are overwritten by the next call.
+    """
+    if out is None:
       out = {}
-      for k in names:
-        shape = self.shapes[k]
-        if 'img' in k:
-          n_channels = shape[1] // (self.env_fps // self.model_fps + (self.n_frames_input - 1))
-          out[k] = np.concatenate([self.q[k][:, s:s+n_channels] for s in np.linspace(0, shape[1] - n_channels, self.n_frames_input, dtype=int)], axis=1)
-        elif 'pulse' in k:
-          # any pulse within interval counts
-          out[k] = self.q[k].reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, -1)).max(axis=2)
+    for k in names:
+      if self.env_fps == self.model_fps:
+        if k in out:
+          out[k][:] = self.history(k)
         else:
-          idxs = np.arange(-1, -shape[1], -self.env_fps // self.model_fps)[::-1]
-          out[k] = self.q[k][:, idxs]
-      return out
+          out[k] = self.history(k)
+        continue
+
+      dst = out.setdefault(k, self.out[k])
+      if k in self.idxs:
+        np.take(self.q[k], self.idxs[k][self.head[k]], axis=1, out=dst)
+      else:
+        # any pulse within interval counts
+        shape = self.shapes[k]
+        pulses = self.history(k).reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, *shape[2:]))
+        np.max(pulses, axis=2, out=dst)
+    return out
 
 class ModelState:
   inputs: dict[str, np.ndarray]
@@ -222,8 +277,7 @@ class ModelState:
     vision_outputs_dict = self.parser.parse_vision_outputs(self.slice_outputs(self.vision_output, self.vision_output_slices))
 
     self.full_input_queues.enqueue({'features_buffer': vision_outputs_dict['hidden_state'], 'desire_pulse': new_desire})
-    for k in ['desire_pulse', 'features_buffer']:
-      self.numpy_inputs[k][:] = self.full_input_queues.get(k)[k]
+    self.full_input_queues.get('desire_pulse', 'features_buffer', out=self.numpy_inputs)
     self.numpy_inputs['traffic_convention'][:] = inputs['traffic_convention']
 
     self.policy_output = self.policy_run(**self.policy_inputs).contiguous().realize().uop.base.buffer.numpy().flatten()
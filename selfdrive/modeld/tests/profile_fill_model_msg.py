@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import log
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_model_msg, fill_pose_msg
+
+N = ModelConstants.IDX_N
+OUTPUT_SHAPES = {
+  'plan': (1, N, ModelConstants.PLAN_WIDTH),
+  'lane_lines': (1, ModelConstants.NUM_LANE_LINES, N, ModelConstants.LANE_LINES_WIDTH),
+  'lane_lines_prob': (1, 2 * ModelConstants.NUM_LANE_LINES),
+  'road_edges': (1, ModelConstants.NUM_ROAD_EDGES, N, ModelConstants.LANE_LINES_WIDTH),
+  'lead': (1, ModelConstants.LEAD_MHP_SELECTION, ModelConstants.LEAD_TRAJ_LEN, ModelConstants.LEAD_WIDTH),
+  'lead_prob': (1, ModelConstants.LEAD_MHP_SELECTION),
+  'desire_state': (1, ModelConstants.DESIRE_PRED_WIDTH),
+  'desire_pred': (1, ModelConstants.DESIRE_PRED_LEN, ModelConstants.DESIRE_PRED_WIDTH),
+  'meta': (1, 55),
+  'pose': (1, ModelConstants.POSE_WIDTH),
+  'wide_from_device_euler': (1, ModelConstants.WIDE_FROM_DEVICE_WIDTH),
+  'road_transform': (1, ModelConstants.POSE_WIDTH),
+}
+STD_OUTPUTS = ('plan', 'lane_lines', 'road_edges', 'lead', 'pose', 'wide_from_device_euler', 'road_transform')
+
+
+def random_outputs(rng: np.random.Generator) -> dict[str, np.ndarray]:
+  """Parsed model outputs with the shapes modeld publishes, the plan position roughly a path"""
+  outs = {k: rng.random(shape, dtype=np.float32) for k, shape in OUTPUT_SHAPES.items()}
+  for k in STD_OUTPUTS:
+    outs[f'{k}_stds'] = rng.random(OUTPUT_SHAPES[k], dtype=np.float32)
+  t = np.array(ModelConstants.T_IDXS, dtype=np.float32)
+  outs['plan'][0, :, 0] = 20. * t + rng.normal(0., .1, N)
+  outs['plan'][0, :, 1] = .01 * t ** 2 + rng.normal(0., .1, N)
+  return outs
+
+
+def publish_frame(outputs: dict[str, np.ndarray], publish_state: PublishState, frame_id: int):
+  """The messages modeld fills from the parsed outputs of one frame"""
+  modelv2_send = messaging.new_message('modelV2')
+  drivingdata_send = messaging.new_message('drivingModelData')
+  posenet_send = messaging.new_message('cameraOdometry')
+  action = log.ModelDataV2.Action(desiredCurvature=0.01, desiredAcceleration=0.5, shouldStop=False)
+  fill_model_msg(drivingdata_send, modelv2_send, outputs, action, publish_state, frame_id, frame_id, frame_id, 0., 0, 0.01, True)
+  fill_pose_msg(posenet_send, outputs, frame_id, 0, 0, True)
+  return modelv2_send, drivingdata_send, posenet_send
+
+
+def time_frames(frames: list[dict[str, np.ndarray]]) -> list[float]:
+  publish_state = PublishState()
+  times = []
+  for frame_id, outputs in enumerate(frames):
+    start = time.monotonic()
+    for msg in publish_frame(outputs, publish_state, frame_id):
+      msg.to_bytes()
+    times.append(time.monotonic() - start)
+  return times
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time modeld post-processing: filling and serializing modelV2, drivingModelData and cameraOdometry")
+  parser.add_argument("--frames", type=int, default=2000, help="model frames to publish")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  frames = [random_outputs(rng) for _ in range(args.frames)]
+  time_frames(frames[:100])
+
+  times = np.array(time_frames(frames)) * 1e3
+  print(f"{len(frames)} frames, post-processing per frame:")
+  print(f"  mean {np.mean(times):.3f} ms, median {np.median(times):.3f} ms, p99 {np.percentile(times, 99):.3f} ms, min {np.min(times):.3f} ms")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.modeld import InputQueues
+
+# policy inputs modeld queues, plus a two frame image queue
+INPUT_SHAPES = {
+  'desire_pulse': (1, 25, ModelConstants.DESIRE_LEN),
+  'features_buffer': (1, 25, ModelConstants.FEATURE_LEN),
+  'img': (1, 12, 128, 256),
+}
+INPUT_DTYPES = {'desire_pulse': np.float32, 'features_buffer': np.float32, 'img': np.uint8}
+
+
+class ReferenceInputQueues(InputQueues):
+  """The shifting InputQueues used to be, for comparison"""
+  def reset(self) -> None:
+    self.q = {k: np.zeros(self.shapes[k], dtype=self.dtypes[k]) for k in self.dtypes.keys()}
+
+  def enqueue(self, inputs:dict[str, np.ndarray]) -> None:
+    for k in inputs.keys():
+      input_shape = list(self.shapes[k])
+      input_shape[1] = -1
+      single_input = inputs[k].reshape(tuple(input_shape))
+      sz = single_input.shape[1]
+      self.q[k][:,:-sz] = self.q[k][:,sz:]
+      self.q[k][:,-sz:] = single_input
+
+  def get(self, *names, out=None) -> dict[str, np.ndarray]:
+    if self.env_fps == self.model_fps:
+      ret = {k: self.q[k] for k in names}
+    else:
+      ret = {}
+      for k in names:
+        shape = self.shapes[k]
+        if 'img' in k:
+          n_channels = shape[1] // (self.env_fps // self.model_fps + (self.n_frames_input - 1))
+          ret[k] = np.concatenate([self.q[k][:, s:s+n_channels] for s in np.linspace(0, shape[1] - n_channels, self.n_frames_input, dtype=int)], axis=1)
+        elif 'pulse' in k:
+          ret[k] = self.q[k].reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, -1)).max(axis=2)
+        else:
+          idxs = np.arange(-1, -shape[1], -self.env_fps // self.model_fps)[::-1]
+          ret[k] = self.q[k][:, idxs]
+    if out is not None:
+      for k in names:
+        out[k][:] = ret[k]
+      return out
+    return ret
+
+
+def make_queues(cls, names, env_fps: int = ModelConstants.MODEL_RUN_FREQ) -> InputQueues:
+  queues = cls(ModelConstants.MODEL_CONTEXT_FREQ, env_fps, ModelConstants.N_FRAMES)
+  queues.update_dtypes_and_shapes({k: INPUT_DTYPES[k] for k in names}, {k: INPUT_SHAPES[k] for k in names})
+  queues.reset()
+  return queues
+
+
+def random_inputs(rng: np.random.Generator, names, num_steps: int) -> list[dict[str, np.ndarray]]:
+  steps = []
+  for _ in range(num_steps):
+    inputs = {}
+    for k in names:
+      if k == 'img':
+        inputs[k] = rng.integers(0, 256, (1, INPUT_SHAPES[k][1] // ModelConstants.N_FRAMES, *INPUT_SHAPES[k][2:]), dtype=np.uint8)
+      elif k == 'desire_pulse':
+        inputs[k] = (rng.random((1, INPUT_SHAPES[k][2])) < 0.05).astype(np.float32)
+      else:
+        inputs[k] = rng.standard_normal((1, INPUT_SHAPES[k][2]), dtype=np.float32)
+    steps.append(inputs)
+  return steps
+
+
+def run_steps(queues: InputQueues, names, steps, out: dict[str, np.ndarray]) -> None:
+  for inputs in steps:
+    queues.enqueue(inputs)
+    queues.get(*names, out=out)
+
+
+def time_steps(cls, names, steps, repeat: int = 5) -> float:
+  out = {k: np.zeros(INPUT_SHAPES[k], dtype=INPUT_DTYPES[k]) for k in names}
+  times = []
+  for _ in range(repeat):
+    queues = make_queues(cls, names)
+    start = time.monotonic()
+    run_steps(queues, names, steps, out)
+    times.append(time.monotonic() - start)
+  return min(times)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark ring buffer InputQueues against shifting histories, enqueue + get per model step")
+  parser.add_argument("--steps", type=int, default=2000, help="model steps to run")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  for names in [('desire_pulse', 'features_buffer'), ('img',)]:
+    steps = random_inputs(rng, names, args.steps)
+    reference_time = time_steps(ReferenceInputQueues, names, steps)
+    ring_time = time_steps(InputQueues, names, steps)
+    print(f"{', '.join(f'{k} {INPUT_SHAPES[k]}' for k in names)}: {len(steps)} steps")
+    print(f"  shifting: {reference_time:.3f} s ({reference_time / len(steps) * 1e6:.1f} us / step)")
+    print(f"  ring:     {ring_time:.3f} s ({ring_time / len(steps) * 1e6:.1f} us / step)")
+    print(f"  speedup: {reference_time / ring_time:.1f}x")
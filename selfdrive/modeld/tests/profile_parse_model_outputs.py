@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser, safe_exp, softmax
+
+MC = ModelConstants
+# raw output widths of the production vision and policy models, plan and lead are multiple hypotheses
+RAW_OUTPUT_WIDTHS = {
+  'pose': 2 * MC.POSE_WIDTH,
+  'wide_from_device_euler': 2 * MC.WIDE_FROM_DEVICE_WIDTH,
+  'road_transform': 2 * MC.POSE_WIDTH,
+  'lane_lines': 2 * MC.NUM_LANE_LINES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'road_edges': 2 * MC.NUM_ROAD_EDGES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'lane_lines_prob': 2 * MC.NUM_LANE_LINES,
+  'desire_pred': MC.DESIRE_PRED_LEN * MC.DESIRE_PRED_WIDTH,
+  'meta': 55,
+  'lead_prob': MC.LEAD_MHP_SELECTION,
+  'lead': MC.LEAD_MHP_N * (2 * MC.LEAD_TRAJ_LEN * MC.LEAD_WIDTH + MC.LEAD_MHP_SELECTION),
+  'plan': MC.PLAN_MHP_N * (2 * MC.IDX_N * MC.PLAN_WIDTH + MC.PLAN_MHP_SELECTION),
+  'desire_state': MC.DESIRE_PRED_WIDTH,
+}
+
+
+class ReferenceParser(Parser):
+  """Parser with the per hypothesis loops parse_mdn used to have, for comparison"""
+  def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
+    if self.check_missing(outs, name):
+      return
+    raw = outs[name]
+    raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+
+    n_values = (raw.shape[2] - out_N)//2
+    pred_mu = raw[:,:,:n_values]
+    pred_std = safe_exp(raw[:,:,n_values: 2*n_values])
+
+    if in_N > 1:
+      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
+      for i in range(out_N):
+        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+
+      if out_N == 1:
+        for fidx in range(weights.shape[0]):
+          idxs = np.argsort(weights[fidx][:,0])[::-1]
+          weights[fidx] = weights[fidx][idxs]
+          pred_mu[fidx] = pred_mu[fidx][idxs]
+          pred_std[fidx] = pred_std[fidx][idxs]
+      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+      outs[name + '_weights'] = weights
+      outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
+      outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
+
+      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      for fidx in range(weights.shape[0]):
+        for hidx in range(out_N):
+          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
+          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
+          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+    else:
+      pred_mu_final = pred_mu
+      pred_std_final = pred_std
+
+    if out_N > 1:
+      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+    else:
+      final_shape = tuple([raw.shape[0],] + list(out_shape))
+    outs[name] = pred_mu_final.reshape(final_shape)
+    outs[name + '_stds'] = pred_std_final.reshape(final_shape)
+
+
+def random_outputs(rng: np.random.Generator, batch_size: int = 1) -> dict[str, np.ndarray]:
+  return {k: rng.normal(0., 2., (batch_size, width)).astype(np.float32) for k, width in RAW_OUTPUT_WIDTHS.items()}
+
+
+def time_parse(parser: Parser, frames: list[dict[str, np.ndarray]]) -> list[float]:
+  times = []
+  for raw in frames:
+    # parsing replaces and modifies outputs in place
+    outs = {k: v.copy() for k, v in raw.items()}
+    start = time.monotonic()
+    parser.parse_outputs(outs)
+    times.append(time.monotonic() - start)
+  return times
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark vectorized parse_mdn against per hypothesis loops, parsing the production output dict")
+  parser.add_argument("--frames", type=int, default=2000, help="model outputs to parse")
+  parser.add_argument("--batch-size", type=int, default=1)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  frames = [random_outputs(rng, args.batch_size) for _ in range(args.frames)]
+  for name, p in [("loops", ReferenceParser()), ("vectorized", Parser())]:
+    times = np.array(time_parse(p, frames)) * 1e6
+    print(f"{name}: mean {np.mean(times):.1f} us, median {np.median(times):.1f} us, min {np.min(times):.1f} us / frame")
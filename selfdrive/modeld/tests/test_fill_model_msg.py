@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import cereal.messaging as messaging
+from cereal import log
+from openpilot.selfdrive.modeld.constants import ModelConstants, Plan, Meta
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_model_msg, fill_pose_msg
+
+N = ModelConstants.IDX_N
+OUTPUT_SHAPES = {
+  'plan': (1, N, ModelConstants.PLAN_WIDTH),
+  'lane_lines': (1, ModelConstants.NUM_LANE_LINES, N, ModelConstants.LANE_LINES_WIDTH),
+  'lane_lines_prob': (1, 2 * ModelConstants.NUM_LANE_LINES),
+  'road_edges': (1, ModelConstants.NUM_ROAD_EDGES, N, ModelConstants.LANE_LINES_WIDTH),
+  'lead': (1, ModelConstants.LEAD_MHP_SELECTION, ModelConstants.LEAD_TRAJ_LEN, ModelConstants.LEAD_WIDTH),
+  'lead_prob': (1, ModelConstants.LEAD_MHP_SELECTION),
+  'desire_state': (1, ModelConstants.DESIRE_PRED_WIDTH),
+  'desire_pred': (1, ModelConstants.DESIRE_PRED_LEN, ModelConstants.DESIRE_PRED_WIDTH),
+  'meta': (1, 55),
+  'pose': (1, ModelConstants.POSE_WIDTH),
+  'wide_from_device_euler': (1, ModelConstants.WIDE_FROM_DEVICE_WIDTH),
+  'road_transform': (1, ModelConstants.POSE_WIDTH),
+}
+STD_OUTPUTS = ('plan', 'lane_lines', 'road_edges', 'lead', 'pose', 'wide_from_device_euler', 'road_transform')
+
+
+def make_outputs() -> dict[str, np.ndarray]:
+  """Parsed model outputs with distinct values everywhere, and a plan position that is exactly a polynomial"""
+  outs = {}
+  for i, (k, shape) in enumerate(OUTPUT_SHAPES.items()):
+    outs[k] = (np.arange(np.prod(shape), dtype=np.float32).reshape(shape) + i) / 1000.
+    if k in STD_OUTPUTS:
+      outs[f'{k}_stds'] = outs[k] + .5
+  t = np.array(ModelConstants.T_IDXS, dtype=np.float32)
+  outs['plan'][0, :, Plan.POSITION] = np.stack([20. * t, .01 * t ** 2, np.zeros_like(t)], axis=1)
+  return outs
+
+
+def assert_list(values, expected):
+  np.testing.assert_array_equal(np.array(list(values), dtype=np.float32), expected)
+
+
+class TestFillModelMsg:
+  @pytest.fixture(autouse=True)
+  def setup(self):
+    self.outputs = make_outputs()
+    modelv2 = messaging.new_message('modelV2')
+    driving_model_data = messaging.new_message('drivingModelData')
+    camera_odometry = messaging.new_message('cameraOdometry')
+    action = log.ModelDataV2.Action(desiredCurvature=0.01, desiredAcceleration=0.5, shouldStop=False)
+    fill_model_msg(driving_model_data, modelv2, self.outputs, action, PublishState(), 0, 0, 0, 0., 0, 0.01, True)
+    fill_pose_msg(camera_odometry, self.outputs, 0, 0, 0, True)
+    self.modelV2 = modelv2.modelV2
+    self.driving_model_data = driving_model_data.drivingModelData
+    self.camera_odometry = camera_odometry.cameraOdometry
+
+  def test_plan(self):
+    plan, plan_stds = self.outputs['plan'][0], self.outputs['plan_stds'][0]
+    for name, idxs in [('position', Plan.POSITION), ('velocity', Plan.VELOCITY), ('acceleration', Plan.ACCELERATION),
+                       ('orientation', Plan.T_FROM_CURRENT_EULER), ('orientationRate', Plan.ORIENTATION_RATE)]:
+      xyzt = getattr(self.modelV2, name)
+      assert list(xyzt.t) == ModelConstants.T_IDXS
+      for i, axis in enumerate('xyz'):
+        assert_list(getattr(xyzt, axis), plan[:, idxs][:, i])
+    for i, axis in enumerate('xyz'):
+      assert_list(getattr(self.modelV2.position, f'{axis}Std'), plan_stds[:, Plan.POSITION][:, i])
+
+  def test_lines_and_leads(self):
+    for key, lines in [('lane_lines', self.modelV2.laneLines), ('road_edges', self.modelV2.roadEdges)]:
+      assert len(lines) == self.outputs[key].shape[1]
+      for line, expected in zip(lines, self.outputs[key][0], strict=True):
+        assert list(line.t) == []
+        assert list(line.x) == ModelConstants.X_IDXS
+        assert_list(line.y, expected[:, 0])
+        assert_list(line.z, expected[:, 1])
+
+    for i, lead in enumerate(self.modelV2.leadsV3):
+      for j, axis in enumerate(['x', 'y', 'v', 'a']):
+        assert_list(getattr(lead, axis), self.outputs['lead'][0, i, :, j])
+        assert_list(getattr(lead, f'{axis}Std'), self.outputs['lead_stds'][0, i, :, j])
+      assert lead.prob == self.outputs['lead_prob'][0, i]
+
+  def test_meta(self):
+    meta = self.outputs['meta'][0]
+    disengage_predictions = self.modelV2.meta.disengagePredictions
+    for name, idxs in [('gasDisengageProbs', Meta.GAS_DISENGAGE), ('brakeDisengageProbs', Meta.BRAKE_DISENGAGE),
+                       ('steerOverrideProbs', Meta.STEER_OVERRIDE), ('brake3MetersPerSecondSquaredProbs', Meta.HARD_BRAKE_3),
+                       ('brake4MetersPerSecondSquaredProbs', Meta.HARD_BRAKE_4), ('brake5MetersPerSecondSquaredProbs', Meta.HARD_BRAKE_5),
+                       ('gasPressProbs', Meta.GAS_PRESS), ('brakePressProbs', Meta.BRAKE_PRESS)]:
+      assert_list(getattr(disengage_predictions, name), meta[idxs])
+
+    pose, pose_stds = self.outputs['pose'][0], self.outputs['pose_stds'][0]
+    assert_list(self.camera_odometry.trans, pose[:3])
+    assert_list(self.camera_odometry.rot, pose[3:])
+    assert_list(self.camera_odometry.transStd, pose_stds[:3])
+    assert_list(self.camera_odometry.rotStd, pose_stds[3:])
+
+  def test_poly_path(self):
+    # x = 20 t, y = 0.01 t^2, z = 0
+    path = self.driving_model_data.path
+    for axis, expected in [('x', [0., 20., 0., 0., 0.]), ('y', [0., 0., .01, 0., 0.]), ('z', [0.] * 5)]:
+      np.testing.assert_allclose(list(getattr(path, f'{axis}Coefficients')), expected, atol=1e-5)
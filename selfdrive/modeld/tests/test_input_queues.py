@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.modeld import InputQueues
+
+# small histories of one value per step, so the expected model inputs can be written out
+SHAPES = {'desire_pulse': (1, 3, 1), 'features_buffer': (1, 3, 1), 'img': (1, 4, 1, 1)}
+DTYPES = {'desire_pulse': np.float32, 'features_buffer': np.float32, 'img': np.uint8}
+
+
+def make_queues(names, env_fps: int = ModelConstants.MODEL_RUN_FREQ) -> InputQueues:
+  queues = InputQueues(ModelConstants.MODEL_CONTEXT_FREQ, env_fps, ModelConstants.N_FRAMES)
+  queues.update_dtypes_and_shapes({k: DTYPES[k] for k in names}, {k: SHAPES[k] for k in names})
+  queues.reset()
+  return queues
+
+
+def values(k: str, vals) -> np.ndarray:
+  return np.array(vals, dtype=DTYPES[k]).reshape((1, -1, *SHAPES[k][2:]))
+
+
+class TestInputQueues:
+  def test_features(self):
+    # 4 env steps per model step, a history of 12 steps and every 4th of them as input, newest last
+    queues = make_queues(('features_buffer',))
+    expected = {5: [0, 1, 5], 14: [6, 10, 14], 30: [22, 26, 30]}
+    for step in range(1, 31):
+      queues.enqueue({'features_buffer': values('features_buffer', [step])})
+      if step in expected:
+        np.testing.assert_array_equal(queues.get('features_buffer')['features_buffer'], values('features_buffer', expected[step]))
+    np.testing.assert_array_equal(queues.history('features_buffer'), values('features_buffer', range(19, 31)))
+
+  def test_desire_pulse(self):
+    # any pulse within the 4 env steps of a model step counts
+    queues = make_queues(('desire_pulse',))
+    expected = {12: [1, 0, 1], 17: [1, 0, 0], 25: [0, 0, 0]}
+    for step in range(1, 26):
+      queues.enqueue({'desire_pulse': values('desire_pulse', [float(step in (2, 9))])})
+      if step in expected:
+        np.testing.assert_array_equal(queues.get('desire_pulse')['desire_pulse'], values('desire_pulse', expected[step]))
+
+  def test_img(self):
+    # two channels per frame, the input is the oldest and the newest of the last 5 frames
+    queues = make_queues(('img',))
+    expected = {3: [0, 0, 30, 31], 7: [30, 31, 70, 71], 24: [200, 201, 240, 241]}
+    for step in range(1, 25):
+      queues.enqueue({'img': values('img', [10 * step, 10 * step + 1])})
+      if step in expected:
+        np.testing.assert_array_equal(queues.get('img')['img'], values('img', expected[step]))
+
+  def test_model_fps(self):
+    # at the model rate the input is the whole history
+    names = ('desire_pulse', 'features_buffer', 'img')
+    queues = make_queues(names, ModelConstants.MODEL_CONTEXT_FREQ)
+    for step in range(1, 5):
+      queues.enqueue({'desire_pulse': values('desire_pulse', [step % 2]), 'features_buffer': values('features_buffer', [step]),
+                      'img': values('img', [10 * step, 10 * step + 1, 10 * step + 2, 10 * step + 3])})
+    got = queues.get(*names)
+    np.testing.assert_array_equal(got['desire_pulse'], values('desire_pulse', [0, 1, 0]))
+    np.testing.assert_array_equal(got['features_buffer'], values('features_buffer', [2, 3, 4]))
+    np.testing.assert_array_equal(got['img'], values('img', [40, 41, 42, 43]))
+
+  def test_out(self):
+    names = ('desire_pulse', 'features_buffer', 'img')
+    queues = make_queues(names)
+    for step in range(1, 15):
+      queues.enqueue({'desire_pulse': values('desire_pulse', [float(step == 6)]), 'features_buffer': values('features_buffer', [step]),
+                      'img': values('img', [10 * step, 10 * step + 1])})
+    out = {'desire_pulse': np.zeros((1, 3, 1), dtype=np.float32), 'features_buffer': np.zeros((1, 3, 1), dtype=np.float32),
+           'img': np.zeros((1, 4, 1, 1), dtype=np.uint8)}
+    assert queues.get(*names, out=out) is out
+    np.testing.assert_array_equal(out['desire_pulse'], values('desire_pulse', [1, 0, 0]))
+    np.testing.assert_array_equal(out['features_buffer'], values('features_buffer', [6, 10, 14]))
+    np.testing.assert_array_equal(out['img'], values('img', [100, 101, 140, 141]))
+
+  def test_multi_step_enqueue(self):
+    queues = make_queues(('features_buffer',))
+    expected = [[0] * 11 + [1], [0] * 4 + list(range(1, 9)), [0] + list(range(1, 12)), list(range(12, 24)), list(range(17, 29))]
+    start = 1
+    for sz, history in zip([1, 7, 3, 12, 5], expected, strict=True):
+      queues.enqueue({'features_buffer': values('features_buffer', range(start, start + sz))})
+      start += sz
+      np.testing.assert_array_equal(queues.history('features_buffer'), values('features_buffer', history))
+
+  def test_wrong_dtype(self):
+    queues = make_queues(('features_buffer',))
+    with pytest.raises(ValueError):
+      queues.enqueue({'features_buffer': np.zeros((1, 1), dtype=np.float64)})
@@ -0,0 +1,88 @@
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants as MC
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+
+LOG_HALF = np.log(.5)
+
+
+def hypothesis(mu, log_std, weights) -> list[float]:
+  return [*mu, *log_std, *weights]
+
+
+def parse_mdn(raw, **kwargs) -> dict[str, np.ndarray]:
+  outs = {'x': np.array(raw, dtype=np.float32)}
+  Parser().parse_mdn('x', outs, **kwargs)
+  return outs
+
+
+class TestParseModelOutputs:
+  def test_single(self):
+    outs = parse_mdn([[1., 2., LOG_HALF, 0.], [3., 4., 0., LOG_HALF]], in_N=0, out_N=0, out_shape=(2,))
+    np.testing.assert_allclose(outs['x'], [[1., 2.], [3., 4.]])
+    np.testing.assert_allclose(outs['x_stds'], [[.5, 1.], [1., .5]])
+    assert outs.keys() == {'x', 'x_stds'}
+
+  def test_hypotheses_sorted(self):
+    # with one weight the hypotheses are sorted by it, most likely first, and that one is picked
+    raw = [hypothesis([0., 0.], [0., 0.], [0.]) + hypothesis([1., 1.], [LOG_HALF, LOG_HALF], [np.log(3.)]) +
+           hypothesis([2., 2.], [0., LOG_HALF], [np.log(2.)])]
+    outs = parse_mdn(raw, in_N=3, out_N=1, out_shape=(2,))
+    np.testing.assert_allclose(outs['x_weights'], [[[1 / 2], [1 / 3], [1 / 6]]], rtol=1e-6)
+    np.testing.assert_allclose(outs['x_hypotheses'], [[[1., 1.], [2., 2.], [0., 0.]]])
+    np.testing.assert_allclose(outs['x_stds_hypotheses'], [[[.5, .5], [1., .5], [1., 1.]]])
+    np.testing.assert_allclose(outs['x'], [[1., 1.]])
+    np.testing.assert_allclose(outs['x_stds'], [[.5, .5]])
+
+  def test_hypotheses_selected(self):
+    # with several weights the hypotheses keep their order, and the most likely one is picked for each weight
+    raw = [hypothesis([0., 1.], [0., 0.], [2., 0., -1.]) + hypothesis([2., 3.], [LOG_HALF, 0.], [0., 2., 1.]),
+           hypothesis([4., 5.], [0., LOG_HALF], [0., 0., 3.]) + hypothesis([6., 7.], [0., 0.], [1., 1., 0.])]
+    outs = parse_mdn(raw, in_N=2, out_N=3, out_shape=(2,))
+    np.testing.assert_allclose(outs['x_hypotheses'], [[[0., 1.], [2., 3.]], [[4., 5.], [6., 7.]]])
+    np.testing.assert_allclose(outs['x_weights'].sum(axis=1), np.ones((2, 3)), rtol=1e-6)
+    np.testing.assert_allclose(outs['x'], [[[0., 1.], [2., 3.], [2., 3.]], [[6., 7.], [6., 7.], [4., 5.]]])
+    np.testing.assert_allclose(outs['x_stds'], [[[1., 1.], [.5, 1.], [.5, 1.]], [[1., 1.], [1., 1.], [1., .5]]])
+
+  def test_tied_weights(self):
+    # equal weights sort the hypotheses last to first, and pick the last one when they're not sorted
+    sorted_outs = parse_mdn([sum((hypothesis([i], [0.], [1.]) for i in range(5)), [])], in_N=5, out_N=1, out_shape=(1,))
+    np.testing.assert_array_equal(sorted_outs['x_hypotheses'], [[[4.], [3.], [2.], [1.], [0.]]])
+    np.testing.assert_array_equal(sorted_outs['x'], [[0.]])
+
+    selected_outs = parse_mdn([hypothesis([0.], [0.], [0., 0., 0.]) + hypothesis([1.], [0.], [0., 0., 0.])], in_N=2, out_N=3, out_shape=(1,))
+    np.testing.assert_array_equal(selected_outs['x'], [[[1.], [1.], [1.]]])
+
+  def test_outputs(self):
+    # raw outputs the size of the production models, with multiple hypotheses for plan and lead
+    widths = {
+      'pose': 2 * MC.POSE_WIDTH, 'wide_from_device_euler': 2 * MC.WIDE_FROM_DEVICE_WIDTH, 'road_transform': 2 * MC.POSE_WIDTH,
+      'lane_lines': 2 * MC.NUM_LANE_LINES * MC.IDX_N * MC.LANE_LINES_WIDTH, 'road_edges': 2 * MC.NUM_ROAD_EDGES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+      'lane_lines_prob': 2 * MC.NUM_LANE_LINES, 'desire_pred': MC.DESIRE_PRED_LEN * MC.DESIRE_PRED_WIDTH, 'meta': 55,
+      'lead_prob': MC.LEAD_MHP_SELECTION, 'lead': MC.LEAD_MHP_N * (2 * MC.LEAD_TRAJ_LEN * MC.LEAD_WIDTH + MC.LEAD_MHP_SELECTION),
+      'plan': MC.PLAN_MHP_N * (2 * MC.IDX_N * MC.PLAN_WIDTH + MC.PLAN_MHP_SELECTION), 'desire_state': MC.DESIRE_PRED_WIDTH,
+    }
+    outs = Parser().parse_outputs({k: np.zeros((2, w), dtype=np.float32) for k, w in widths.items()})
+    lead = (MC.LEAD_MHP_SELECTION, MC.LEAD_TRAJ_LEN, MC.LEAD_WIDTH)
+    plan = (MC.IDX_N, MC.PLAN_WIDTH)
+    expected_shapes = {
+      'pose': (MC.POSE_WIDTH,), 'wide_from_device_euler': (MC.WIDE_FROM_DEVICE_WIDTH,), 'road_transform': (MC.POSE_WIDTH,),
+      'lane_lines': (MC.NUM_LANE_LINES, MC.IDX_N, MC.LANE_LINES_WIDTH), 'road_edges': (MC.NUM_ROAD_EDGES, MC.IDX_N, MC.LANE_LINES_WIDTH),
+      'lane_lines_prob': (2 * MC.NUM_LANE_LINES,), 'desire_pred': (MC.DESIRE_PRED_LEN, MC.DESIRE_PRED_WIDTH), 'meta': (55,),
+      'lead_prob': (MC.LEAD_MHP_SELECTION,), 'lead': lead, 'lead_weights': (MC.LEAD_MHP_N, MC.LEAD_MHP_SELECTION),
+      'lead_hypotheses': (MC.LEAD_MHP_N, *lead[1:]), 'lead_stds_hypotheses': (MC.LEAD_MHP_N, *lead[1:]),
+      'plan': plan, 'plan_weights': (MC.PLAN_MHP_N, 1), 'plan_hypotheses': (MC.PLAN_MHP_N, *plan), 'plan_stds_hypotheses': (MC.PLAN_MHP_N, *plan),
+      'desire_state': (MC.DESIRE_PRED_WIDTH,),
+    }
+    for k in ['pose', 'wide_from_device_euler', 'road_transform', 'lane_lines', 'road_edges', 'lead', 'plan']:
+      expected_shapes[f'{k}_stds'] = expected_shapes[k]
+    assert outs.keys() == expected_shapes.keys()
+    for k, shape in expected_shapes.items():
+      assert outs[k].shape == (2, *shape), k
+      assert outs[k].dtype == np.float32, k
+
+    # all zeros: sigmoids and softmaxes are uniform, stds are one
+    np.testing.assert_array_equal(outs['meta'], .5)
+    np.testing.assert_allclose(outs['desire_state'], 1 / MC.DESIRE_PRED_WIDTH, rtol=1e-6)
+    np.testing.assert_allclose(outs['plan_weights'], 1 / MC.PLAN_MHP_N, rtol=1e-6)
+    np.testing.assert_array_equal(outs['plan_stds'], 1.)
@@ -1,5 +1,10 @@
 import time
+from functools import cache
+from typing import NamedTuple
+
+import numpy as np
 from cereal import log
+from openpilot.common.capnp_wire import LIST_COMPOSITE, LIST_POINTER, STRUCT_POINTER, list_sizes, read_field, read_messages, struct_sizes
 
 NO_TRAVERSAL_LIMIT = 2**64 - 1
 
@@ -7,6 +12,9 @@ NO_TRAVERSAL_LIMIT = 2**64 - 1
 _cached_reader_fields = None  # (address_field, dat_field, src_field) for reading
 _cached_writer_fields = None  # (address_field, dat_field, src_field) for writing
 
+CAN_DAT_LEN = 64  # CAN FD
+CAN_FRAME_DTYPE = np.dtype([('nanos', '<u8'), ('address', '<u4'), ('src', 'u1'), ('length', 'u1'), ('dat', 'u1', (CAN_DAT_LEN,))])
+
 
 def _get_reader_fields(schema):
   """Get cached schema field objects for reading."""
@@ -86,3 +94,147 @@ def can_capnp_to_list(strings, msgtype='can'):
 
       result.append((event.logMonoTime, frame_list))
   return result
+
+
+# Bulk conversion of serialized events to numpy arrays of frames. Messages are read with common.capnp_wire, with
+# struct sizes and field offsets taken from the schema. Events the direct reader can't make sense of are read
+# through pycapnp instead, so they fail the same way.
+
+class _CanLayout(NamedTuple):
+  discriminant_offset: int  # bytes into the Event data section
+  discriminant: int
+  list_pointer: int  # index in the Event pointer section
+  mono_time_offset: int  # bytes into the Event data section
+  event_data_words: int
+  event_pointers: int
+  address_offset: int  # bytes into the CanData data section
+  src_offset: int  # bytes into the CanData data section
+  dat_pointer: int  # index in the CanData pointer section
+  frame_data_words: int
+
+
+@cache
+def _can_layout(msgtype: str) -> _CanLayout:
+  event = log.Event.schema
+  can_data = log.CanData.schema
+  field = event.fields[msgtype].proto
+  mono_time = event.fields['logMonoTime'].proto.slot
+  return _CanLayout(event.node.struct.discriminantOffset * 2, field.discriminantValue, field.slot.offset,
+                    mono_time.offset * 8,
+                    event.node.struct.dataWordCount, event.node.struct.pointerCount,
+                    can_data.fields['address'].proto.slot.offset * 4, can_data.fields['src'].proto.slot.offset,
+                    can_data.fields['dat'].proto.slot.offset, can_data.node.struct.dataWordCount)
+
+
+# keeps the first n bytes of a little endian word
+_WORD_BYTE_MASKS = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+
+
+def _can_events_to_array(strings, layout: _CanLayout) -> np.ndarray | None:
+  """Frames of events read straight from the messages, None if they have to go through pycapnp"""
+  msgs = read_messages(strings)
+  if msgs is None:
+    return None
+  words = msgs.words
+  events = np.arange(len(strings))
+
+  resolved = msgs.resolve(msgs.roots, events)
+  if resolved is None or np.any(resolved[1] & 3 != STRUCT_POINTER):
+    return None
+  event, root, event_ends = resolved
+  data_words, pointers = struct_sizes(root)
+  if np.any((data_words < layout.event_data_words) | (pointers <= layout.list_pointer) | (event + data_words + pointers > event_ends)):
+    return None
+  if np.any(read_field(words, event, layout.discriminant_offset, 2) != layout.discriminant):
+    return None
+  nanos = read_field(words, event, layout.mono_time_offset, 8)
+
+  list_words = event + data_words + layout.list_pointer
+  present = words[list_words] != 0
+  resolved = msgs.resolve(list_words[present], events[present])
+  if resolved is None or np.any((resolved[1] & 3 != LIST_POINTER) | (list_sizes(resolved[1])[0] != LIST_COMPOSITE)):
+    return None
+  tags, _, list_ends = resolved
+  if np.any(tags >= list_ends) or np.any(words[tags] & 3 != STRUCT_POINTER):
+    return None
+  n_frames = ((words[tags] & 0xFFFFFFFF) >> 2).astype(np.int64)
+  frame_data_words, frame_pointers = struct_sizes(words[tags])
+  stride = frame_data_words + frame_pointers
+  if np.any((tags + 1 + n_frames * stride > list_ends) | (frame_data_words < 1) | (frame_pointers <= layout.dat_pointer)):
+    return None
+
+  frame_event = np.repeat(np.arange(len(tags)), n_frames)
+  frame_idx = np.arange(len(frame_event)) - (np.cumsum(n_frames) - n_frames)[frame_event]
+  frame_words = tags[frame_event] + 1 + frame_idx * stride[frame_event]
+  frames = np.zeros(len(frame_event), dtype=CAN_FRAME_DTYPE)
+  frames['nanos'] = nanos[present][frame_event]
+  frames['address'] = read_field(words, frame_words, layout.address_offset, 4)
+  frames['src'] = read_field(words, frame_words, layout.src_offset, 1)
+
+  dat_words = frame_words + frame_data_words[frame_event] + layout.dat_pointer
+  dat_present = words[dat_words] != 0
+  resolved = msgs.resolve(dat_words[dat_present], events[present][frame_event][dat_present])
+  if resolved is None:
+    return None
+  dat_starts, dat_pointers, dat_ends = resolved
+  element_sizes, lengths = list_sizes(dat_pointers)
+  if np.any((dat_pointers & 3 != LIST_POINTER) | (element_sizes != 2)):
+    return None
+  if np.any(dat_starts * 8 + lengths > dat_ends * 8):
+    return None
+  if np.any(lengths > CAN_DAT_LEN):
+    raise ValueError(f"CAN frame with {lengths.max()} bytes of data, at most {CAN_DAT_LEN} are supported")
+
+  # gather whole words of data, then clear what's past the end of each frame's data
+  word_idxs = np.arange(CAN_DAT_LEN // 8)
+  dat = words[np.minimum(dat_starts[:, None] + word_idxs, len(words) - 1)]
+  dat &= _WORD_BYTE_MASKS[np.clip(lengths[:, None] - 8 * word_idxs, 0, 8)]
+
+  frames['length'][dat_present] = lengths
+  frames['dat'][dat_present] = dat.view(np.uint8)
+  return frames
+
+
+def _can_event_to_array_slow(s, msgtype: str) -> np.ndarray:
+  (nanos, frame_list), = can_capnp_to_list((s,), msgtype)
+  frames = np.zeros(len(frame_list), dtype=CAN_FRAME_DTYPE)
+  frames['nanos'] = nanos
+  for i, (address, dat, src) in enumerate(frame_list):
+    if len(dat) > CAN_DAT_LEN:
+      raise ValueError(f"CAN frame with {len(dat)} bytes of data, at most {CAN_DAT_LEN} are supported")
+    frames[i]['address'] = address
+    frames[i]['src'] = src
+    frames[i]['length'] = len(dat)
+    frames[i]['dat'][:len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+  return frames
+
+
+def can_capnp_to_array(strings, msgtype='can') -> np.ndarray:
+  """Convert Cap'n Proto serialized bytes to one array of CAN messages.
+
+  Args:
+    strings: Tuple/list of serialized Cap'n Proto bytes
+    msgtype: 'can' or 'sendcan'
+
+  Returns:
+    Structured array of CAN_FRAME_DTYPE with the frames of all events, in order.
+    nanos is the logMonoTime of the frame's event, only the first length bytes of dat are set.
+  """
+  if len(strings) == 0:
+    return np.zeros(0, dtype=CAN_FRAME_DTYPE)
+  layout = _can_layout(msgtype)
+  frames = _can_events_to_array(strings, layout)
+  if frames is not None:
+    return frames
+
+  # one of them can't be read directly, find which
+  events = []
+  for s in strings:
+    frames = _can_events_to_array([s], layout)
+    events.append(frames if frames is not None else _can_event_to_array_slow(s, msgtype))
+  return np.concatenate(events)
+
+
+def can_array_dat_mask(frames: np.ndarray) -> np.ndarray:
+  """Which bytes of each frame's dat are data"""
+  return np.arange(CAN_DAT_LEN) < frames['length'][:, None]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+from openpilot.selfdrive.pandad import can_capnp_to_array, can_capnp_to_list, can_list_to_can_capnp
+from openpilot.selfdrive.pandad.tests.test_pandad_api_impl import random_can_list
+
+
+def time_call(function, *args, repeat: int = 3) -> float:
+  times = []
+  for _ in range(repeat):
+    start = time.monotonic()
+    function(*args)
+    times.append(time.monotonic() - start)
+  return min(times)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark decoding CAN events to numpy arrays against the tuple lists")
+  parser.add_argument("--events", type=int, default=1000)
+  args = parser.parse_args()
+
+  rng = random.Random(0)
+  for n_frames in [10, 100, 500]:
+    can_lists = [random_can_list(rng, n_frames) for _ in range(args.events)]
+    strings = [can_list_to_can_capnp(can_list) for can_list in can_lists]
+    n = args.events * n_frames
+
+    list_decode = time_call(can_capnp_to_list, strings)
+    array_decode = time_call(can_capnp_to_array, strings)
+
+    print(f"{args.events} events of {n_frames} frames, per frame:")
+    print(f"  decode: list {list_decode / n * 1e6:.3f} us, array {array_decode / n * 1e6:.3f} us, speedup {list_decode / array_decode:.1f}x")
@@ -0,0 +1,61 @@
+import random
+
+import capnp
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.pandad import can_capnp_to_array, can_capnp_to_list, can_list_to_can_capnp
+from openpilot.selfdrive.pandad.pandad_api_impl import CAN_DAT_LEN, _can_layout, can_array_dat_mask
+
+
+def random_can_list(rng: random.Random, n_frames: int) -> list[tuple[int, bytes, int]]:
+  return [(rng.randrange(2**29), rng.randbytes(rng.choice([0, 1, 5, 8, 12, 32, 64])), rng.randrange(256)) for _ in range(n_frames)]
+
+
+def corrupt_pointer(s: bytes, pointer_word: int, offset: int) -> bytes:
+  """Moves the target of the struct or list pointer at the given word of a single segment message"""
+  words = np.frombuffer(s, dtype='<u8').copy()
+  words[1 + pointer_word] += np.uint64(offset << 2)
+  return words.tobytes()
+
+
+def array_to_list(frames: np.ndarray) -> list[tuple[int, bytes, int]]:
+  return [(int(f['address']), f['dat'][:f['length']].tobytes(), int(f['src'])) for f in frames]
+
+
+class TestCanArrays:
+  @pytest.mark.parametrize("msgtype", ["can", "sendcan"])
+  @pytest.mark.parametrize("n_frames", [0, 1, 100, 3000])
+  def test_matches_list(self, msgtype, n_frames):
+    rng = random.Random(n_frames)
+    # large events spill into more segments, reached through far pointers
+    strings = [can_list_to_can_capnp(random_can_list(rng, n_frames), msgtype=msgtype) for _ in range(3)]
+    frames = can_capnp_to_array(strings, msgtype)
+    expected = can_capnp_to_list(strings, msgtype)
+
+    assert len(frames) == sum(len(f) for _, f in expected)
+    assert frames['nanos'].tolist() == [nanos for nanos, f in expected for _ in f]
+    assert array_to_list(frames) == [frame for _, f in expected for frame in f]
+    assert not frames['dat'][~can_array_dat_mask(frames)].any()
+
+  @pytest.mark.parametrize("pointer", ["root", "list", "dat"])
+  def test_corrupted_pointer(self, pointer):
+    # single segment, one frame: root pointer, Event, frame list tag, frame, then its data
+    layout = _can_layout('can')
+    s = can_list_to_can_capnp([(0x123, b'\xaa' * 8, 1)])
+    frame = 1 + layout.event_data_words + layout.event_pointers + 1
+    pointer_word = {'root': 0, 'list': 1 + layout.event_data_words + layout.list_pointer, 'dat': frame + layout.frame_data_words + layout.dat_pointer}
+    bad = corrupt_pointer(s, pointer_word[pointer], 4)
+    good = can_list_to_can_capnp(random_can_list(random.Random(0), 50))
+
+    # pointing past the end of its message has to fail, not read from the next one
+    for strings in ([bad], [bad, good], [good, bad, good]):
+      with pytest.raises(capnp.KjException):
+        can_capnp_to_list(strings)
+      with pytest.raises(capnp.KjException):
+        can_capnp_to_array(strings)
+
+  def test_errors(self):
+    with pytest.raises(ValueError):
+      can_capnp_to_array([can_list_to_can_capnp([(1, bytes(CAN_DAT_LEN + 1), 0)])])
+    assert len(can_capnp_to_array([])) == 0
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import bisect
 import math
 import os
 from enum import IntEnum
@@ -48,43 +47,134 @@ class ET:
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
+NUM_EVENTS = max(EVENT_NAME) + 1
+
+
+def _event_bits(mask: int) -> list[int]:
+  """The event names set in an event bitmask, in ascending order"""
+  bits = []
+  while mask:
+    low = mask & -mask
+    bits.append(low.bit_length() - 1)
+    mask ^= low
+  return bits
+
+
+class EventTable(dict[int, dict[str, "Alert | AlertCallbackType"]]):
+  """
+  Alerts by event name and type. Keeps a bitmask of the events that have an alert
+  for each event type, which is rebuilt when events are added or removed.
+  """
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._et_masks: dict[str, int] | None = None
+
+  @property
+  def et_masks(self) -> dict[str, int]:
+    if self._et_masks is None:
+      masks: dict[str, int] = {}
+      for e, alerts in self.items():
+        for et in alerts:
+          masks[et] = masks.get(et, 0) | (1 << e)
+      self._et_masks = masks
+    return self._et_masks
+
+  def __setitem__(self, key, value):
+    super().__setitem__(key, value)
+    self._et_masks = None
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self._et_masks = None
+
+  def update(self, *args, **kwargs):
+    super().update(*args, **kwargs)
+    self._et_masks = None
+
+  def pop(self, *args):
+    self._et_masks = None
+    return super().pop(*args)
+
+  def popitem(self):
+    self._et_masks = None
+    return super().popitem()
+
+  def setdefault(self, key, default=None):
+    self._et_masks = None
+    return super().setdefault(key, default)
+
+  def clear(self):
+    super().clear()
+    self._et_masks = None
 
 
 class Events:
+  """
+  Active events as a bitmask indexed by event name. Events added more than once, which is rare,
+  are also counted in extra. Event types are checked against the per type masks of EVENTS.
+  """
   def __init__(self):
-    self.events: list[int] = []
-    self.static_events: list[int] = []
-    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+    self.mask = 0
+    self.extra: dict[int, int] = {}
+    self.static_mask = 0
+    self.static_extra: dict[int, int] = {}
+    self.event_counters = [0] * NUM_EVENTS
+    self._bits_mask = 0
+    self._bits: list[int] = []
+
+  def _active(self) -> list[int]:
+    if self.mask != self._bits_mask:
+      self._bits = _event_bits(self.mask)
+      self._bits_mask = self.mask
+    return self._bits
 
   @property
   def names(self) -> list[int]:
-    return self.events
+    if not self.extra:
+      return self._active()
+    return [e for e in self._active() for _ in range(1 + self.extra.get(e, 0))]
 
   def __len__(self) -> int:
-    return len(self.events)
+    return len(self._active()) + sum(self.extra.values())
 
   def add(self, event_name: int, static: bool=False) -> None:
+    bit = 1 << event_name
     if static:
-      bisect.insort(self.static_events, event_name)
-    bisect.insort(self.events, event_name)
+      if self.static_mask & bit:
+        self.static_extra[event_name] = self.static_extra.get(event_name, 0) + 1
+      self.static_mask |= bit
+    if self.mask & bit:
+      self.extra[event_name] = self.extra.get(event_name, 0) + 1
+    self.mask |= bit
 
   def clear(self) -> None:
-    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
-    self.events = self.static_events.copy()
+    prev_counters = self.event_counters
+    self.event_counters = [0] * NUM_EVENTS
+    for e in self._active():
+      self.event_counters[e] = prev_counters[e] + 1
+    self.mask = self.static_mask
+    self.extra = self.static_extra.copy()
 
   def contains(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return bool(self.mask & EVENTS.et_masks.get(event_type, 0))
 
   def create_alerts(self, event_types: list[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
+    et_masks = EVENTS.et_masks
+    mask = 0
+    for et in event_types:
+      mask |= et_masks.get(et, 0)
+
     ret = []
-    for e in self.events:
-      types = EVENTS[e].keys()
+    for e in self.names:
+      if not (mask >> e) & 1:
+        continue
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
+        if et in alerts:
+          alert = alerts[et]
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
 
@@ -96,11 +186,11 @@ class Events:
 
   def add_from_msg(self, events):
     for e in events:
-      bisect.insort(self.events, e.name.raw)
+      self.add(e.name.raw)
 
   def to_msg(self):
     ret = []
-    for event_name in self.events:
+    for event_name in self.names:
       event = log.OnroadEvent.new_message()
       event.name = event_name
       for event_type in EVENTS.get(event_name, {}):
@@ -390,7 +480,7 @@ def invalid_lkas_setting_alert(CP: car.CarParams, CS: car.CarState, sm: messagin
 
 
 
-EVENTS: dict[int, dict[str, Alert | AlertCallbackType]] = {
+EVENTS: EventTable = EventTable({
   # ********** events with no alerts **********
 
   EventName.stockFcw: {},
@@ -1022,7 +1112,7 @@ EVENTS: dict[int, dict[str, Alert | AlertCallbackType]] = {
   EventName.audioFeedback: {
     ET.PERMANENT: audio_feedback_alert,
   },
-}
+})
 
 
 if HARDWARE.get_device_type() == 'mici':
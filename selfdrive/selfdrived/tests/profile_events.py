@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import random
+import time
+
+from cereal import car, log
+from openpilot.common.realtime import DT_CTRL
+from openpilot.selfdrive.selfdrived.events import Alert, EVENTS, EVENT_NAME, ET, Events
+from openpilot.selfdrive.selfdrived.state import StateMachine
+
+EventName = log.OnroadEvent.EventName
+
+
+class ReferenceEvents:
+  """The sorted list Events used to be, for comparison"""
+  def __init__(self):
+    self.events: list[int] = []
+    self.static_events: list[int] = []
+    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+
+  @property
+  def names(self) -> list[int]:
+    return self.events
+
+  def __len__(self) -> int:
+    return len(self.events)
+
+  def add(self, event_name: int, static: bool=False) -> None:
+    if static:
+      bisect.insort(self.static_events, event_name)
+    bisect.insort(self.events, event_name)
+
+  def clear(self) -> None:
+    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
+    self.events = self.static_events.copy()
+
+  def contains(self, event_type: str) -> bool:
+    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+
+  def create_alerts(self, event_types: list[str], callback_args=None):
+    if callback_args is None:
+      callback_args = []
+
+    ret = []
+    for e in self.events:
+      types = EVENTS[e].keys()
+      for et in event_types:
+        if et in types:
+          alert = EVENTS[e][et]
+          if not isinstance(alert, Alert):
+            alert = alert(*callback_args)
+
+          if DT_CTRL * (self.event_counters[e] + 1) >= alert.creation_delay:
+            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
+            alert.event_type = et
+            ret.append(alert)
+    return ret
+
+  def to_msg(self):
+    ret = []
+    for event_name in self.events:
+      event = log.OnroadEvent.new_message()
+      event.name = event_name
+      for event_type in EVENTS.get(event_name, {}):
+        setattr(event, event_type, True)
+      ret.append(event)
+    return ret
+
+
+def random_cycles(rng: random.Random, num_cycles: int) -> list[list[int]]:
+  """
+  Events added on each selfdrived cycle. Events that stay on for a while, like they do
+  on the road, with the occasional duplicate. Events with alert callbacks are left out,
+  those need a running SubMaster.
+  """
+  names = [e for e, alerts in EVENTS.items() if not any(callable(a) for a in alerts.values())]
+  active: list[int] = []
+  cycles = []
+  for _ in range(num_cycles):
+    if rng.random() < 0.05:
+      active.append(rng.choice(names))
+    if active and rng.random() < 0.05:
+      active.pop(rng.randrange(len(active)))
+    cycles.append(active + rng.sample(names, rng.choice([0] * 18 + [1, 2])))
+  return cycles
+
+
+def run_cycles(events, cycles: list[list[int]]) -> list[tuple]:
+  """Exercises Events the way SelfdriveD.step does, returning what each cycle produced"""
+  state_machine = StateMachine()
+  events.add(EventName.dashcamMode, static=True)
+  events_prev: list[int] = []
+  out = []
+  for frame, cycle in enumerate(cycles):
+    events.clear()
+    for e in cycle:
+      events.add(e)
+    state_machine.update(events)
+    alerts = events.create_alerts(state_machine.current_alert_types)
+    engageable = not events.contains(ET.NO_ENTRY)
+    if frame % int(1. / DT_CTRL) == 0 or events.names != events_prev:
+      msgs = [(e.name.raw, e.to_bytes()) for e in events.to_msg()]
+    else:
+      msgs = []
+    events_prev = events.names.copy()
+    out.append((state_machine.state, engageable, len(events), [(a.alert_type, a.event_type) for a in alerts], msgs))
+  return out
+
+
+def time_cycles(events_cls, cycles: list[list[int]], repeat: int = 3) -> float:
+  times = []
+  for _ in range(repeat):
+    start = time.monotonic()
+    run_cycles(events_cls(), cycles)
+    times.append(time.monotonic() - start)
+  return min(times)
+
+
+def time_selfdrived_step(num_steps: int) -> list[float]:
+  """Times SelfdriveD.step with carState published every cycle, like card does"""
+  import cereal.messaging as messaging
+  from openpilot.selfdrive.selfdrived.selfdrived import SelfdriveD
+
+  CP = car.CarParams.new_message(brand="mock")
+  sd = SelfdriveD(CP)
+  pm = messaging.PubMaster(['carState'])
+  time.sleep(0.5)
+
+  times = []
+  for _ in range(num_steps):
+    pm.send('carState', messaging.new_message('carState'))
+    start = time.monotonic()
+    sd.step()
+    times.append(time.monotonic() - start)
+  return times
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark Events bitmasks against a sorted event list, and time SelfdriveD.step")
+  parser.add_argument("--cycles", type=int, default=20000, help="selfdrived cycles to simulate")
+  parser.add_argument("--step", action="store_true", help="also time SelfdriveD.step, needs messaging")
+  args = parser.parse_args()
+
+  cycles = random_cycles(random.Random(0), args.cycles)
+  assert run_cycles(Events(), cycles) == run_cycles(ReferenceEvents(), cycles)
+
+  reference_time = time_cycles(ReferenceEvents, cycles)
+  bitmask_time = time_cycles(Events, cycles)
+  print(f"{len(cycles)} cycles, {sum(len(c) for c in cycles) / len(cycles):.1f} events / cycle")
+  print(f"  sorted list: {reference_time:.2f} s ({reference_time / len(cycles) * 1e6:.1f} us / cycle)")
+  print(f"  bitmask:     {bitmask_time:.2f} s ({bitmask_time / len(cycles) * 1e6:.1f} us / cycle)")
+  print(f"  speedup: {reference_time / bitmask_time:.1f}x")
+
+  if args.step:
+    times = sorted(time_selfdrived_step(1000))
+    mean, median, p99 = sum(times) / len(times), times[len(times) // 2], times[int(len(times) * 0.99)]
+    print(f"SelfdriveD.step: mean {mean * 1e3:.3f} ms, median {median * 1e3:.3f} ms, p99 {p99 * 1e3:.3f} ms")
@@ -0,0 +1,90 @@
+from cereal import log
+from openpilot.selfdrive.selfdrived.events import Events, ET, EVENTS, NormalPermanentAlert
+
+EventName = log.OnroadEvent.EventName
+
+
+class TestEvents:
+  def test_names(self):
+    events = Events()
+    assert events.names == [] and len(events) == 0
+    for e in (EventName.seatbeltNotLatched, EventName.doorOpen, EventName.reverseGear, EventName.wrongGear):
+      events.add(e)
+    # ordered by event name, not by when they were added
+    assert events.names == sorted([EventName.seatbeltNotLatched, EventName.doorOpen, EventName.reverseGear, EventName.wrongGear])
+    assert len(events) == 4
+
+  def test_contains(self):
+    events = Events()
+    events.add(EventName.doorOpen)
+    assert events.contains(ET.NO_ENTRY) and events.contains(ET.SOFT_DISABLE)
+    assert not events.contains(ET.PERMANENT) and not events.contains(ET.USER_DISABLE)
+    events.add(EventName.reverseGear)
+    assert events.contains(ET.PERMANENT) and events.contains(ET.USER_DISABLE)
+    events.clear()
+    assert not events.contains(ET.NO_ENTRY)
+
+  def test_counters(self):
+    events = Events()
+    for _ in range(3):
+      events.clear()
+      events.add(EventName.doorOpen)
+      events.add(EventName.reverseGear)
+    events.clear()
+    events.add(EventName.doorOpen)
+    assert events.event_counters[EventName.doorOpen] == 3
+    assert events.event_counters[EventName.reverseGear] == 3
+    events.clear()
+    assert events.event_counters[EventName.doorOpen] == 4
+    assert events.event_counters[EventName.reverseGear] == 0
+
+  def test_creation_delay(self):
+    # the reverse gear permanent alert is created after being active for 0.5 s
+    events = Events()
+    for cycle in range(52):
+      events.clear()
+      events.add(EventName.reverseGear)
+      alerts = [(a.alert_type, a.event_type) for a in events.create_alerts([ET.PERMANENT, ET.NO_ENTRY])]
+      if cycle < 49:
+        assert alerts == [("reverseGear/noEntry", ET.NO_ENTRY)], cycle
+      else:
+        assert alerts == [("reverseGear/permanent", ET.PERMANENT), ("reverseGear/noEntry", ET.NO_ENTRY)], cycle
+
+  def test_to_msg(self):
+    events = Events()
+    events.add(EventName.reverseGear)
+    events.add(EventName.doorOpen)
+    msgs = {e.name.raw: e for e in events.to_msg()}
+    assert list(msgs) == sorted([EventName.reverseGear, EventName.doorOpen])
+    assert msgs[EventName.doorOpen].noEntry and msgs[EventName.doorOpen].softDisable
+    assert not msgs[EventName.doorOpen].permanent and not msgs[EventName.doorOpen].userDisable
+    assert msgs[EventName.reverseGear].permanent and msgs[EventName.reverseGear].userDisable and msgs[EventName.reverseGear].noEntry
+
+  def test_duplicates(self):
+    events = Events()
+    events.add(EventName.dashcamMode, static=True)
+    events.add(EventName.dashcamMode, static=True)
+    for e in (EventName.reverseGear, EventName.doorOpen, EventName.reverseGear):
+      events.add(e)
+    assert events.names == sorted([EventName.dashcamMode] * 2 + [EventName.reverseGear] * 2 + [EventName.doorOpen])
+    assert len(events) == 5
+    assert [e.name.raw for e in events.to_msg()] == events.names
+    assert len(events.create_alerts([ET.NO_ENTRY])) == 3
+
+    events.clear()
+    assert events.names == [EventName.dashcamMode] * 2
+    assert events.event_counters[EventName.reverseGear] == 1
+
+  def test_event_table_update(self):
+    events = Events()
+    events.add(EventName.stockFcw)
+    assert not events.contains(ET.PERMANENT)
+
+    alerts = EVENTS[EventName.stockFcw]
+    try:
+      EVENTS[EventName.stockFcw] = {ET.PERMANENT: NormalPermanentAlert("alert")}
+      assert events.contains(ET.PERMANENT)
+      assert len(events.create_alerts([ET.PERMANENT])) == 1
+    finally:
+      EVENTS[EventName.stockFcw] = alerts
+    assert not events.contains(ET.PERMANENT)
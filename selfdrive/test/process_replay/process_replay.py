@@ -4,10 +4,9 @@ import time
 import copy
 import heapq
 import signal
-import numpy as np
-from collections import Counter
+from collections import Counter, deque
 from dataclasses import dataclass, field
-from itertools import islice
+from itertools import count, islice
 from typing import Any
 from collections.abc import Callable, Iterable
 from tqdm import tqdm
@@ -152,6 +151,8 @@ class ProcessContainer:
     self.vipc_server: VisionIpcServer | None = None
     self.environ_config: dict[str, Any] | None = None
     self.capture: ProcessOutputCapture | None = None
+    # wall time of each run_step that ran a cycle of the process
+    self.step_times: list[float] = []
 
   @property
   def has_empty_queue(self) -> bool:
@@ -281,6 +282,7 @@ class ProcessContainer:
 
     self.msg_queue.append(msg)
     if end_of_cycle:
+      step_start = time.monotonic()
       with self.prefix, Timeout(self.cfg.timeout, error_msg=f"timed out testing process {repr(self.cfg.proc_name)}"):
         # call recv to let sub-sockets reconnect, after we know the process is ready
         if self.cnt == 0:
@@ -302,18 +304,9 @@ class ProcessContainer:
             camera_state = getattr(m, m.which())
             camera_meta = meta_from_camera_state(m.which())
             assert frs is not None
-            img = frs[m.which()].get(camera_state.frameId)
-
-            h, w = frs[m.which()].h, frs[m.which()].w
-            stride, y_height, _, yuv_size = get_nv12_info(w, h)
-            uv_offset = stride * y_height
-            padded_img = np.zeros(((uv_offset //stride) + (h // 2), stride))
-            padded_img[:h, :w] = img[:h * w].reshape((-1, w))
-            padded_img[uv_offset // stride:uv_offset // stride + h // 2, :w] = img[h * w:].reshape((-1, w))
-            img_bytes = np.zeros((yuv_size,), dtype=np.uint8)
-            img_bytes[:padded_img.size] = padded_img.flatten()
-
-            self.vipc_server.send(camera_meta.stream, img_bytes.tobytes(),
+            # decoded straight into a buffer with camerad's padded NV12 layout
+            img = frs[m.which()].get_nv12(camera_state.frameId)
+            self.vipc_server.send(camera_meta.stream, img,
                                   camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
         self.msg_queue = []
 
@@ -321,6 +314,7 @@ class ProcessContainer:
         if trigger_empty_recv:
           self.rc.unlock_sockets()
         self.cnt += 1
+      self.step_times.append(time.monotonic() - step_start)
     assert self.process.proc.is_alive()
 
     return output_msgs
@@ -625,7 +619,8 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None = None,
   fingerprint: str | None = None, return_all_logs: bool = False, custom_params: dict[str, Any] | None = None,
-  captured_output_store: dict[str, dict[str, str]] | None = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] | None = None, disable_progress: bool = False,
+  step_timing_store: dict[str, list[float]] | None = None
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
@@ -636,7 +631,7 @@ def replay_process(
                          manager_states=True,
                          panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, step_timing_store)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -652,7 +647,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  step_timing_store: dict[str, list[float]] | None = None
 ) -> list[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -685,29 +681,26 @@ def _replay_multi_process(
     lr_pubs = all_pubs - all_subs
     pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
 
-    pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: list[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: list[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: list[tuple[int, int]] = []
+    # external queue for messages taken from logs; internal heap for messages generated by processes, which will be republished
+    # in logMonoTime order, ties broken by generation order. popped messages aren't referenced by the scheduler anymore
+    external_pub_queue: deque[capnp._DynamicStructReader] = deque(msg for msg in all_msgs if msg.which() in lr_pubs)
+    internal_pub_heap: list[tuple[int, int, capnp._DynamicStructReader]] = []
+    internal_pub_order = count()
 
     pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+    while len(external_pub_queue) != 0 or (len(internal_pub_heap) != 0 and not all(c.has_empty_queue for c in containers)):
+      if len(internal_pub_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_heap[0][0]):
+        msg = external_pub_queue.popleft()
         pbar.update(1)
       else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
+        msg = heapq.heappop(internal_pub_heap)[2]
 
       target_containers = pubs_to_containers[msg.which()]
       for container in target_containers:
         output_msgs = container.run_step(msg, frs)
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            heapq.heappush(internal_pub_heap, (m.logMonoTime, next(internal_pub_order), m))
         log_msgs.extend(output_msgs)
 
     # flush last set of messages from each process
@@ -721,6 +714,8 @@ def _replay_multi_process(
         assert container.capture is not None
         out, err = container.capture.read_outerr()
         captured_output_store[container.cfg.proc_name] = {"out": out, "err": err}
+      if step_timing_store is not None:
+        step_timing_store[container.cfg.proc_name] = container.step_times
 
   return log_msgs
 
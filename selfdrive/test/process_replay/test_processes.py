@@ -76,14 +76,15 @@ def run_test_process(data):
   segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
   ref_log_msgs = list(LogReader(ref_log_path))
   lr = LogReader.from_bytes(lr_dat)
-  res, log_msgs = test_process(cfg, lr, segment, ref_log_msgs, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+  step_times: dict[str, list[float]] = {}
+  res, log_msgs = test_process(cfg, lr, segment, ref_log_msgs, cur_log_fn, args.ignore_fields, args.ignore_msgs, step_times)
   # save logs so we can update refs
   save_log(cur_log_fn, log_msgs)
   try:
     diff_data = diff_process(cfg, ref_log_msgs, log_msgs)
   except Exception:
     diff_data = traceback.format_exc()
-  return (segment, cfg.proc_name, res, diff_data)
+  return (segment, cfg.proc_name, res, diff_data, step_times)
 
 
 def get_log_data(segment):
@@ -92,14 +93,14 @@ def get_log_data(segment):
     return (segment, f.read())
 
 
-def test_process(cfg, lr, segment, ref_log_msgs, new_log_path, ignore_fields=None, ignore_msgs=None):
+def test_process(cfg, lr, segment, ref_log_msgs, new_log_path, ignore_fields=None, ignore_msgs=None, step_timing_store=None):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
     ignore_msgs = []
 
   try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
+    log_msgs = replay_process(cfg, lr, disable_progress=True, step_timing_store=step_timing_store)
   except Exception as e:
     raise Exception("failed on segment: " + segment) from e
 
@@ -142,6 +143,8 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
+  parser.add_argument("--timings", action="store_true",
+                      help="Print how long each process spent in replay steps")
   args = parser.parse_args()
 
   tested_procs = set(args.whitelist_procs) - set(args.blacklist_procs)
@@ -207,10 +210,19 @@ if __name__ == "__main__":
 
     results: Any = defaultdict(dict)
     diffs: list = []
+    step_times: defaultdict[str, list[float]] = defaultdict(list)
     p2 = pool.map(run_test_process, pool_args)
-    for (segment, proc, result, diff_data) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
+    for (segment, proc, result, diff_data, proc_step_times) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
       results[segment][proc] = result
       diffs.append((segment, proc, diff_data))
+      for name, times in proc_step_times.items():
+        step_times[name].extend(times)
+
+  if args.timings:
+    print("\n***** replay step timings *****")
+    for name, times in sorted(step_times.items(), key=lambda x: sum(x[1]), reverse=True):
+      times_ms = [t * 1e3 for t in times]
+      print(f"{name}: {sum(times):.2f} s total, {len(times)} steps, {sum(times_ms) / max(len(times), 1):.3f} mean ms, {max(times_ms, default=0):.3f} max ms")
 
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not args.update_refs:
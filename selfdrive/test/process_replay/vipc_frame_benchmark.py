@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import numpy as np
+
+from msgq.visionipc import VisionIpcServer, VisionStreamType
+from openpilot.selfdrive.test.process_replay.model_replay import TEST_ROUTE, SEGMENT
+from openpilot.system.camerad.cameras.nv12_info import get_nv12_info
+from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.openpilotci import get_url
+
+STREAM = VisionStreamType.VISION_STREAM_ROAD
+
+
+def padded_nv12_copy(fr: FrameReader, fidx: int) -> np.ndarray:
+  """How ProcessContainer.run_step used to lay out frames for VisionIpcServer"""
+  img = fr.get(fidx)
+  h, w = fr.h, fr.w
+  stride, y_height, _, yuv_size = get_nv12_info(w, h)
+  uv_offset = stride * y_height
+  padded_img = np.zeros(((uv_offset //stride) + (h // 2), stride))
+  padded_img[:h, :w] = img[:h * w].reshape((-1, w))
+  padded_img[uv_offset // stride:uv_offset // stride + h // 2, :w] = img[h * w:].reshape((-1, w))
+  img_bytes = np.zeros((yuv_size,), dtype=np.uint8)
+  img_bytes[:padded_img.size] = padded_img.flatten()
+  return img_bytes.tobytes()
+
+
+def run(vipc_server: VisionIpcServer, fr: FrameReader, frames: range, get_frame) -> float:
+  start = time.monotonic()
+  for fidx in frames:
+    vipc_server.send(STREAM, get_frame(fr, fidx), fidx, 0, 0)
+  return len(frames) / (time.monotonic() - start)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Throughput of sending replayed camera frames to VisionIpcServer, as model_replay does")
+  parser.add_argument("--camera", default="fcamera.hevc")
+  parser.add_argument("--frames", type=int, default=200)
+  args = parser.parse_args()
+
+  fn = get_url(TEST_ROUTE, SEGMENT, args.camera)
+  fr = FrameReader(fn, pix_fmt="nv12", cache_size=args.frames)
+  frames = range(args.frames)
+
+  stride, y_height, _, yuv_size = get_nv12_info(fr.w, fr.h)
+  vipc_server = VisionIpcServer("camerad")
+  vipc_server.create_buffers_with_sizes(STREAM, 2, fr.w, fr.h, yuv_size, stride, stride * y_height)
+  vipc_server.start_listener()
+
+  # model_replay sends frames that are already decoded and cached
+  for fidx in frames:
+    fr.get(fidx)
+  print(f"{args.camera}, {fr.w}x{fr.h}, {len(frames)} frames")
+  print(f"cached, padded copy:  {run(vipc_server, fr, frames, padded_nv12_copy):.1f} frames/s")
+  print(f"cached, get_nv12:     {run(vipc_server, fr, frames, FrameReader.get_nv12):.1f} frames/s")
+
+  # decoding included, as replays of whole segments do
+  for name, get_frame in [("padded copy", padded_nv12_copy), ("get_nv12", FrameReader.get_nv12)]:
+    fr = FrameReader(fn, pix_fmt="nv12", cache_size=1)
+    print(f"decoding, {name + ':':<13} {run(vipc_server, fr, frames, get_frame):.1f} frames/s")
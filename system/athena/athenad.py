@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import base64
+import bisect
 import hashlib
+import heapq
 import io
 import json
 import os
@@ -31,6 +33,7 @@ import cereal.messaging as messaging
 from cereal import log
 from cereal.services import SERVICE_LIST
 from openpilot.common.api import Api, get_key_pair
+from openpilot.common.inotify import Inotify, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW
 from openpilot.common.utils import CallbackReader, get_upload_stream
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
@@ -47,6 +50,10 @@ LOCAL_PORT_WHITELIST = {22, }  # SSH
 
 LOG_ATTR_NAME = 'user.upload'
 LOG_ATTR_VALUE_MAX_UNIX_TIME = int.to_bytes(2147483647, 4, sys.byteorder)
+LOG_RETRY_INTERVAL = 3600  # seconds, assume send failed and we lost the response after this
+LOG_RESPONSE_TIMEOUT = 100  # seconds
+LOG_WINDOW = 4  # forwardLogs requests in flight
+LOG_BATCH_BYTES = 1024 * 1024
 RECONNECT_TIMEOUT_S = 70
 
 RETRY_DELAY = 10  # seconds
@@ -575,86 +582,201 @@ def takeSnapshot() -> str | dict[str, str] | None:
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted() -> list[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())  # noqa: TID251
-  logs = []
-  for log_entry in os.listdir(Paths.swaglog_root()):
-    log_path = os.path.join(Paths.swaglog_root(), log_entry)
-    time_sent = 0
-    try:
-      value = getxattr(log_path, LOG_ATTR_NAME)
-      if value is not None:
-        time_sent = int.from_bytes(value, sys.byteorder)
-    except (ValueError, TypeError):
-      pass
-    # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+def get_log_sent_time(log_path: str) -> int:
+  try:
+    value = getxattr(log_path, LOG_ATTR_NAME)
+    if value is not None:
+      return int.from_bytes(value, sys.byteorder)
+  except (ValueError, TypeError):
+    pass
+  return 0
+
+
+class SwaglogQueue:
+  """
+  Rotated swaglog files that haven't been forwarded yet, popped newest first.
+  Seeded with one scan of the swaglog root and then kept current with inotify, a new
+  file means the previous one is complete. Files that are sent but never confirmed
+  are queued again after LOG_RETRY_INTERVAL. Without inotify the root is rescanned every 10s.
+  """
+  WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+  def __init__(self, root: str):
+    self.root = root
+    self.logs: set[str] = set()
+    self.active: str | None = None
+    self.pending: list[str] = []  # sorted, entries that are gone are dropped when reached
+    self.unconfirmed: set[str] = set()
+    self.retries: list[tuple[float, str]] = []
+
+    self.inotify: Inotify | None = None
+    self.last_scan = 0.
+    self.seeded = False
+
+  def seed(self) -> None:
+    self.close()
+    if Inotify.available():
+      try:
+        self.inotify = Inotify()
+        self.inotify.add_watch(self.root, self.WATCH_MASK)
+      except OSError:
+        cloudlog.exception("athena.log_handler.inotify_failed")
+        self.close()
+
+    names = sorted(os.listdir(self.root))
+    self.logs = set(names)
+    self.active = names[-1] if names else None
+    self.pending.clear()
+    self.unconfirmed.clear()
+    self.retries.clear()
+
+    curr_time = int(time.time())  # noqa: TID251
+    for name in names[:-1]:
+      time_sent = get_log_sent_time(os.path.join(self.root, name))
+      if not time_sent or curr_time - time_sent > LOG_RETRY_INTERVAL:
+        self.pending.append(name)
+      elif time_sent != int.from_bytes(LOG_ATTR_VALUE_MAX_UNIX_TIME, sys.byteorder):
+        self.unconfirmed.add(name)
+        heapq.heappush(self.retries, (time.monotonic() + LOG_RETRY_INTERVAL - (curr_time - time_sent), name))
+
+    self.last_scan = time.monotonic()
+    self.seeded = True
+
+  def update(self) -> None:
+    if not self.seeded or (self.inotify is None and time.monotonic() - self.last_scan > 10):
+      self.seed()
+      return
+
+    if self.inotify is not None:
+      for _, mask, _, name in self.inotify.read():
+        if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+          self.seed()
+          return
+        if mask & IN_ISDIR:
+          continue
+
+        if mask & (IN_CREATE | IN_MOVED_TO):
+          self.logs.add(name)
+          if self.active is None or name > self.active:
+            name, self.active = self.active, name
+          if name is not None:
+            bisect.insort(self.pending, name)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+          self.logs.discard(name)
+          self.unconfirmed.discard(name)
+
+    while self.retries and self.retries[0][0] <= time.monotonic():
+      _, name = heapq.heappop(self.retries)
+      if name in self.unconfirmed and name in self.logs:
+        self.unconfirmed.discard(name)
+        bisect.insort(self.pending, name)
+
+  def pop_batch(self, max_bytes: int) -> list[str]:
+    batch: list[str] = []
+    size = 0
+    while self.pending:
+      name = self.pending[-1]
+      if name not in self.logs or name == self.active or name in self.unconfirmed:
+        self.pending.pop()
+        continue
+      try:
+        sz = os.path.getsize(os.path.join(self.root, name))
+      except OSError:
+        self.pending.pop()
+        self.logs.discard(name)
+        continue
+      if batch and size + sz > max_bytes:
+        break
+      self.pending.pop()
+      batch.append(name)
+      size += sz
+    return batch
+
+  def sent(self, name: str) -> None:
+    self.unconfirmed.add(name)
+    heapq.heappush(self.retries, (time.monotonic() + LOG_RETRY_INTERVAL, name))
+
+  def confirmed(self, name: str) -> None:
+    self.unconfirmed.discard(name)
+
+  def close(self) -> None:
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
 
 
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
-  last_scan = 0.
-  while not end_event.is_set():
-    try:
-      curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
-        last_scan = curr_scan
+  log_queue = SwaglogQueue(Paths.swaglog_root())
+  # forwardLogs requests waiting for a response, by id
+  in_flight: dict[str, tuple[float, list[str]]] = {}
+  try:
+    while not end_event.is_set():
+      try:
+        log_queue.update()
+
+        # a lost response only frees up the window, the logs are sent again after LOG_RETRY_INTERVAL
+        curr_scan = time.monotonic()
+        for log_id, (sent_at, _) in list(in_flight.items()):
+          if curr_scan - sent_at > LOG_RESPONSE_TIMEOUT:
+            del in_flight[log_id]
+
+        # keep up to LOG_WINDOW requests in flight, each with a batch of the newest logs
+        while len(in_flight) < LOG_WINDOW:
+          batch = log_queue.pop_batch(LOG_BATCH_BYTES)
+          if not batch:
+            break
 
-      # send one log
-      curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
           curr_time = int(time.time())  # noqa: TID251
-          log_path = os.path.join(Paths.swaglog_root(), log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
+          contents, sent = [], []
+          for log_entry in batch:
+            log_path = os.path.join(Paths.swaglog_root(), log_entry)
+            try:
+              setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
+              with open(log_path) as f:
+                contents.append(f.read())
+            except OSError:
+              continue  # file could be deleted by log rotation
+            log_queue.sent(log_entry)
+            sent.append(log_entry)
+
+          if sent:
+            cloudlog.debug(f"athena.log_handler.forward_request {sent}")
             jsonrpc = {
               "method": "forwardLogs",
               "params": {
-                "logs": f.read()
+                "logs": "".join(c if c.endswith("\n") else c + "\n" for c in contents)
               },
               "jsonrpc": "2.0",
-              "id": log_entry
+              "id": sent[0]
             }
             low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
+            in_flight[sent[0]] = (time.monotonic(), sent)
 
-      # wait for response up to ~100 seconds
-      # always read queue at least once to process any old responses that arrive
-      for _ in range(100):
-        if end_event.is_set():
-          break
         try:
           log_resp = json.loads(log_recv_queue.get(timeout=1))
-          log_entry = log_resp.get("id")
-          log_success = "result" in log_resp and log_resp["result"].get("success")
-          cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
-          if log_entry and log_success:
-            log_path = os.path.join(Paths.swaglog_root(), log_entry)
+        except queue.Empty:
+          continue
+
+        log_entry = log_resp.get("id")
+        log_success = "result" in log_resp and log_resp["result"].get("success")
+        cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
+        # responses to requests from an earlier connection only cover the file named by the id
+        _, log_entries = in_flight.pop(log_entry, (0., [log_entry]))
+        if log_entry and log_success:
+          for log_entry in log_entries:
+            log_queue.confirmed(log_entry)
             try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+              setxattr(os.path.join(Paths.swaglog_root(), log_entry), LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
             except OSError:
               pass  # file could be deleted by log rotation
-          if curr_log == log_entry:
-            break
-        except queue.Empty:
-          if curr_log is None:
-            break
 
-    except Exception:
-      cloudlog.exception("athena.log_handler.exception")
+      except Exception:
+        cloudlog.exception("athena.log_handler.exception")
+  finally:
+    log_queue.close()
 
 
 def stat_handler(end_event: threading.Event) -> None:
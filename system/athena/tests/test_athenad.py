@@ -436,13 +436,53 @@ class TestAthenadMethods:
       end_event.set()
       thread.join()
 
-  def test_get_logs_to_send_sorted(self):
+  def test_swaglog_queue(self):
     fl = list()
     for i in range(10):
       file = f'swaglog.{i:010}'
       self._create_file(file, Paths.swaglog_root())
       fl.append(file)
 
-    # ensure the list is all logs except most recent
-    sl = athenad.get_logs_to_send_sorted()
-    assert sl == fl[:-1]
+    # all logs except the most recent one, newest first
+    log_queue = athenad.SwaglogQueue(Paths.swaglog_root())
+    try:
+      log_queue.update()
+      assert log_queue.pop_batch(2**30) == fl[:-1][::-1]
+
+      # a new log completes the previous one
+      self._create_file('swaglog.0000000010', Paths.swaglog_root())
+      log_queue.update()
+      assert log_queue.pop_batch(2**30) == [fl[-1]]
+    finally:
+      log_queue.close()
+
+  def test_log_handler(self, mocker):
+    mocker.patch('openpilot.system.athena.athenad.PC', False)
+    fl = list()
+    for i in range(20):
+      file = f'swaglog.{i:010}'
+      self._create_file(file, Paths.swaglog_root(), data=f'{file}\n'.encode() * 10000)
+      fl.append(file)
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.log_handler, args=(end_event,))
+    thread.start()
+    try:
+      forwarded, num_requests = [], 0
+      with Timeout(10, 'logs not forwarded'):
+        while len(forwarded) < len(fl) - 1:
+          req = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+          num_requests += 1
+          forwarded += sorted(set(req['params']['logs'].splitlines()))
+          athenad.log_recv_queue.put_nowait(json.dumps({'result': {'success': 1}, 'id': req['id'], 'jsonrpc': '2.0'}))
+    finally:
+      end_event.set()
+      thread.join()
+
+    # every log except the active one is forwarded once, batched into fewer requests
+    assert sorted(forwarded) == fl[:-1]
+    assert num_requests < len(forwarded)
+    log_queue = athenad.SwaglogQueue(Paths.swaglog_root())
+    log_queue.update()
+    assert log_queue.pop_batch(2**30) == []
+    log_queue.close()
@@ -7,7 +7,7 @@ from pathlib import Path
 from openpilot.system.hardware.hw import Paths
 
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.uploader import main, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd.uploader import main, UploadIndex, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
 
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
@@ -163,6 +163,23 @@ class TestUploader(UploaderTestCase):
       uploaded = UPLOAD_ATTR_NAME in os.listxattr(fn) and os.getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
       assert not uploaded, "File upload when locked"
 
+  def test_upload_after_lock_released(self):
+    self.start_thread()
+
+    time.sleep(0.25)
+    f_paths = self.gen_files(lock=True, boot=False)
+    time.sleep(0.25)
+    assert len(log_handler.upload_order) == 0, "File upload when locked"
+
+    # segment is finished, the index should pick it up without a rescan
+    for f_path in f_paths:
+      f_path.with_suffix(f_path.suffix + ".lock").unlink()
+    time.sleep(1)
+    self.join_thread()
+
+    exp_order = self.gen_order([self.seg_num], [], boot=False)
+    assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
+
   def test_no_upload_with_xattr(self):
     self.gen_files(lock=False, xattr=UPLOAD_ATTR_VALUE)
 
@@ -182,3 +199,67 @@ class TestUploader(UploaderTestCase):
     for f_path in f_paths:
       lock_path = f_path.with_suffix(f_path.suffix + ".lock")
       assert not lock_path.is_file(), "File lock not cleared on startup"
+
+
+class TestUploadIndex:
+  def make_index(self, root: Path) -> UploadIndex:
+    index = UploadIndex(str(root), ["crash/"], {"qlog": 0})
+    index.update()
+    return index
+
+  def test_ctime_of_closed_file(self, tmp_path):
+    (tmp_path / "crash").mkdir()
+    index = self.make_index(tmp_path)
+    fn = tmp_path / "crash" / "error.log"
+    with open(fn, "wb") as f:
+      index.update()
+      time.sleep(0.01)
+      f.write(b"\0" * 1024)
+
+    # the file was indexed when it was created, it's judged by the ctime it has now
+    ctimes = []
+    assert index.next_file(lambda logdir, name, ctime: ctimes.append(ctime)) == ("crash", "error.log")
+    assert ctimes == [os.path.getctime(fn)]
+
+  def test_skipped_files(self, tmp_path):
+    for i in range(3):
+      (tmp_path / f"segment--{i}").mkdir()
+      (tmp_path / f"segment--{i}" / "qlog").write_bytes(b"\0")
+    (tmp_path / "segment--1" / "qlog.lock").write_bytes(b"")
+    index = self.make_index(tmp_path)
+
+    checked = []
+    def skip(logdir, name, ctime):
+      checked.append(logdir)
+      return logdir != "segment--2" or skip_all
+    skip_all = True
+
+    # skipped files aren't looked at again while the conditions stay the same
+    for _ in range(3):
+      assert index.next_file(skip, skip_key=True) is None
+    assert checked == ["segment--0", "segment--2"]
+
+    checked.clear()
+    skip_all = False
+    assert index.next_file(skip, skip_key=False) == ("segment--2", "qlog")
+    assert checked == ["segment--0", "segment--2"]
+
+    # a released lock gets its segment checked again
+    checked.clear()
+    (tmp_path / "segment--1" / "qlog.lock").unlink()
+    index.update()
+    assert index.next_file(skip, skip_key=False) == ("segment--2", "qlog")
+    assert checked == ["segment--0", "segment--1", "segment--2"]
+
+    # and so does everything once SKIP_RECHECK_INTERVAL passed, skipping may depend on the time
+    checked.clear()
+    index.recheck_time = time.monotonic()
+    assert index.next_file(skip, skip_key=False) == ("segment--2", "qlog")
+    assert checked == ["segment--0", "segment--1", "segment--2"]
+
+    # deleted files are dropped
+    (tmp_path / "segment--2" / "qlog").unlink()
+    index.update()
+    checked.clear()
+    assert index.next_file(skip, skip_key=True) is None
+    assert checked == ["segment--0", "segment--1"]
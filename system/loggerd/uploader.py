@@ -7,12 +7,14 @@ import threading
 import time
 import traceback
 import datetime
-from collections.abc import Iterator
+import heapq
+from collections.abc import Callable, Hashable
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
 from openpilot.common.utils import get_upload_stream
+from openpilot.common.inotify import Inotify, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
@@ -73,6 +75,186 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class UploadIndex:
+  """
+  Files under root that haven't been uploaded yet, seeded with one scan and then kept current
+  with inotify, so picking the next upload doesn't list every segment and query its xattrs.
+  Upload candidates are kept in two heaps (immediate folders, then immediate_priority files),
+  entries that are uploaded or deleted are dropped lazily when they reach the top.
+  Entries that are locked or skipped move to a heap of their own, and are only looked at again once
+  the skip conditions change, a lock is released or SKIP_RECHECK_INTERVAL has passed.
+  Without inotify the index is rebuilt on every update.
+  """
+  WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+  SKIP_RECHECK_INTERVAL = 60.  # seconds, skipping can depend on the age of a file
+
+  def __init__(self, root: str, immediate_folders: list[str], immediate_priority: dict[str, int]):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    self.files: dict[str, set[str]] = {}
+    self.locks: dict[str, set[str]] = {}
+    self.queues: tuple[list, list] = ([], [])
+    self.skipped: tuple[list, list] = ([], [])
+    self.queued: set[tuple[str, str]] = set()
+    self.skip_key: Hashable = None
+    self.recheck_time = 0.
+
+    self.inotify: Inotify | None = None
+    self.watches: dict[int, str] = {}
+    self.seeded = False
+
+  def queue_for(self, logdir: str, name: str) -> list | None:
+    key = os.path.join(logdir, name)
+    if any(f in key for f in self.immediate_folders):
+      return self.queues[0]
+    if name in self.immediate_priority:
+      return self.queues[1]
+    return None
+
+  def seed(self) -> None:
+    self.files.clear()
+    self.locks.clear()
+    self.queued.clear()
+    for q in self.queues + self.skipped:
+      q.clear()
+    self.watches.clear()
+    self.seeded = False
+
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+    if Inotify.available() and os.path.isdir(self.root):
+      try:
+        self.inotify = Inotify()
+        # watch before listing, so directories created in between aren't missed
+        self.watches[self.inotify.add_watch(self.root, self.WATCH_MASK)] = ""
+      except OSError:
+        cloudlog.exception("uploader inotify setup failed")
+        if self.inotify is not None:
+          self.inotify.close()
+          self.inotify = None
+
+    for logdir in listdir_by_creation(self.root):
+      self.add_dir(logdir)
+    self.seeded = self.inotify is not None
+
+  def add_dir(self, logdir: str) -> None:
+    path = os.path.join(self.root, logdir)
+    if self.inotify is not None:
+      try:
+        self.watches[self.inotify.add_watch(path, self.WATCH_MASK)] = logdir
+      except OSError:
+        # directory is already gone, or out of watches. in the latter case files
+        # that show up later are missed until the next seed
+        cloudlog.exception("uploader add_watch failed")
+
+    try:
+      names = os.listdir(path)
+    except OSError:
+      return
+    for name in names:
+      self.add_file(logdir, name)
+
+  def remove_dir(self, logdir: str) -> None:
+    self.files.pop(logdir, None)
+    self.locks.pop(logdir, None)
+
+  def add_file(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.setdefault(logdir, set()).add(name)
+      return
+
+    fn = os.path.join(self.root, logdir, name)
+    try:
+      if os.path.isdir(fn) or getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE:
+        return
+    except OSError:
+      cloudlog.event("uploader_getxattr_failed", key=os.path.join(logdir, name), fn=fn)
+      # deleter could have deleted, so skip
+      return
+
+    self.files.setdefault(logdir, set()).add(name)
+    queue = self.queue_for(logdir, name)
+    if queue is not None and (logdir, name) not in self.queued:
+      self.queued.add((logdir, name))
+      heapq.heappush(queue, (get_directory_sort(logdir), self.immediate_priority.get(name, 1000), name, logdir))
+
+  def remove_file(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.get(logdir, set()).discard(name)
+      # files of the segment may have been skipped for the lock
+      self.recheck_time = 0.
+    else:
+      self.files.get(logdir, set()).discard(name)
+
+  def update(self) -> None:
+    if not self.seeded:
+      self.seed()
+      return
+
+    assert self.inotify is not None
+    for wd, mask, _, name in self.inotify.read():
+      if mask & IN_Q_OVERFLOW:
+        self.seed()
+        return
+
+      logdir = self.watches.get(wd)
+      if logdir is None:
+        continue
+      if mask & IN_IGNORED:
+        del self.watches[wd]
+        if logdir == "":
+          self.seeded = False
+        continue
+
+      if logdir == "":
+        if not mask & IN_ISDIR:
+          continue
+        if mask & (IN_CREATE | IN_MOVED_TO):
+          self.add_dir(name)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+          self.remove_dir(name)
+      elif mask & (IN_CREATE | IN_MOVED_TO):
+        self.add_file(logdir, name)
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        self.remove_file(logdir, name)
+
+  def next_file(self, skip: Callable[[str, str, float], bool], skip_key: Hashable = None) -> tuple[str, str] | None:
+    """
+    The first file in upload order that isn't locked and isn't skipped. skip gets the file's current ctime,
+    skip_key identifies everything else skip depends on, so skipped files are checked again when it changes.
+    """
+    now = time.monotonic()
+    if skip_key != self.skip_key or now >= self.recheck_time:
+      for queue, skipped in zip(self.queues, self.skipped, strict=True):
+        for item in skipped:
+          heapq.heappush(queue, item)
+        skipped.clear()
+      self.skip_key, self.recheck_time = skip_key, now + self.SKIP_RECHECK_INTERVAL
+
+    for queue, skipped in zip(self.queues, self.skipped, strict=True):
+      while queue:
+        _, _, name, logdir = queue[0]
+        ctime = None
+        if name in self.files.get(logdir, ()):
+          # the ctime of a file changes until it's closed, so it's read when the file is considered
+          try:
+            ctime = os.path.getctime(os.path.join(self.root, logdir, name))
+          except OSError:
+            pass  # deleter could have deleted it
+        if ctime is None:
+          heapq.heappop(queue)
+          self.queued.discard((logdir, name))
+          continue
+
+        if not self.locks.get(logdir) and not skip(logdir, name, ctime):
+          return logdir, name
+        heapq.heappush(skipped, heapq.heappop(queue))
+    return None
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -86,58 +268,34 @@ class Uploader:
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.zst": 0, "qcamera.ts": 1}
+    self.index = UploadIndex(root, self.immediate_folders, self.immediate_priority)
 
-  def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
+  def get_requested_routes(self) -> list[str]:
     r = self.params.get("AthenadRecentlyViewedRoutes")
-    requested_routes = [] if r is None else [route for route in r.split(",") if route]
-
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
+    return [] if r is None else [route for route in r.split(",") if route]
 
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
-
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
+  def skip_upload(self, logdir: str, name: str, ctime: float, metered: bool, requested_routes: list[str]) -> bool:
+    # limit uploading on metered connections
+    if metered:
+      dt = datetime.timedelta(hours=12)
+      if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
+        return True
 
-        yield name, key, fn
+      if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+        return True
+    return False
 
   def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
+    requested_routes = self.get_requested_routes()
 
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
+    self.index.update()
+    d = self.index.next_file(lambda logdir, name, ctime: self.skip_upload(logdir, name, ctime, metered, requested_routes),
+                             skip_key=(metered, tuple(requested_routes)))
+    if d is None:
+      return None
 
-    return None
+    logdir, name = d
+    return name, os.path.join(logdir, name), os.path.join(self.root, logdir, name)
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -218,12 +376,16 @@ class Uploader:
       return None
 
     name, key, fn = d
+    logdir = os.path.dirname(key)
 
     # qlogs and bootlogs need to be compressed before uploading
     if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.zst')):
       key += ".zst"
 
-    return self.upload(name, key, fn, network_type, metered)
+    success = self.upload(name, key, fn, network_type, metered)
+    if success:
+      self.index.remove_file(logdir, name)
+    return success
 
 
 def main(exit_event: threading.Event | None = None) -> None:
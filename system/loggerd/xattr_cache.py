@@ -1,23 +1,38 @@
 import errno
+import threading
+from collections import OrderedDict
 
 import xattr
 
-_cached_attributes: dict[tuple, bytes | None] = {}
+# least recently used attributes are dropped past this, instead of holding every path ever queried
+MAX_CACHED_ATTRIBUTES = 4096
+
+_cached_attributes: OrderedDict[tuple, bytes | None] = OrderedDict()
+_lock = threading.Lock()
 
 def getxattr(path: str, attr_name: str) -> bytes | None:
   key = (path, attr_name)
-  if key not in _cached_attributes:
-    try:
-      response = xattr.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA (Linux) or ENOATTR (macOS) means attribute hasn't been set
-      if e.errno == errno.ENODATA or (hasattr(errno, 'ENOATTR') and e.errno == errno.ENOATTR):
-        response = None
-      else:
-        raise
+  with _lock:
+    if key in _cached_attributes:
+      _cached_attributes.move_to_end(key)
+      return _cached_attributes[key]
+
+  try:
+    response = xattr.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA (Linux) or ENOATTR (macOS) means attribute hasn't been set
+    if e.errno == errno.ENODATA or (hasattr(errno, 'ENOATTR') and e.errno == errno.ENOATTR):
+      response = None
+    else:
+      raise
+
+  with _lock:
     _cached_attributes[key] = response
-  return _cached_attributes[key]
+    if len(_cached_attributes) > MAX_CACHED_ATTRIBUTES:
+      _cached_attributes.popitem(last=False)
+  return response
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
-  _cached_attributes.pop((path, attr_name), None)
+  with _lock:
+    _cached_attributes.pop((path, attr_name), None)
   xattr.setxattr(path, attr_name, attr_value)
@@ -2,11 +2,15 @@
 Binary struct parsing DSL.
 
 Defines a declarative schema for binary messages using dataclasses
-and type annotations.
+and type annotations. Each schema is compiled once into a parse plan,
+where runs of byte-aligned fixed-width fields decode with a single
+struct.Struct and only switch, bit and substream fields are interpreted.
 """
 
 import struct
+from collections.abc import Callable
 from enum import Enum
+from functools import cache
 from dataclasses import dataclass, is_dataclass
 from typing import Annotated, Any, TypeVar, get_args, get_origin
 
@@ -121,12 +125,14 @@ class BinaryReader:
       raise EOFError("Unexpected end of data")
 
   def _read_struct(self, fmt: str):
+    return self.unpack(_get_struct(fmt))[0]
+
+  def unpack(self, st: struct.Struct) -> tuple:
     self._align_to_byte()
-    size = struct.calcsize(fmt)
-    self._require(size)
-    value = struct.unpack_from(fmt, self.data, self.pos)[0]
-    self.pos += size
-    return value
+    self._require(st.size)
+    values = st.unpack_from(self.data, self.pos)
+    self.pos += st.size
+    return values
 
   def read_bytes(self, n: int) -> bytes:
     self._align_to_byte()
@@ -175,13 +181,13 @@ class BinaryStruct:
       dataclass(init=False)(cls)
     fields = list(getattr(cls, '__annotations__', {}).items())
     cls.__binary_fields__ = fields
+    cls.__binary_plan__ = _compile(fields)
 
     @classmethod
     def _read(inner_cls, reader: BinaryReader):
       obj = inner_cls.__new__(inner_cls)
-      for name, spec in inner_cls.__binary_fields__:
-        value = _parse_field(spec, reader, obj)
-        setattr(obj, name, value)
+      for step in inner_cls.__binary_plan__:
+        step(reader, obj)
       return obj
 
     cls._read = _read
@@ -218,6 +224,10 @@ def _field_type_from_spec(spec: Any) -> FieldType | None:
   return None
 
 
+@cache
+def _get_struct(fmt: str) -> struct.Struct:
+  return struct.Struct(fmt)
+
 def _int_format(field_type: IntType) -> str:
   if field_type.bits == 8:
     return 'b' if field_type.signed else 'B'
@@ -278,3 +288,154 @@ def _parse_field(spec: Any, reader: BinaryReader, obj: Any) -> Any:
   if isinstance(spec, type) and issubclass(spec, BinaryStruct):
     return spec._read(reader)
   raise TypeError(f"Unsupported field spec: {spec!r}")
+
+
+# *** compiled parse plans ***
+
+# (struct code, byte order or None if it doesn't matter, converter applied to the unpacked value)
+FixedCode = tuple[str, str | None, Callable[[Any], Any] | None]
+
+def _enum_converter(enum_cls: type[Enum], base: Callable[[Any], Any] | None) -> Callable[[Any], Any]:
+  def convert(raw: Any) -> Any:
+    if base is not None:
+      raw = base(raw)
+    try:
+      return enum_cls(raw)
+    except ValueError:
+      return raw
+  return convert
+
+def _const_converter(expected: Any, base: Callable[[Any], Any] | None) -> Callable[[Any], Any]:
+  def convert(value: Any) -> Any:
+    if base is not None:
+      value = base(value)
+    if value != expected:
+      raise ValueError(f"Invalid constant: expected {expected!r}, got {value!r}")
+    return value
+  return convert
+
+def _fixed_code(spec: Any) -> FixedCode | None:
+  """Struct code for a byte-aligned fixed-width field, None if it needs the generic path"""
+  field_type = _field_type_from_spec(spec)
+  if field_type is not None:
+    spec = field_type
+  if isinstance(spec, IntType):
+    fmt = _int_format(spec)
+    return fmt[-1], (fmt[0] if len(fmt) > 1 else None), None
+  if isinstance(spec, FloatType):
+    fmt = _float_format(spec)
+    return fmt[-1], fmt[0], None
+  if isinstance(spec, BytesType):
+    return f"{spec.size}s", None, None
+  if isinstance(spec, (EnumType, ConstType)):
+    base = _fixed_code(spec.base_type)
+    if base is None:
+      return None
+    code, order, convert = base
+    if isinstance(spec, EnumType):
+      return code, order, _enum_converter(spec.enum_cls, convert)
+    return code, order, _const_converter(spec.expected, convert)
+  return None
+
+
+class _FixedRun:
+  """Consecutive fixed-width fields that share a byte order, decoded with one struct.Struct"""
+
+  def __init__(self, names: list[str], codes: list[FixedCode]):
+    order = next((o for _, o, _ in codes if o is not None), '<')
+    self.names = tuple(names)
+    self.struct = _get_struct(order + ''.join(c for c, _, _ in codes))
+    self.converters = tuple((i, convert) for i, (_, _, convert) in enumerate(codes) if convert is not None)
+
+  def decode(self, values: tuple) -> dict[str, Any]:
+    if self.converters:
+      values_list = list(values)
+      for i, convert in self.converters:
+        values_list[i] = convert(values_list[i])
+      values = tuple(values_list)
+    return dict(zip(self.names, values, strict=True))
+
+  def __call__(self, reader: BinaryReader, obj: Any) -> None:
+    obj.__dict__.update(self.decode(reader.unpack(self.struct)))
+
+
+class _FixedArray:
+  """Array of fixed-width scalars or fixed-layout structs, decoded with iter_unpack"""
+
+  def __init__(self, name: str, count_field: str, element: Any, run: _FixedRun):
+    self.name = name
+    self.count_field = count_field
+    self.element = element
+    self.run = run
+
+  def __call__(self, reader: BinaryReader, obj: Any) -> None:
+    count = int(_resolve_path(obj, self.count_field))
+    reader._align_to_byte()
+    size = self.run.struct.size * count
+    reader._require(size)
+    rows = self.run.struct.iter_unpack(memoryview(reader.data)[reader.pos:reader.pos + size])
+    reader.pos += size
+
+    if self.element is None:
+      value = [self.run.decode(row)['value'] for row in rows] if self.run.converters else [row[0] for row in rows]
+    else:
+      value = []
+      for row in rows:
+        element = self.element.__new__(self.element)
+        element.__dict__.update(self.run.decode(row))
+        value.append(element)
+    setattr(obj, self.name, value)
+
+
+def _generic_step(name: str, spec: Any) -> Callable[[BinaryReader, Any], None]:
+  def step(reader: BinaryReader, obj: Any) -> None:
+    setattr(obj, name, _parse_field(spec, reader, obj))
+  return step
+
+def _fixed_layout(spec: Any) -> _FixedRun | None:
+  """The single run a fixed-layout BinaryStruct compiles to, if it is one"""
+  if isinstance(spec, type) and issubclass(spec, BinaryStruct):
+    plan = spec.__binary_plan__
+    if len(plan) == 1 and isinstance(plan[0], _FixedRun):
+      return plan[0]
+  return None
+
+def _compile(fields: list[tuple[str, Any]]) -> list[Callable[[BinaryReader, Any], None]]:
+  plan: list[Callable[[BinaryReader, Any], None]] = []
+  names: list[str] = []
+  codes: list[FixedCode] = []
+  order: str | None = None
+
+  def flush() -> None:
+    nonlocal order
+    if names:
+      plan.append(_FixedRun(names.copy(), codes.copy()))
+      names.clear()
+      codes.clear()
+    order = None
+
+  for name, spec in fields:
+    code = _fixed_code(spec)
+    if code is not None:
+      if code[1] is not None and order is not None and code[1] != order:
+        flush()
+      order = order or code[1]
+      names.append(name)
+      codes.append(code)
+      continue
+
+    flush()
+    field_type = _field_type_from_spec(spec)
+    if isinstance(field_type, ArrayType):
+      element_code = _fixed_code(field_type.element_type)
+      if element_code is not None:
+        plan.append(_FixedArray(name, field_type.count_field, None, _FixedRun(['value'], [element_code])))
+        continue
+      run = _fixed_layout(field_type.element_type)
+      if run is not None:
+        plan.append(_FixedArray(name, field_type.count_field, field_type.element_type, run))
+        continue
+    plan.append(_generic_step(name, spec))
+
+  flush()
+  return plan
@@ -15,6 +15,7 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.system.hardware import TICI
 from openpilot.common.gpio import gpio_init, gpio_set
 from openpilot.system.hardware.tici.pins import GPIO
+from openpilot.system.ubloxd.ubx import CHECKSUM_SIZE, HEADER_SIZE, PREAMBLE, ubx_checksum
 
 UBLOX_TTY = "/dev/ttyHS0"
 
@@ -35,11 +36,7 @@ def set_power(enabled: bool) -> None:
   gpio_set(GPIO.UBLOX_RST_N, enabled)
 
 def add_ubx_checksum(msg: bytes) -> bytes:
-  A = B = 0
-  for b in msg[2:]:
-    A = (A + b) % 256
-    B = (B + A) % 256
-  return msg + bytes([A, B])
+  return msg + ubx_checksum(msg[2:])
 
 def get_assistnow_messages(token: str) -> list[bytes]:
   # make request
@@ -54,11 +51,12 @@ def get_assistnow_messages(token: str) -> list[bytes]:
 
   # split up messages
   msgs = []
-  while len(dat) > 0:
-    assert dat[:2] == b"\xB5\x62"
-    msg_len = 6 + (dat[5] << 8 | dat[4]) + 2
-    msgs.append(dat[:msg_len])
-    dat = dat[msg_len:]
+  offset = 0
+  while offset < len(dat):
+    assert dat[offset:offset + 2] == PREAMBLE
+    msg_len = HEADER_SIZE + (dat[offset + 5] << 8 | dat[offset + 4]) + CHECKSUM_SIZE
+    msgs.append(dat[offset:offset + msg_len])
+    offset += msg_len
   return msgs
 
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import argparse
+import struct
+import time
+
+from openpilot.system.ubloxd import binary_struct as bs
+from openpilot.system.ubloxd.gps import Gps
+from openpilot.system.ubloxd.ubx import Ubx
+
+DEMO_ROUTE = "a2a0ccea32023010|2023-07-27--13-01-19/0"
+
+
+def reference_parse_field(spec, reader: bs.BinaryReader, obj):
+  """The field-by-field interpretation BinaryStruct used before schemas were compiled, for comparison"""
+  field_type = bs._field_type_from_spec(spec)
+  if field_type is not None:
+    spec = field_type
+  if isinstance(spec, bs.ConstType):
+    value = reference_parse_field(spec.base_type, reader, obj)
+    if value != spec.expected:
+      raise ValueError(f"Invalid constant: expected {spec.expected!r}, got {value!r}")
+    return value
+  if isinstance(spec, bs.EnumType):
+    raw = reference_parse_field(spec.base_type, reader, obj)
+    try:
+      return spec.enum_cls(raw)
+    except ValueError:
+      return raw
+  if isinstance(spec, bs.SwitchType):
+    target = spec.cases.get(bs._resolve_path(obj, spec.selector), spec.default)
+    return None if target is None else reference_parse_field(target, reader, obj)
+  if isinstance(spec, bs.ArrayType):
+    count = bs._resolve_path(obj, spec.count_field)
+    return [reference_parse_field(spec.element_type, reader, obj) for _ in range(int(count))]
+  if isinstance(spec, bs.SubstreamType):
+    data = reader.read_bytes(int(bs._resolve_path(obj, spec.length_field)))
+    return reference_parse_field(spec.element_type, bs.BinaryReader(data), obj)
+  if isinstance(spec, (bs.IntType, bs.FloatType)):
+    fmt = bs._int_format(spec) if isinstance(spec, bs.IntType) else bs._float_format(spec)
+    reader._align_to_byte()
+    size = struct.calcsize(fmt)
+    reader._require(size)
+    value = struct.unpack_from(fmt, reader.data, reader.pos)[0]
+    reader.pos += size
+    return value
+  if isinstance(spec, type) and issubclass(spec, bs.BinaryStruct):
+    obj = spec.__new__(spec)
+    for name, field_spec in spec.__binary_fields__:
+      setattr(obj, name, reference_parse_field(field_spec, reader, obj))
+    return obj
+  return bs._parse_field(spec, reader, obj)
+
+
+def reference_from_bytes(cls, data: bytes):
+  return reference_parse_field(cls, bs.BinaryReader(data), None)
+
+
+def gps_subframe(words: list[int]) -> bytes:
+  """The 30 byte subframe in a GPS RXM-SFRBX, as ubloxd builds it"""
+  subframe = bytearray()
+  for word in words:
+    word >>= 6
+    subframe += bytes(((word >> 16) & 0xFF, (word >> 8) & 0xFF, word & 0xFF))
+  return bytes(subframe)
+
+
+def compiled_from_bytes(cls, data: bytes):
+  return cls.from_bytes(data)
+
+
+def try_parse(parse, cls, data: bytes):
+  # some recorded frames are truncated, both parsers have to fail the same way on those
+  try:
+    return parse(cls, data)
+  except (EOFError, ValueError) as e:
+    return type(e)
+
+
+def time_parse(parse, cls, items) -> float:
+  start = time.monotonic()
+  for item in items:
+    try_parse(parse, cls, item)
+  return time.monotonic() - start
+
+
+if __name__ == "__main__":
+  from openpilot.system.ubloxd.ubx import UbxFramer
+  from openpilot.tools.lib.logreader import LogReader
+
+  parser = argparse.ArgumentParser(description="Benchmark compiled binary_struct parsing against per-field interpretation on a recorded ublox stream")
+  parser.add_argument("route", nargs="?", default=DEMO_ROUTE, help="segment with ubloxRaw")
+  args = parser.parse_args()
+
+  framer = UbxFramer()
+  frames = []
+  for msg in LogReader(args.route):
+    if msg.which() == 'ubloxRaw':
+      frames += [bytes(f) for f in framer.add_data(msg.logMonoTime * 1e-9, bytes(msg.ubloxRaw))]
+  assert len(frames), "no ubloxRaw in route"
+
+  subframes = []
+  for frame in frames:
+    ubx = try_parse(compiled_from_bytes, Ubx, frame)
+    sfrbx = getattr(ubx, 'body', None)
+    if isinstance(sfrbx, Ubx.RxmSfrbx) and sfrbx.gnss_id == Ubx.GnssType.gps and len(sfrbx.body) == 10:
+      subframes.append(gps_subframe(sfrbx.body))
+
+  for name, cls, items in [("UBX frames", Ubx, frames), ("GPS subframes", Gps, subframes)]:
+    for item in items:
+      assert try_parse(compiled_from_bytes, cls, item) == try_parse(reference_from_bytes, cls, item)
+    reference_time = time_parse(reference_from_bytes, cls, items)
+    compiled_time = time_parse(compiled_from_bytes, cls, items)
+    print(f"{name}: {len(items)}")
+    print(f"  interpreted: {reference_time:.3f} s ({reference_time / max(len(items), 1) * 1e6:.1f} us / msg)")
+    print(f"  compiled:    {compiled_time:.3f} s ({compiled_time / max(len(items), 1) * 1e6:.1f} us / msg)")
+    if compiled_time > 0:
+      print(f"  speedup: {reference_time / compiled_time:.1f}x")
@@ -0,0 +1,169 @@
+import math
+import random
+import struct
+from typing import Annotated
+
+import pytest
+
+from openpilot.system.ubloxd import binary_struct as bs
+from openpilot.system.ubloxd.gps import Gps
+from openpilot.system.ubloxd.glonass import Glonass
+from openpilot.system.ubloxd.ubx import Ubx
+
+
+class MixedEndian(bs.BinaryStruct):
+  a: Annotated[int, bs.u16be]
+  f: Annotated[float, bs.f32]
+  b: Annotated[int, bs.s32be]
+  d: Annotated[float, bs.f64]
+  c: Annotated[int, bs.u16]
+
+
+def ubx_frame(msg_type: int, payload: bytes) -> bytes:
+  body = struct.pack('>H', msg_type) + struct.pack('<H', len(payload)) + payload
+  ck_a = ck_b = 0
+  for b in body:
+    ck_a = (ck_a + b) & 0xFF
+    ck_b = (ck_b + ck_a) & 0xFF
+  return b'\xb5\x62' + body + bytes((ck_a, ck_b))
+
+
+def rxm_rawx(rng: random.Random, num_meas: int) -> tuple[bytes, list[dict]]:
+  payload = struct.pack('<dHbB', 345600.5, 2300, 18, num_meas) + bytes(4)
+  meas = []
+  for _ in range(num_meas):
+    # gnss_id 9 isn't a GnssType, it stays an int
+    m = {'pr_mes': rng.uniform(2e7, 3e7), 'cp_mes': rng.uniform(-1e6, 1e6), 'do_mes': float(rng.randrange(-5000, 5000)),
+         'gnss_id': rng.choice([0, 2, 6, 9]), 'sv_id': rng.randrange(256), 'freq_id': rng.randrange(256), 'lock_time': rng.randrange(65536),
+         'cno': rng.randrange(256), 'pr_stdev': rng.randrange(256), 'cp_stdev': rng.randrange(256), 'do_stdev': rng.randrange(256),
+         'trk_stat': rng.randrange(256)}
+    payload += struct.pack('<ddfBBxBHBBBBBx', *m.values())
+    meas.append(m)
+  return payload, meas
+
+
+def random_bit_fields(rng: random.Random, cls: type[bs.BinaryStruct], **fixed: int) -> list[tuple[str, int, int]]:
+  """(name, bits, value) for each bit and big endian int field of cls in order, with random values. Switch fields are left out"""
+  fields = []
+  for name, spec in cls.__binary_fields__:
+    field_type = bs._field_type_from_spec(spec)
+    if isinstance(field_type, bs.SwitchType):
+      continue
+    if isinstance(field_type, bs.ConstType):
+      value = int.from_bytes(field_type.expected, 'big')
+      fields.append((name, 8 * len(field_type.expected), value))
+      continue
+    bits = field_type.bits
+    if name in fixed:
+      value = fixed[name]
+    elif isinstance(field_type, bs.IntType) and field_type.signed:
+      value = rng.randrange(-(1 << (bits - 1)), 1 << (bits - 1))
+    else:
+      value = rng.randrange(1 << bits)
+    fields.append((name, bits, value))
+  return fields
+
+
+def pack_bits(fields: list[tuple[str, int, int]], size: int) -> bytes:
+  out = 0
+  num_bits = 0
+  for _, bits, value in fields:
+    out = (out << bits) | (value & ((1 << bits) - 1))
+    num_bits += bits
+  return (out << (8 * size - num_bits)).to_bytes(size, 'big')
+
+
+def check_fields(obj, fields: list[tuple[str, int, int]]):
+  for name, bits, value in fields:
+    field = getattr(obj, name)
+    if isinstance(field, bytes):
+      field = int.from_bytes(field, 'big')
+    assert field == (bool(value) if bits == 1 else value), name
+    assert isinstance(field, bool) == (bits == 1), name
+
+
+class TestBinaryStruct:
+  def test_plans(self):
+    # fixed-width fields collapse into one struct per byte order
+    assert [type(step) for step in Ubx.NavPvt.__binary_plan__] == [bs._FixedRun]
+    assert [type(step) for step in Ubx.RxmRawx.__binary_plan__] == [bs._FixedRun, bs._FixedArray]
+    assert Ubx.RxmRawx.Measurement.__binary_plan__[0].struct.size == 32
+    assert [type(step) for step in Ubx.__binary_plan__][:2] == [bs._FixedRun, bs._FixedRun]
+
+  def test_mixed_endianness(self):
+    # floats are always little endian, they can't share a run with big endian ints
+    assert [step.struct.format for step in MixedEndian.__binary_plan__] == ['>H', '<f', '>i', '<dH']
+
+    msg = MixedEndian.from_bytes(struct.pack('>H', 7) + struct.pack('<f', 1.5) + struct.pack('>i', -3) + struct.pack('<dH', math.pi, 513))
+    assert (msg.a, msg.f, msg.b, msg.d, msg.c) == (7, 1.5, -3, math.pi, 513)
+
+  @pytest.mark.parametrize("num_meas", [0, 1, 32])
+  def test_rxm_rawx(self, num_meas):
+    payload, meas = rxm_rawx(random.Random(num_meas), num_meas)
+    msg = Ubx.from_bytes(ubx_frame(0x0215, payload))
+
+    assert (msg.msg_type, msg.length) == (0x0215, len(payload))
+    assert (msg.body.rcv_tow, msg.body.week, msg.body.leap_s, msg.body.num_meas) == (345600.5, 2300, 18, num_meas)
+    assert len(msg.body.meas) == num_meas
+    for parsed, expected in zip(msg.body.meas, meas, strict=True):
+      assert {name: getattr(parsed, name) for name in expected} == expected
+      assert isinstance(parsed.gnss_id, Ubx.GnssType) == (parsed.gnss_id != 9)
+
+  def test_ubx_messages(self):
+    nav_pvt = struct.pack('<IHBBBBBBIiBBBBiiiiIIiiiiiiIHB5xihH', 1000, 2024, 5, 6, 7, 8, 9, 3, 50, -20, 3, 1, 2, 12, -1223456789, 374567890,
+                          12000, 10000, 500, 800, -100, 200, 3, 224, 9000000, 400, 100, 150, 0, -50, -20, 20)
+    msg = Ubx.from_bytes(ubx_frame(0x0107, nav_pvt))
+    assert isinstance(msg.body, Ubx.NavPvt)
+    assert (msg.body.i_tow, msg.body.year, msg.body.num_sv, msg.body.lon, msg.body.lat) == (1000, 2024, 12, -1223456789, 374567890)
+    assert (msg.body.head_mot, msg.body.p_dop, msg.body.head_veh, msg.body.mag_dec, msg.body.mag_acc) == (9000000, 150, -50, -20, 20)
+
+    nav_sat = struct.pack('<IBB2x', 1000, 1, 2) + struct.pack('<BBBbhhI', 0, 12, 40, -5, 300, -7, 0x1234) + struct.pack('<BBBbhhI', 9, 1, 0, 90, 0, 0, 0)
+    msg = Ubx.from_bytes(ubx_frame(0x0135, nav_sat))
+    assert [(sv.gnss_id, sv.sv_id, sv.elev, sv.azim, sv.pr_res, sv.flags) for sv in msg.body.svs] == \
+           [(Ubx.GnssType.gps, 12, -5, 300, -7, 0x1234), (9, 1, 90, 0, 0, 0)]
+
+    sfrbx = bytes((6, 5, 0, 8, 2, 0, 2, 0)) + struct.pack('<2I', 0xdeadbeef, 42)
+    msg = Ubx.from_bytes(ubx_frame(0x0213, sfrbx))
+    assert (msg.body.gnss_id, msg.body.sv_id, msg.body.freq_id, msg.body.body) == (Ubx.GnssType.glonass, 5, 8, [0xdeadbeef, 42])
+
+    mon_hw2 = struct.pack('<bBbBB3xI8xI4x', -3, 10, 4, 200, 111, 7, 0xabcd)
+    msg = Ubx.from_bytes(ubx_frame(0x0A0B, mon_hw2))
+    assert (msg.body.ofs_i, msg.body.mag_q, msg.body.cfg_source, msg.body.post_status) == (-3, 200, Ubx.MonHw2.ConfigSource.otp, 0xabcd)
+
+    # unknown message types have no body
+    assert Ubx.from_bytes(ubx_frame(0x0101, bytes(10))).body is None
+
+  @pytest.mark.parametrize("subframe_id", [1, 2, 3, 4])
+  def test_gps(self, subframe_id):
+    rng = random.Random(subframe_id)
+    body_cls = {1: Gps.Subframe1, 2: Gps.Subframe2, 3: Gps.Subframe3, 4: Gps.Subframe4}[subframe_id]
+    for _ in range(20):
+      tlm = random_bit_fields(rng, Gps.Tlm)
+      how = random_bit_fields(rng, Gps.How, subframe_id=subframe_id)
+      body = random_bit_fields(rng, body_cls, page_id=56)
+      page = random_bit_fields(rng, Gps.Subframe4.IonosphereData) if subframe_id == 4 else []
+
+      sf = Gps.from_bytes(pack_bits(tlm + how + body + page, 30))
+      check_fields(sf.tlm, tlm)
+      check_fields(sf.how, how)
+      check_fields(sf.body, body)
+      if subframe_id == 4:
+        check_fields(sf.body.body, page)
+
+  def test_glonass(self):
+    rng = random.Random(0)
+    data_cls = {1: Glonass.String1, 2: Glonass.String2, 3: Glonass.String3, 4: Glonass.String4, 5: Glonass.String5}
+    for string_number in range(16):
+      header = random_bit_fields(rng, Glonass, string_number=string_number)
+      data = random_bit_fields(rng, data_cls.get(string_number, Glonass.StringNonImmediate))
+
+      string = Glonass.from_bytes(pack_bits(header[:2] + data + header[2:], 16))
+      check_fields(string, header)
+      check_fields(string.data, data)
+
+  def test_errors(self):
+    frame = ubx_frame(0x0215, rxm_rawx(random.Random(0), 4)[0])
+    with pytest.raises(EOFError):
+      Ubx.RxmRawx.from_bytes(frame[6:-40])
+    with pytest.raises(ValueError):
+      Ubx.from_bytes(b'\xb5\x63' + frame[2:])
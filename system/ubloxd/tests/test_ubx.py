@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from openpilot.system.ubloxd.pigeond import add_ubx_checksum
+from openpilot.system.ubloxd.ubx import UbxFramer, ubx_checksum
+from openpilot.system.ubloxd.tests.test_binary_struct import ubx_frame
+
+
+def ubx_stream(rng: random.Random, num_frames: int) -> tuple[bytes, list[bytes]]:
+  """A stream of valid frames mixed with garbage and frames with a bad checksum"""
+  stream, frames = bytearray(), []
+  for _ in range(num_frames):
+    r = rng.random()
+    if r < 0.1:
+      stream += rng.randbytes(rng.randrange(50))
+    elif r < 0.15:
+      bad = bytearray(ubx_frame(0x0215, rng.randbytes(rng.randrange(2000))))
+      bad[-1] ^= 1
+      stream += bad
+    else:
+      frame = ubx_frame(rng.choice([0x0215, 0x0107, 0x0213]), rng.randbytes(rng.randrange(1500)))
+      frames.append(frame)
+      stream += frame
+  return bytes(stream), frames
+
+
+def split(rng: random.Random, data: bytes, num_chunks: int) -> list[bytes]:
+  cuts = sorted(rng.sample(range(1, len(data)), num_chunks - 1))
+  return [data[a:b] for a, b in zip([0, *cuts], [*cuts, len(data)], strict=True)]
+
+
+class TestUbx:
+  @pytest.mark.parametrize("length", [0, 1, 2, 100, 0xFFFF])
+  def test_checksum(self, length):
+    data = random.Random(length).randbytes(length)
+    ck_a = ck_b = 0
+    for b in data:
+      ck_a = (ck_a + b) & 0xFF
+      ck_b = (ck_b + ck_a) & 0xFF
+    assert ubx_checksum(data) == bytes((ck_a, ck_b))
+    assert add_ubx_checksum(b"\xb5\x62" + data) == b"\xb5\x62" + data + bytes((ck_a, ck_b))
+
+  @pytest.mark.parametrize("num_chunks", [1, 10, 2000])
+  def test_framing(self, num_chunks):
+    rng = random.Random(num_chunks)
+    stream, expected = ubx_stream(rng, 1000)
+
+    # small capacity so the buffer has to grow and compact
+    framer = UbxFramer(capacity=64)
+    frames = []
+    for chunk in split(rng, stream, num_chunks):
+      frames += [bytes(f) for f in framer.add_data(0., chunk)]
+    assert frames == expected
+
+  def test_resync(self):
+    frame = ubx_frame(0x0107, bytes(range(92)))
+    corrupted = bytearray(frame)
+    corrupted[10] ^= 0xFF
+
+    framer = UbxFramer()
+    frames = framer.add_data(0., b"\x00\xb5\xff" + bytes(corrupted) + frame[:20])
+    assert frames == []
+    frames = framer.add_data(1., frame[20:] + b"\xb5")
+    assert [bytes(f) for f in frames] == [frame]
+    assert framer.last_log_time == 1.
+
+    # garbage without a preamble is dropped
+    framer.add_data(2., bytes(1000))
+    assert len(framer) == 0
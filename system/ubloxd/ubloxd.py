@@ -8,7 +8,7 @@ from dataclasses import dataclass
 
 from cereal import log
 from cereal import messaging
-from openpilot.system.ubloxd.ubx import Ubx
+from openpilot.system.ubloxd.ubx import Ubx, UbxFramer
 from openpilot.system.ubloxd.gps import Gps
 from openpilot.system.ubloxd.glonass import Glonass
 
@@ -19,68 +19,6 @@ SECS_IN_DAY = 24 * SECS_IN_HR
 SECS_IN_WEEK = 7 * SECS_IN_DAY
 
 
-class UbxFramer:
-  PREAMBLE1 = 0xB5
-  PREAMBLE2 = 0x62
-  HEADER_SIZE = 6
-  CHECKSUM_SIZE = 2
-
-  def __init__(self) -> None:
-    self.buf = bytearray()
-    self.last_log_time = 0.0
-
-  def reset(self) -> None:
-    self.buf.clear()
-
-  @staticmethod
-  def _checksum_ok(frame: bytes) -> bool:
-    ck_a = 0
-    ck_b = 0
-    for b in frame[2:-2]:
-      ck_a = (ck_a + b) & 0xFF
-      ck_b = (ck_b + ck_a) & 0xFF
-    return ck_a == frame[-2] and ck_b == frame[-1]
-
-  def add_data(self, log_time: float, incoming: bytes) -> list[bytes]:
-    self.last_log_time = log_time
-    out: list[bytes] = []
-    if not incoming:
-      return out
-    self.buf += incoming
-
-    while True:
-      # find preamble
-      if len(self.buf) < 2:
-        break
-      start = self.buf.find(b"\xb5\x62")
-      if start < 0:
-        # no preamble in buffer
-        self.buf.clear()
-        break
-      if start > 0:
-        # drop garbage before preamble
-        self.buf = self.buf[start:]
-
-      if len(self.buf) < self.HEADER_SIZE:
-        break
-
-      length_le = int.from_bytes(self.buf[4:6], 'little', signed=False)
-      total_len = self.HEADER_SIZE + length_le + self.CHECKSUM_SIZE
-      if len(self.buf) < total_len:
-        break
-
-      candidate = bytes(self.buf[:total_len])
-      if self._checksum_ok(candidate):
-        out.append(candidate)
-        # consume this frame
-        self.buf = self.buf[total_len:]
-      else:
-        # drop first byte and retry
-        self.buf = self.buf[1:]
-
-    return out
-
-
 def _bit(b: int, shift: int) -> bool:
   return (b & (1 << shift)) != 0
 
@@ -126,7 +64,7 @@ class UbloxMsgParser:
     )
 
   # Message generation entry point
-  def parse_frame(self, frame: bytes) -> tuple[str, capnp.lib.capnp._DynamicStructBuilder] | None:
+  def parse_frame(self, frame: bytes | memoryview) -> tuple[str, capnp.lib.capnp._DynamicStructBuilder] | None:
     # Quick header parse
     msg_type = int.from_bytes(frame[2:4], 'big')
     payload = frame[6:-2]
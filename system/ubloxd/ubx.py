@@ -5,8 +5,107 @@ UBX protocol parser
 from enum import IntEnum
 from typing import Annotated
 
+import numpy as np
+
 from openpilot.system.ubloxd import binary_struct as bs
 
+PREAMBLE = b"\xb5\x62"
+HEADER_SIZE = 6
+CHECKSUM_SIZE = 2
+MAX_FRAME_SIZE = HEADER_SIZE + 0xFFFF + CHECKSUM_SIZE
+
+# weights of each byte in the second Fletcher sum, n..1 for the last n bytes
+_CK_B_WEIGHTS = np.arange(MAX_FRAME_SIZE, 0, -1, dtype=np.uint32)
+
+
+def ubx_checksum(data) -> bytes:
+  """8-bit Fletcher checksum of the class, id, length and payload of a UBX message"""
+  dat = np.frombuffer(data, dtype=np.uint8)
+  if not len(dat):
+    return b"\x00\x00"
+  # sums wrap at 2**32, which doesn't change them mod 256
+  ck_a = int(dat.sum(dtype=np.uint32)) & 0xFF
+  ck_b = int(np.dot(_CK_B_WEIGHTS[-len(dat):], dat)) & 0xFF
+  return bytes((ck_a, ck_b))
+
+
+class UbxFramer:
+  """
+  Splits a stream of UBX data into frames with a valid checksum.
+  Data is kept in a buffer with read and write offsets, which is only compacted when
+  it runs out of space at the end. Frames are memoryviews into that buffer, valid until
+  the next call to add_data. After a bad checksum, the framer resyncs on the next preamble.
+  """
+  PREAMBLE1 = 0xB5
+  PREAMBLE2 = 0x62
+  HEADER_SIZE = HEADER_SIZE
+  CHECKSUM_SIZE = CHECKSUM_SIZE
+
+  def __init__(self, capacity: int = 0x4000) -> None:
+    self.buf = bytearray(capacity)
+    self.start = 0
+    self.end = 0
+    self.last_log_time = 0.0
+
+  def reset(self) -> None:
+    self.start = self.end = 0
+
+  def __len__(self) -> int:
+    return self.end - self.start
+
+  def _append(self, incoming) -> None:
+    n = len(incoming)
+    if self.end + n > len(self.buf):
+      size = self.end - self.start
+      if size + n > len(self.buf):
+        # frames handed out earlier keep pointing at the old buffer
+        buf = bytearray(max(2 * len(self.buf), size + n))
+        buf[:size] = self.buf[self.start:self.end]
+        self.buf = buf
+      else:
+        self.buf[:size] = self.buf[self.start:self.end]
+      self.start, self.end = 0, size
+    self.buf[self.end:self.end + n] = incoming
+    self.end += n
+
+  def add_data(self, log_time: float, incoming: bytes) -> list[memoryview]:
+    self.last_log_time = log_time
+    out: list[memoryview] = []
+    if not incoming:
+      return out
+    self._append(incoming)
+
+    buf = self.buf
+    view = memoryview(buf)
+    start, end = self.start, self.end
+    while end - start >= 2:
+      # find preamble
+      start = buf.find(PREAMBLE, start, end)
+      if start < 0:
+        # no preamble in buffer
+        start = end
+        break
+
+      if end - start < HEADER_SIZE:
+        break
+
+      total_len = HEADER_SIZE + (buf[start + 4] | buf[start + 5] << 8) + CHECKSUM_SIZE
+      if end - start < total_len:
+        break
+
+      frame = view[start:start + total_len]
+      if ubx_checksum(frame[2:-2]) == frame[-2:]:
+        out.append(frame)
+        start += total_len
+      else:
+        # look for the next preamble
+        start += 1
+
+    if start == end:
+      start = end = 0
+    self.start, self.end = start, end
+    return out
+
 
 class GnssType(IntEnum):
   gps = 0
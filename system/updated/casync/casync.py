@@ -5,13 +5,16 @@ import os
 import pathlib
 import struct
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
-from collections.abc import Callable
+from collections import defaultdict, deque, namedtuple
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import IO
 
 import requests
+from requests.adapters import HTTPAdapter
 from Crypto.Hash import SHA512
 from openpilot.system.updated.casync import tar
 from openpilot.system.updated.casync.common import create_casync_tar_package
@@ -29,6 +32,9 @@ CA_TABLE_MIN_LEN = CA_TABLE_HEADER_LEN + CA_TABLE_ENTRY_LEN
 CHUNK_DOWNLOAD_TIMEOUT = 60
 CHUNK_DOWNLOAD_RETRIES = 3
 
+EXTRACT_WORKERS = 8  # fetch, decompress and hash chunks concurrently
+EXTRACT_WINDOW = 32  # max chunks waiting to be written
+
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
@@ -36,6 +42,9 @@ ChunkDict = dict[bytes, Chunk]
 
 
 class ChunkReader(ABC):
+  # remote readers are only used for chunks no local reader has
+  remote = False
+
   @abstractmethod
   def read(self, chunk: Chunk) -> bytes:
     ...
@@ -46,10 +55,12 @@ class BinaryChunkReader(ChunkReader):
   def __init__(self, file_like: IO[bytes]) -> None:
     super().__init__()
     self.f = file_like
+    self.lock = threading.Lock()
 
   def read(self, chunk: Chunk) -> bytes:
-    self.f.seek(chunk.offset)
-    return self.f.read(chunk.length)
+    with self.lock:
+      self.f.seek(chunk.offset)
+      return self.f.read(chunk.length)
 
 
 class FileChunkReader(BinaryChunkReader):
@@ -62,11 +73,13 @@ class FileChunkReader(BinaryChunkReader):
 
 class RemoteChunkReader(ChunkReader):
   """Reads lzma compressed chunks from a remote store"""
+  remote = True
 
   def __init__(self, url: str) -> None:
     super().__init__()
     self.url = url
     self.session = requests.Session()
+    self.session.mount(url, HTTPAdapter(pool_maxsize=EXTRACT_WORKERS))
 
   def read(self, chunk: Chunk) -> bytes:
     sha_hex = chunk.sha.hex()
@@ -165,41 +178,88 @@ def build_chunk_dict(chunks: list[Chunk]) -> ChunkDict:
   return r
 
 
-def extract(target: list[Chunk],
-            sources: list[tuple[str, ChunkReader, ChunkDict]],
-            out_path: str,
-            progress: Callable[[int], None] | None = None):
-  stats: dict[str, int] = defaultdict(int)
+def verify_chunk(bts: bytes, chunk: Chunk) -> bool:
+  return len(bts) == chunk.length and SHA512.new(bts, truncate="256").digest() == chunk.sha
+
 
-  mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
+def _read_chunk(chunk: Chunk, sources: list[tuple[str, ChunkReader, ChunkDict]]) -> tuple[str | None, bytes | None]:
+  for name, chunk_reader, store_chunks in sources:
+    if chunk.sha in store_chunks:
+      bts = chunk_reader.read(store_chunks[chunk.sha])
+      if verify_chunk(bts, chunk):
+        return name, bts
+  return None, None
 
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
-        if cur_chunk.sha in store_chunks:
-          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
 
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
+def _in_order(pool: ThreadPoolExecutor, fn: Callable, items: Iterable, window: int) -> Iterator[tuple]:
+  """Runs fn over items in the pool, yielding (item, result) in order with at most window results pending"""
+  pending: deque[tuple[object, Future]] = deque()
+  for item in items:
+    pending.append((item, pool.submit(fn, item)))
+    if len(pending) >= window:
+      item, fut = pending.popleft()
+      yield item, fut.result()
+  while pending:
+    item, fut = pending.popleft()
+    yield item, fut.result()
 
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
-            continue
 
-          # Write to output
+def extract(target: list[Chunk],
+            sources: list[tuple[str, ChunkReader, ChunkDict]],
+            out_path: str,
+            progress: Callable[[int], None] | None = None,
+            workers: int = EXTRACT_WORKERS,
+            window: int = EXTRACT_WINDOW):
+  """Writes the target chunks to out_path, taking each from the first source that has it.
+  Chunks that are already in place in out_path are kept and counted as 'target'. Local sources
+  are tried first, chunks missing from all of them are then fetched once from the remote sources.
+  Chunks are read and verified in a thread pool, writes happen in offset order."""
+  stats: dict[str, int] = defaultdict(int)
+  local_sources = [s for s in sources if not s[1].remote]
+  remote_sources = [s for s in sources if s[1].remote]
+
+  total = 0
+  def done(name: str, length: int) -> None:
+    nonlocal total
+    stats[name] += length
+    total += length
+    if progress is not None:
+      progress(total)
+
+  exists = os.path.exists(out_path)
+  with open(out_path, 'rb+' if exists else 'wb') as out, ThreadPoolExecutor(max_workers=workers) as pool:
+    in_place = BinaryChunkReader(open(out_path, 'rb')) if exists else None
+
+    def read_local(chunk: Chunk) -> tuple[str | None, bytes | None]:
+      if in_place is not None and verify_chunk(in_place.read(chunk), chunk):
+        return 'target', None
+      return _read_chunk(chunk, local_sources)
+
+    # seed from the output file and local sources
+    missing: dict[bytes, list[Chunk]] = {}
+    try:
+      for cur_chunk, (name, bts) in _in_order(pool, read_local, target, window):
+        if name is None:
+          missing.setdefault(cur_chunk.sha, []).append(cur_chunk)
+          continue
+        if bts is not None:
           out.seek(cur_chunk.offset)
           out.write(bts)
-
-          stats[name] += cur_chunk.length
-
-          if progress is not None:
-            progress(sum(stats.values()))
-
-          break
-      else:
+        done(name, cur_chunk.length)
+    finally:
+      if in_place is not None:
+        in_place.f.close()
+
+    # fetch each remaining chunk once, and write it everywhere it's used
+    for chunks, (name, bts) in _in_order(pool, lambda chunks: _read_chunk(chunks[0], remote_sources), missing.values(), window):
+      if name is None:
         raise RuntimeError("Desired chunk not found in provided stores")
+      for i, cur_chunk in enumerate(chunks):
+        out.seek(cur_chunk.offset)
+        out.write(bts)
+        # copies are credited to the local store they would have been read back from
+        copy_source = next((n for n, _, store_chunks in local_sources if cur_chunk.sha in store_chunks), name)
+        done(name if i == 0 else copy_source, cur_chunk.length)
 
   return stats
 
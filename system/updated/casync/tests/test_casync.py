@@ -1,8 +1,13 @@
 import pytest
+import lzma
 import os
 import pathlib
+import random
 import tempfile
 import subprocess
+from collections import Counter
+
+from Crypto.Hash import SHA512
 
 from openpilot.system.updated.casync import casync
 from openpilot.system.updated.casync import tar
@@ -151,6 +156,85 @@ class TestCasync:
     assert stats['remote'] < len(self.contents)
 
 
+class CountingChunkReader(casync.RemoteChunkReader):
+  def __init__(self, url):
+    super().__init__(url)
+    self.reads = Counter()
+
+  def read(self, chunk):
+    self.reads[chunk.sha] += 1
+    return super().read(chunk)
+
+
+class TestExtract:
+  """Extracts from a chunk store written directly, without the casync binary"""
+  CHUNK_SIZE = 16 * 1024
+
+  def setup_method(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.store_fn = os.path.join(self.tmpdir.name, 'store')
+    self.target_fn = os.path.join(self.tmpdir.name, 'target')
+
+    rng = random.Random(0)
+    blocks = [rng.randbytes(self.CHUNK_SIZE) for _ in range(8)]
+    # reuse blocks, and end with a short chunk
+    data = [blocks[rng.randrange(len(blocks))] for _ in range(64)] + [blocks[0][:1000]]
+    self.contents = b''.join(data)
+
+    self.target = []
+    offset = 0
+    for bts in data:
+      sha = SHA512.new(bts, truncate="256").digest()
+      self.target.append(casync.Chunk(sha, offset, len(bts)))
+      offset += len(bts)
+
+      chunk_fn = os.path.join(self.store_fn, sha.hex()[:4], sha.hex() + ".cacnk")
+      os.makedirs(os.path.dirname(chunk_fn), exist_ok=True)
+      with open(chunk_fn, 'wb') as f:
+        f.write(lzma.compress(bts))
+
+  def teardown_method(self):
+    self.tmpdir.cleanup()
+
+  @pytest.mark.parametrize("workers", [1, 4])
+  def test_extract(self, workers):
+    remote = CountingChunkReader(self.store_fn)
+    sources = [('remote', remote, casync.build_chunk_dict(self.target))]
+
+    progress = []
+    stats = casync.extract(self.target, sources, self.target_fn, progress.append, workers=workers, window=3)
+
+    with open(self.target_fn, 'rb') as f:
+      assert f.read() == self.contents
+    assert stats['remote'] == len(self.contents)
+    assert progress == sorted(progress) and progress[-1] == len(self.contents)
+    # reused chunks are only downloaded once
+    assert set(remote.reads.values()) == {1}
+
+  def test_seed_from_output(self):
+    # first half is already in place, the rest is garbage
+    half = self.target[len(self.target) // 2].offset
+    with open(self.target_fn, 'wb') as f:
+      f.write(self.contents[:half] + b'\x00' * (len(self.contents) - half))
+
+    remote = CountingChunkReader(self.store_fn)
+    sources = [('remote', remote, casync.build_chunk_dict(self.target))]
+    stats = casync.extract(self.target, sources, self.target_fn)
+
+    with open(self.target_fn, 'rb') as f:
+      assert f.read() == self.contents
+    assert stats['target'] == half
+    assert stats['remote'] == len(self.contents) - half
+    assert set(remote.reads) == {c.sha for c in self.target[len(self.target) // 2:]}
+
+  def test_missing_chunk(self):
+    store_chunks = casync.build_chunk_dict(self.target)
+    del store_chunks[self.target[0].sha]
+    sources = [('remote', casync.RemoteChunkReader(self.store_fn), store_chunks)]
+    with pytest.raises(RuntimeError):
+      casync.extract(self.target, sources, self.target_fn)
+
+
 @pytest.mark.skip("not used yet")
 class TestCasyncDirectory:
   """Tests extracting a directory stored as a casync tar archive"""
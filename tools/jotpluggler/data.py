@@ -1,95 +1,242 @@
 import numpy as np
+import json
+import os
 import threading
 import multiprocessing
 import bisect
-from collections import defaultdict
+from typing import NamedTuple
 from tqdm import tqdm
+from cereal import log
+from openpilot.common.capnp_wire import LIST_COMPOSITE, LIST_ELEMENT_BITS, LIST_POINTER, STRUCT_POINTER, Messages, list_sizes, read_field, \
+                                        read_messages, struct_sizes
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.utils import atomic_write
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.tools.lib.column_cache import load_columns, prune_columns, save_columns, segment_cache_dir, touch_segment
 from openpilot.tools.lib.logreader import _LogFileReader, LogReader
 
 
-def flatten_dict(d: dict, sep: str = "/", prefix: str | None = None) -> dict:
-  result = {}
-  stack: list[tuple] = [(d, prefix)]
-
-  while stack:
-    obj, current_prefix = stack.pop()
-
-    if isinstance(obj, dict):
-      for key, val in obj.items():
-        new_prefix = key if current_prefix is None else f"{current_prefix}{sep}{key}"
-        if isinstance(val, (dict, list)):
-          stack.append((val, new_prefix))
-        else:
-          result[new_prefix] = val
-    elif isinstance(obj, list):
-      for i, item in enumerate(obj):
-        new_prefix = f"{current_prefix}{sep}{i}"
-        if isinstance(item, (dict, list)):
-          stack.append((item, new_prefix))
-        else:
-          result[new_prefix] = item
+# *** extraction straight from the wire format ***
+#
+# Events are serialized again and decoded in one batch per message type, with common.capnp_wire. Every struct
+# schema is walked once per batch, reading a field for all structs that have it at once. The result has the
+# same fields as flattening to_dict(verbose=True): null structs read as defaults, list elements and union
+# members become columns only when present, and enums read as their names.
+
+_SCALAR_DTYPES = {
+  'bool': np.dtype(np.bool_), 'int8': np.dtype('<i1'), 'int16': np.dtype('<i2'), 'int32': np.dtype('<i4'), 'int64': np.dtype('<i8'),
+  'uint8': np.dtype('<u1'), 'uint16': np.dtype('<u2'), 'uint32': np.dtype('<u4'), 'uint64': np.dtype('<u8'),
+  'float32': np.dtype('<f4'), 'float64': np.dtype('<f8'), 'enum': np.dtype('<u2'),
+}
+_NO_ROWS = np.zeros(0, dtype=np.int64)
+
+
+class _Structs(NamedTuple):
+  """Structs of one schema across messages"""
+  data: np.ndarray  # first word of the data section, the pointer section follows it
+  data_words: np.ndarray
+  n_pointers: np.ndarray
+  messages: np.ndarray  # message each struct is in
+
+  def take(self, idx: np.ndarray) -> '_Structs':
+    return _Structs(*(a[idx] for a in self))
+
+
+def _join(name: str, path: str) -> str:
+  return f"{name}/{path}" if path else name
+
+
+def _group_by_index(index: np.ndarray) -> list[tuple[int, np.ndarray]]:
+  """Positions of each list index that occurs, in order"""
+  order = np.argsort(index, kind='stable')
+  counts = np.bincount(index)
+  ends = np.cumsum(counts)
+  return [(i, order[end - count:end]) for i, (count, end) in enumerate(zip(counts.tolist(), ends.tolist(), strict=True)) if count]
+
+
+def _object_array(values: list) -> np.ndarray:
+  out = np.empty(len(values), dtype=object)
+  out[:] = values
+  return out
+
+
+def _enum_names(raw: np.ndarray, schema) -> np.ndarray:
+  # values the schema doesn't know stay ints
+  names = {value: name for name, value in schema.enumerants.items()}
+  size = max(int(raw.max(initial=0)), max(names, default=0)) + 1
+  return _object_array([names.get(value, value) for value in range(size)])[raw]
+
+
+def _read_scalars(words: np.ndarray, structs: _Structs, kind: str, slot) -> np.ndarray:
+  """A data section field of every struct, the default where a struct's data section is too short to have it"""
+  default = getattr(slot.defaultValue, kind)
+  if kind == 'bool':
+    present = structs.data_words * 64 > slot.offset
+    word = words[np.where(present, structs.data + slot.offset // 64, 0)]
+    return (((word >> np.uint64(slot.offset % 64)) & np.uint64(1)).astype(bool) & present) ^ default
+
+  # non-default values are stored xored with the default
+  dtype = _SCALAR_DTYPES[kind]
+  unsigned = np.dtype(f'<u{dtype.itemsize}')
+  present = structs.data_words * 8 >= (slot.offset + 1) * dtype.itemsize
+  raw = read_field(words, np.where(present, structs.data, 0), slot.offset * dtype.itemsize, dtype.itemsize) * present
+  raw = raw.astype(unsigned) ^ np.array(default, dtype=dtype).view(unsigned)
+  return raw.view(dtype)
+
+
+def _read_list_scalars(words: np.ndarray, bit_starts: np.ndarray, kind: str) -> np.ndarray:
+  dtype = _SCALAR_DTYPES[kind]
+  bits = 1 if kind == 'bool' else 8 * dtype.itemsize
+  raw = (words[bit_starts // 64] >> (bit_starts % 64).astype(np.uint64)) & np.uint64((1 << bits) - 1)
+  return raw.astype(bool) if kind == 'bool' else raw.astype(np.dtype(f'<u{dtype.itemsize}')).view(dtype)
+
+
+def _follow(msgs: Messages, slots: np.ndarray, messages: np.ndarray, kind: int):
+  """Non-null pointers among the pointer words in slots (-1 for a missing pointer), where their content starts and ends"""
+  present = slots >= 0
+  present[present] = msgs.words[slots[present]] != 0
+  idx = np.flatnonzero(present)
+  resolved = msgs.resolve(slots[idx], messages[idx])
+  if resolved is None or np.any(resolved[1] & 3 != kind):
+    raise ValueError("Malformed message")
+  return idx, *resolved
+
+
+def _structs_at(msgs: Messages, slots: np.ndarray, messages: np.ndarray) -> _Structs:
+  idx, starts, pointers, ends = _follow(msgs, slots, messages, STRUCT_POINTER)
+  data_words, n_pointers = struct_sizes(pointers)
+  if np.any(starts + data_words + n_pointers > ends):
+    raise ValueError("Malformed message")
+  # null structs read as all defaults
+  structs = _Structs(np.zeros(len(slots), dtype=np.int64), np.zeros(len(slots), dtype=np.int64), np.zeros(len(slots), dtype=np.int64), messages)
+  structs.data[idx], structs.data_words[idx], structs.n_pointers[idx] = starts, data_words, n_pointers
+  return structs
+
+
+def _read_blobs(msgs: Messages, slots: np.ndarray, messages: np.ndarray, text: bool) -> np.ndarray:
+  idx, starts, pointers, ends = _follow(msgs, slots, messages, LIST_POINTER)
+  element_sizes, lengths = list_sizes(pointers)
+  if np.any((element_sizes != 2) | (8 * starts + lengths > 8 * ends)):
+    raise ValueError("Malformed message")
+  buf = memoryview(msgs.words).cast('B')
+  blobs: list = ['' if text else b''] * len(slots)
+  for i, start, length in zip(idx.tolist(), (8 * starts).tolist(), lengths.tolist(), strict=True):
+    # text ends with a NUL that isn't part of it
+    blobs[i] = str(buf[start:start + max(length - 1, 0)], 'utf-8', 'replace') if text else buf[start:start + length].tobytes()
+  return _object_array(blobs)
+
+
+def _decode_list(msgs: Messages, type_proto, schema, slots: np.ndarray, messages: np.ndarray):
+  words = msgs.words
+  element = type_proto.list.elementType
+  kind = element.which()
+  idx, starts, pointers, ends = _follow(msgs, slots, messages, LIST_POINTER)
+  element_sizes, counts = list_sizes(pointers)
+
+  if kind == 'struct':
+    if np.any((element_sizes != LIST_COMPOSITE) | (starts + 1 + counts > ends)):
+      raise ValueError("Malformed message")
+    tags = words[starts]
+    counts, word_counts = ((tags & 0xFFFFFFFF) >> 2).astype(np.int64), counts
+    data_words, n_pointers = struct_sizes(tags)
+    if np.any(counts * (data_words + n_pointers) > word_counts):
+      raise ValueError("Malformed message")
+    owners = np.repeat(idx, counts)
+    index = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    data = np.repeat(starts + 1, counts) + index * np.repeat(data_words + n_pointers, counts)
+    elements = _Structs(data, np.repeat(data_words, counts), np.repeat(n_pointers, counts), messages[owners])
+    columns = _decode_struct(msgs, schema.elementType, elements)
+  else:
+    bits = 64 if kind in ('text', 'data', 'list') else 0 if kind == 'void' else 1 if kind == 'bool' else 8 * _SCALAR_DTYPES[kind].itemsize
+    if np.any((LIST_ELEMENT_BITS[element_sizes] != bits) | (element_sizes == LIST_COMPOSITE) | (64 * starts + bits * counts > 64 * ends)):
+      raise ValueError("Malformed message")
+    owners = np.repeat(idx, counts)
+    index = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.arange(len(owners))
+    if kind in ('text', 'data', 'list'):
+      element_slots = np.repeat(starts, counts) + index
+      element_schema = schema.elementType if kind == 'list' else None
+      columns = _decode_pointer(msgs, element, element_schema, element_slots, messages[owners])
+    elif kind == 'void':
+      columns = [('', np.zeros(0, dtype=object), _NO_ROWS)]
+      positions = _NO_ROWS
     else:
-      if current_prefix is not None:
-        result[current_prefix] = obj
-  return result
-
-
-def extract_field_types(schema, prefix, field_types_dict):
-  stack = [(schema, prefix)]
-
-  while stack:
-    current_schema, current_prefix = stack.pop()
-
-    for field in current_schema.fields_list:
-      field_name = field.proto.name
-      field_path = f"{current_prefix}/{field_name}"
-      field_proto = field.proto
-      field_which = field_proto.which()
-
-      field_type = field_proto.slot.type.which() if field_which == 'slot' else field_which
-      field_types_dict[field_path] = field_type
-
-      if field_which == 'slot':
-        slot_type = field_proto.slot.type
-        type_which = slot_type.which()
-
-        if type_which == 'list':
-          element_type = slot_type.list.elementType.which()
-          list_path = f"{field_path}/*"
-          field_types_dict[list_path] = element_type
-
-          if element_type == 'struct':
-            stack.append((field.schema.elementType, list_path))
-
-        elif type_which == 'struct':
-          stack.append((field.schema, field_path))
-
-      elif field_which == 'group':
-        stack.append((field.schema, field_path))
-
-
-def _convert_to_optimal_dtype(values_list, capnp_type):
-  dtype_mapping = {
-    'bool': np.bool_, 'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
-    'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
-    'float32': np.float32, 'float64': np.float64, 'text': object, 'data': object,
-    'enum': object, 'anyPointer': object,
-  }
-
-  target_dtype = dtype_mapping.get(capnp_type, object)
-  return np.array(values_list, dtype=target_dtype)
-
-
-def _match_field_type(field_path, field_types):
-  if field_path in field_types:
-    return field_types[field_path]
-
-  path_parts = field_path.split('/')
-  template_parts = [p if not p.isdigit() else '*' for p in path_parts]
-  template_path = '/'.join(template_parts)
-  return field_types.get(template_path)
+      values = _read_list_scalars(words, 64 * np.repeat(starts, counts) + bits * index, kind)
+      if kind == 'enum':
+        values = _enum_names(values, schema.elementType)
+      columns = [('', values, positions)]
+
+  # one column per list index, holding the elements of the lists that long
+  for path, values, pos in columns:
+    if not len(values):
+      # empty columns of void elements still exist for each index that occurs
+      for i in range(int(counts.max(initial=0))):
+        yield _join(str(i), path), values, _NO_ROWS
+      continue
+    for i, group in _group_by_index(index[pos]):
+      yield _join(str(i), path), values[group], owners[pos[group]]
+
+
+def _decode_pointer(msgs: Messages, type_proto, schema, slots: np.ndarray, messages: np.ndarray):
+  kind = type_proto.which()
+  if kind == 'struct':
+    yield from _decode_struct(msgs, schema, _structs_at(msgs, slots, messages))
+  elif kind == 'list':
+    yield from _decode_list(msgs, type_proto, schema, slots, messages)
+  elif kind in ('text', 'data'):
+    yield '', _read_blobs(msgs, slots, messages, kind == 'text'), np.arange(len(slots))
+  # anyPointer fields only exist in deprecated generic maps, they aren't extracted
+
+
+def _decode_field(msgs: Messages, field, structs: _Structs):
+  name = field.proto.name
+  if field.proto.which() == 'group':
+    for path, values, pos in _decode_struct(msgs, field.schema, structs):
+      yield _join(name, path), values, pos
+    return
+
+  slot = field.proto.slot
+  kind = slot.type.which()
+  if kind in _SCALAR_DTYPES:
+    values = _read_scalars(msgs.words, structs, kind, slot)
+    yield name, _enum_names(values, field.schema) if kind == 'enum' else values, np.arange(len(structs.data))
+  elif kind == 'void':
+    # void fields never have a value, like the None values from to_dict
+    yield name, np.zeros(0, dtype=object), _NO_ROWS
+  else:
+    slots = np.where(structs.n_pointers > slot.offset, structs.data + structs.data_words + slot.offset, -1)
+    schema = field.schema if kind in ('struct', 'list') else None
+    for path, values, pos in _decode_pointer(msgs, slot.type, schema, slots, structs.messages):
+      yield _join(name, path), values, pos
+
+
+def _decode_struct(msgs: Messages, schema, structs: _Structs):
+  """(path, values, index of the struct each value is from) of every scalar in the structs, and in what they point to"""
+  fields = schema.fields
+  for name in schema.non_union_fields:
+    yield from _decode_field(msgs, fields[name], structs)
+
+  if schema.union_fields:
+    offset = schema.node.struct.discriminantOffset
+    present = structs.data_words * 4 > offset
+    discriminants = read_field(msgs.words, np.where(present, structs.data, 0), 2 * offset, 2) * present
+    for name in schema.union_fields:
+      members = np.flatnonzero(discriminants == fields[name].proto.discriminantValue)
+      if len(members):
+        for path, values, pos in _decode_field(msgs, fields[name], structs.take(members)):
+          yield path, values, members[pos]
+
+
+def _time_series(typ: str, columns, num_msgs: int) -> dict:
+  typ_result: dict = {}
+  for path, values, rows in columns:
+    if len(rows) == num_msgs:
+      typ_result[path] = {'values': values, 'sparse': False}
+    else:
+      # check if indices > uint16 max, currently would require a 1000+ Hz signal since indices are within segments
+      assert len(rows) == 0 or rows[-1] <= 65535, f"Sparse field {typ}/{path} has timestamp indices exceeding uint16 max. Max: {rows[-1]}"
+      typ_result[path] = {'values': values, 'sparse': True, 't_index': rows.astype(np.uint16)}
+  return typ_result
 
 
 def _get_field_times_values(segment, field_name):
@@ -109,103 +256,104 @@ def _get_field_times_values(segment, field_name):
 
 def msgs_to_time_series(msgs):
   """Extract scalar fields and return (time_series_data, start_time, end_time)."""
-  collected_data = defaultdict(lambda: {'timestamps': [], 'columns': defaultdict(list), 'sparse_fields': set()})
-  field_types = {}
-  extracted_schemas = set()
-  min_time = max_time = None
-
-  for msg in msgs:
-    typ = msg.which()
-    timestamp = msg.logMonoTime * 1e-9
-    if typ != 'initData':
-      if min_time is None:
-        min_time = timestamp
-      max_time = timestamp
-
-    sub_msg = getattr(msg, typ)
-    if not hasattr(sub_msg, 'to_dict'):
-      continue
-
-    if hasattr(sub_msg, 'schema') and typ not in extracted_schemas:
-      extract_field_types(sub_msg.schema, typ, field_types)
-      extracted_schemas.add(typ)
-
-    try:
-      msg_dict = sub_msg.to_dict(verbose=True)
-    except Exception as e:
-      cloudlog.warning(f"Failed to convert sub_msg.to_dict() for message of type: {typ}: {e}")
-      continue
-
-    flat_dict = flatten_dict(msg_dict)
-    flat_dict['_valid'] = msg.valid
-    field_types[f"{typ}/_valid"] = 'bool'
-
-    type_data = collected_data[typ]
-    columns, sparse_fields = type_data['columns'], type_data['sparse_fields']
-    known_fields = set(columns.keys())
-    missing_fields = known_fields - flat_dict.keys()
-
-    for field, value in flat_dict.items():
-      if field not in known_fields and type_data['timestamps']:
-        sparse_fields.add(field)
-      columns[field].append(value)
-      if value is None:
-        sparse_fields.add(field)
+  msgs = read_messages([msg.as_builder().to_bytes() for msg in msgs])
+  if msgs is None:
+    raise ValueError("Malformed message")
+  n_msgs = len(msgs.first_segment)
+  if n_msgs == 0:
+    return {}, 0.0, 0.0
 
-    for field in missing_fields:
-      columns[field].append(None)
-      sparse_fields.add(field)
+  event_schema = log.Event.schema
+  events = _structs_at(msgs, msgs.roots, np.arange(n_msgs))
+  event_fields = event_schema.fields
+  timestamps = _read_scalars(msgs.words, events, 'uint64', event_fields['logMonoTime'].proto.slot) * 1e-9
+  valid = _read_scalars(msgs.words, events, 'bool', event_fields['valid'].proto.slot)
+  offset = event_schema.node.struct.discriminantOffset
+  which = read_field(msgs.words, events.data, 2 * offset, 2) * (events.data_words * 4 > offset)
 
-    type_data['timestamps'].append(timestamp)
+  not_init = np.flatnonzero(which != event_fields['initData'].proto.discriminantValue)
+  start_time, end_time = (timestamps[not_init[0]], timestamps[not_init[-1]]) if len(not_init) else (0.0, 0.0)
 
+  # message types in the order they first appear
+  members = {event_fields[name].proto.discriminantValue: event_fields[name] for name in event_schema.union_fields}
+  types, first = np.unique(which, return_index=True)
   final_result = {}
-  for typ, data in collected_data.items():
-    if not data['timestamps']:
+  for discriminant in types[np.argsort(first)].tolist():
+    field = members.get(discriminant)
+    if field is None or field.proto.slot.type.which() != 'struct':
       continue
+    sel = np.flatnonzero(which == discriminant)
+    slot = field.proto.slot.offset
+    structs = _structs_at(msgs, np.where(events.n_pointers[sel] > slot, events.data[sel] + events.data_words[sel] + slot, -1), sel)
+
+    typ = field.proto.name
+    typ_result = {'t': timestamps[sel]}
+    typ_result.update(_time_series(typ, _decode_struct(msgs, field.schema, structs), len(sel)))
+    typ_result['_valid'] = {'values': valid[sel], 'sparse': False}
+    final_result[typ] = typ_result
+  return final_result, float(start_time), float(end_time)
 
-    typ_result = {'t': np.array(data['timestamps'], dtype=np.float64)}
-    sparse_fields = data['sparse_fields']
-
-    for field_name, values in data['columns'].items():
-      if len(values) < len(data['timestamps']):
-        values = [None] * (len(data['timestamps']) - len(values)) + values
-        sparse_fields.add(field_name)
-
-      capnp_type = _match_field_type(f"{typ}/{field_name}", field_types)
 
-      if field_name in sparse_fields:  # extract non-None values and their indices
-        non_none_indices = []
-        non_none_values = []
-        for i, value in enumerate(values):
-          if value is not None:
-            non_none_indices.append(i)
-            non_none_values.append(value)
+def _save_cached_segment(segment_identifier: str, segment_data: dict, start_time: float, end_time: float):
+  cache_dir = segment_cache_dir(segment_identifier)
+  os.makedirs(cache_dir, exist_ok=True)
 
-        if non_none_values: # check if indices > uint16 max, currently would require a 1000+ Hz signal since indices are within segments
-          assert max(non_none_indices) <= 65535, f"Sparse field {typ}/{field_name} has timestamp indices exceeding uint16 max. Max: {max(non_none_indices)}"
+  for typ, typ_data in segment_data.items():
+    columns = {'t': typ_data['t']}
+    for field_name, field_data in typ_data.items():
+      if field_name != 't':
+        columns[f"{field_name}#values"] = field_data['values']
+        if field_data['sparse']:
+          columns[f"{field_name}#t_index"] = field_data['t_index']
+    save_columns(os.path.join(cache_dir, f"{typ}.cols"), columns)
 
-        typ_result[field_name] = {
-          'values': _convert_to_optimal_dtype(non_none_values, capnp_type),
-          'sparse': True,
-          't_index': np.array(non_none_indices, dtype=np.uint16),
-        }
-      else:  # dense representation
-        typ_result[field_name] = {'values': _convert_to_optimal_dtype(values, capnp_type), 'sparse': False}
+  # the metadata is written last, so its presence marks a complete entry
+  with atomic_write(os.path.join(cache_dir, "meta.json"), mode="w", overwrite=True) as f:
+    json.dump({'types': list(segment_data.keys()), 'start_time': start_time, 'end_time': end_time}, f)
 
-    final_result[typ] = typ_result
 
-  return final_result, min_time or 0.0, max_time or 0.0
+def _load_cached_segment(segment_identifier: str):
+  cache_dir = segment_cache_dir(segment_identifier)
+  try:
+    with open(os.path.join(cache_dir, "meta.json")) as f:
+      meta = json.load(f)
+
+    segment_data = {}
+    for typ in meta['types']:
+      columns = load_columns(os.path.join(cache_dir, f"{typ}.cols"))
+      typ_data = {'t': columns.pop('t')}
+      for name, values in columns.items():
+        field_name, kind = name.rsplit('#', 1)
+        if kind == 'values':
+          typ_data[field_name] = {'values': values, 'sparse': f"{field_name}#t_index" in columns}
+          if typ_data[field_name]['sparse']:
+            typ_data[field_name]['t_index'] = columns[f"{field_name}#t_index"]
+      segment_data[typ] = typ_data
+    touch_segment(cache_dir)
+    return segment_data, meta['start_time'], meta['end_time']
+  except (OSError, ValueError, KeyError):
+    return None
 
 
 def _process_segment(segment_identifier: str):
+  cached = _load_cached_segment(segment_identifier)
+  if cached is not None:
+    return cached
+
   try:
     lr = _LogFileReader(segment_identifier, sort_by_time=True)
     migrated_msgs = migrate_all(lr)
-    return msgs_to_time_series(migrated_msgs)
+    result = msgs_to_time_series(migrated_msgs)
   except Exception as e:
     cloudlog.warning(f"Warning: Failed to process segment {segment_identifier}: {e}")
     return {}, 0.0, 0.0
 
+  try:
+    _save_cached_segment(segment_identifier, *result)
+  except OSError as e:
+    cloudlog.warning(f"Warning: Failed to cache segment {segment_identifier}: {e}")
+  return result
+
 
 class DataManager:
   def __init__(self):
@@ -320,12 +468,19 @@ class DataManager:
       for callback in observers:
         callback({'metadata_loaded': True, 'total_segments': total_segments})
 
-      num_processes = max(1, multiprocessing.cpu_count() // 2)
+      # cached segments are memory-mapped in this process, the rest are parsed in parallel
+      cached = [_load_cached_segment(identifier) for identifier in lr.logreader_identifiers]
+      uncached = [identifier for identifier, result in zip(lr.logreader_identifiers, cached, strict=True) if result is None]
+
+      num_processes = max(1, min(multiprocessing.cpu_count() // 2, len(uncached)))
       with multiprocessing.Pool(processes=num_processes) as pool, tqdm(total=len(lr.logreader_identifiers), desc="Processing Segments") as pbar:
-        for segment_result, start_time, end_time in pool.imap(_process_segment, lr.logreader_identifiers):
+        processed = pool.imap(_process_segment, uncached)
+        for result in cached:
+          segment_result, start_time, end_time = result if result is not None else next(processed)
           pbar.update(1)
           if segment_result:
             self._add_segment(segment_result, start_time, end_time)
+      prune_columns()
     except Exception:
       cloudlog.exception(f"Error loading route {route}:")
     finally:
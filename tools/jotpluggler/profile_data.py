@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import numpy as np
+from collections import defaultdict
+
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.tools.jotpluggler.data import msgs_to_time_series
+from openpilot.tools.lib.logreader import LogReader
+
+DEMO_ROUTE = "a2a0ccea32023010|2023-07-27--13-01-19/0"
+
+
+def flatten_dict(d: dict, sep: str = "/", prefix: str | None = None) -> dict:
+  result = {}
+  stack: list[tuple] = [(d, prefix)]
+  while stack:
+    obj, current_prefix = stack.pop()
+    if isinstance(obj, dict):
+      for key, val in obj.items():
+        new_prefix = key if current_prefix is None else f"{current_prefix}{sep}{key}"
+        if isinstance(val, (dict, list)):
+          stack.append((val, new_prefix))
+        else:
+          result[new_prefix] = val
+    elif isinstance(obj, list):
+      for i, item in enumerate(obj):
+        new_prefix = f"{current_prefix}{sep}{i}"
+        if isinstance(item, (dict, list)):
+          stack.append((item, new_prefix))
+        else:
+          result[new_prefix] = item
+  return result
+
+
+def convert_to_optimal_dtype(values_list, capnp_type):
+  dtype_mapping = {
+    'bool': np.bool_, 'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+    'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+    'float32': np.float32, 'float64': np.float64, 'text': object, 'data': object,
+    'enum': object, 'anyPointer': object,
+  }
+
+  target_dtype = dtype_mapping.get(capnp_type, object)
+  return np.array(values_list, dtype=target_dtype)
+
+
+def extract_field_types(schema, prefix, field_types_dict):
+  stack = [(schema, prefix)]
+  while stack:
+    current_schema, current_prefix = stack.pop()
+    for field in current_schema.fields_list:
+      field_path = f"{current_prefix}/{field.proto.name}"
+      field_which = field.proto.which()
+      field_types_dict[field_path] = field.proto.slot.type.which() if field_which == 'slot' else field_which
+      if field_which == 'slot':
+        slot_type = field.proto.slot.type
+        if slot_type.which() == 'list':
+          element_type = slot_type.list.elementType.which()
+          field_types_dict[f"{field_path}/*"] = element_type
+          if element_type == 'struct':
+            stack.append((field.schema.elementType, f"{field_path}/*"))
+        elif slot_type.which() == 'struct':
+          stack.append((field.schema, field_path))
+      elif field_which == 'group':
+        stack.append((field.schema, field_path))
+
+
+def reference_msgs_to_time_series(msgs):
+  """The to_dict + flatten_dict extraction msgs_to_time_series used to do, for comparison"""
+  collected_data = defaultdict(lambda: {'timestamps': [], 'columns': defaultdict(list), 'sparse_fields': set()})
+  field_types: dict[str, str] = {}
+  for msg in msgs:
+    typ = msg.which()
+    sub_msg = getattr(msg, typ)
+    if not hasattr(sub_msg, 'to_dict'):
+      continue
+    if f"{typ}/_valid" not in field_types:
+      extract_field_types(sub_msg.schema, typ, field_types)
+    flat_dict = flatten_dict(sub_msg.to_dict(verbose=True))
+    flat_dict['_valid'] = msg.valid
+    field_types[f"{typ}/_valid"] = 'bool'
+
+    type_data = collected_data[typ]
+    columns, sparse_fields = type_data['columns'], type_data['sparse_fields']
+    known_fields = set(columns.keys())
+    for field, value in flat_dict.items():
+      if field not in known_fields and type_data['timestamps']:
+        sparse_fields.add(field)
+      columns[field].append(value)
+      if value is None:
+        sparse_fields.add(field)
+    for field in known_fields - flat_dict.keys():
+      columns[field].append(None)
+      sparse_fields.add(field)
+    type_data['timestamps'].append(msg.logMonoTime * 1e-9)
+
+  result = {}
+  for typ, data in collected_data.items():
+    num_msgs = len(data['timestamps'])
+    typ_result = {'t': np.array(data['timestamps'], dtype=np.float64)}
+    for field_name, values in data['columns'].items():
+      if len(values) < num_msgs:
+        values = [None] * (num_msgs - len(values)) + values
+        data['sparse_fields'].add(field_name)
+      path_parts = f"{typ}/{field_name}".split('/')
+      capnp_type = field_types.get('/'.join(p if not p.isdigit() else '*' for p in path_parts))
+      if field_name in data['sparse_fields']:
+        t_index = [i for i, v in enumerate(values) if v is not None]
+        typ_result[field_name] = {'values': convert_to_optimal_dtype([values[i] for i in t_index], capnp_type), 'sparse': True,
+                                  't_index': np.array(t_index, dtype=np.uint16)}
+      else:
+        typ_result[field_name] = {'values': convert_to_optimal_dtype(values, capnp_type), 'sparse': False}
+    result[typ] = typ_result
+  return result
+
+
+def assert_same(result, reference):
+  assert result.keys() == reference.keys(), set(result.keys()) ^ set(reference.keys())
+  for typ, fields in reference.items():
+    assert result[typ].keys() == fields.keys(), (typ, set(result[typ].keys()) ^ set(fields.keys()))
+    assert np.array_equal(result[typ]['t'], fields['t'])
+    for name, field in fields.items():
+      if name == 't':
+        continue
+      got = result[typ][name]
+      assert got['sparse'] == field['sparse'], f"{typ}/{name}"
+      if field['sparse']:
+        assert np.array_equal(got['t_index'], field['t_index']), f"{typ}/{name}"
+      assert len(got['values']) == len(field['values']) and all(a == b for a, b in zip(got['values'], field['values'], strict=True)), f"{typ}/{name}"
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark jotpluggler field extraction against to_dict + flatten_dict")
+  parser.add_argument("route", nargs="?", default=DEMO_ROUTE, help="segment to extract")
+  args = parser.parse_args()
+
+  msgs = list(migrate_all(LogReader(args.route, sort_by_time=True)))
+
+  start = time.monotonic()
+  reference = reference_msgs_to_time_series(msgs)
+  reference_time = time.monotonic() - start
+
+  start = time.monotonic()
+  result, _, _ = msgs_to_time_series(msgs)
+  decoded_time = time.monotonic() - start
+
+  assert_same(result, reference)
+  print(f"{len(msgs)} messages, {sum(len(v) - 1 for v in result.values())} fields")
+  print(f"to_dict + flatten_dict: {reference_time:.2f} s ({reference_time / len(msgs) * 1e6:.1f} us / msg)")
+  print(f"batched wire decoding:  {decoded_time:.2f} s ({decoded_time / len(msgs) * 1e6:.1f} us / msg)")
+  print(f"speedup: {reference_time / decoded_time:.1f}x")
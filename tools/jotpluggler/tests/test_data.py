@@ -0,0 +1,135 @@
+import os
+from collections import defaultdict
+
+import hypothesis.strategies as st
+import numpy as np
+import pytest
+from hypothesis import HealthCheck, Phase, given, settings
+
+from cereal import log
+from openpilot.selfdrive.test.fuzzy_generation import FuzzyGenerator
+from openpilot.tools.jotpluggler.data import msgs_to_time_series
+
+MAX_EXAMPLES = int(os.environ.get("MAX_EXAMPLES", "10"))
+FUZZ_SERVICES = ['accelerometer', 'carState', 'controlsState', 'gnssMeasurements', 'managerState']
+
+
+def flatten(d, prefix: str) -> dict:
+  """Leaves of a to_dict() message, with list items indexed in the path"""
+  items = d.items() if isinstance(d, dict) else enumerate(d)
+  result = {}
+  for key, val in items:
+    path = f"{prefix}/{key}" if prefix else str(key)
+    if isinstance(val, (dict, list)):
+      result.update(flatten(val, path))
+    else:
+      result[path] = val
+  return result
+
+
+def expected_time_series(msgs) -> dict:
+  """Every field of every message through to_dict, as {type: {field: [(message index, value)]}}"""
+  expected: dict = defaultdict(lambda: defaultdict(list))
+  for msg in msgs:
+    typ = msg.which()
+    sub_msg = getattr(msg, typ)
+    if not hasattr(sub_msg, 'to_dict'):
+      continue
+    columns = expected[typ]
+    columns['t'].append((None, msg.logMonoTime * 1e-9))
+    fields = flatten(sub_msg.to_dict(verbose=True), '')
+    fields['_valid'] = msg.valid
+    for field, value in fields.items():
+      columns[field].append((len(columns['t']) - 1, value))
+  return expected
+
+
+def assert_matches_to_dict(msgs):
+  result, _, _ = msgs_to_time_series(msgs)
+  expected = expected_time_series(msgs)
+  assert result.keys() == expected.keys()
+  for typ, columns in expected.items():
+    assert result[typ].keys() == columns.keys(), (typ, result[typ].keys() ^ columns.keys())
+    assert result[typ]['t'].tolist() == [t for _, t in columns['t']]
+    for field, values in columns.items():
+      if field == 't':
+        continue
+      column = result[typ][field]
+      indices = [i for i, _ in values]
+      # fields missing from some messages of a type are sparse, and only kept where they're set
+      assert column['sparse'] == (len(indices) < len(columns['t'])), f"{typ}/{field}"
+      if column['sparse']:
+        assert column['t_index'].tolist() == indices, f"{typ}/{field}"
+      assert len(column['values']) == len(values), f"{typ}/{field}"
+      assert all(a == b for a, (_, b) in zip(column['values'], values, strict=True)), f"{typ}/{field}"
+
+
+def event(mono_time: int, **kwargs):
+  return log.Event.new_message(logMonoTime=mono_time, valid=mono_time % 3 != 0, **kwargs).as_reader()
+
+
+class TestMsgsToTimeSeries:
+  def test_list_of_struct(self):
+    msgs = []
+    for i, n_buttons in enumerate([0, 2, 1, 3, 0]):
+      buttons = [{'type': ['accelCruise', 'cancel', 'setCruise'][j % 3], 'pressed': j % 2 == 0} for j in range(n_buttons)]
+      msgs.append(event(2 * i, carState={'vEgo': float(i), 'buttonEvents': buttons}))
+      processes = [{'name': f"process{j}", 'running': j != i, 'pid': 100 * i + j, 'exitCode': -j} for j in range(i % 3 + 1)]
+      msgs.append(event(2 * i + 1, managerState={'processes': processes}))
+    assert_matches_to_dict(msgs)
+
+    result, _, _ = msgs_to_time_series(msgs)
+    assert result['carState']['buttonEvents/2/type']['t_index'].tolist() == [3]
+    assert result['carState']['buttonEvents/1/pressed']['values'].tolist() == [False, False]
+    assert result['managerState']['processes/0/name']['values'].tolist() == ["process0"] * 5
+    assert not result['managerState']['processes/0/pid']['sparse']
+
+  def test_unions(self):
+    states = [
+      {'pidState': {'active': True, 'output': 0.5}},
+      {'torqueState': {'active': True, 'error': 1.5, 'saturated': True}},
+      {'angleState': {'steeringAngleDeg': -3.0}},
+      {'pidState': {'active': False, 'p': 2.0}},
+    ]
+    sensors = [
+      {'acceleration': {'v': [0.1, 9.8, 0.3], 'status': 1}},
+      {'light': 5.0},
+      {'acceleration': {'v': [], 'status': 0}},
+      {'temperature': 30.0},
+    ]
+    msgs = []
+    for i, (state, sensor) in enumerate(zip(states, sensors, strict=True)):
+      msgs.append(event(2 * i, controlsState={'curvature': 0.1 * i, 'lateralControlState': state}))
+      msgs.append(event(2 * i + 1, accelerometer={'sensor': 4, 'timestamp': i, **sensor}))
+    assert_matches_to_dict(msgs)
+
+    result, _, _ = msgs_to_time_series(msgs)
+    assert result['controlsState']['lateralControlState/pidState/active']['t_index'].tolist() == [0, 3]
+    assert result['controlsState']['lateralControlState/torqueState/error']['values'].tolist() == [1.5]
+    assert result['accelerometer']['acceleration/v/1']['t_index'].tolist() == [0]
+    assert 'temperature' in result['accelerometer'] and 'light' in result['accelerometer']
+
+  def test_large_messages(self):
+    # messages past the first segment are reached through far pointers
+    msgs = [event(i, managerState={'processes': [{'name': 'x' * 1000, 'pid': j} for j in range(20 * i)]}) for i in range(4)]
+    msgs.append(event(4, carState={'buttonEvents': [{'type': 'cancel'}] * 5000}))
+    assert any(len(msg.as_builder().to_segments()) > 1 for msg in msgs)
+    assert_matches_to_dict(msgs)
+
+  def test_empty(self):
+    assert msgs_to_time_series([]) == ({}, 0.0, 0.0)
+
+  def test_times(self):
+    msgs = [event(0, initData={}), event(int(1e9), carState={}), event(int(3e9), initData={}), event(int(2e9), carState={})]
+    result, start, end = msgs_to_time_series(msgs)
+    assert (start, end) == (1.0, 2.0)
+    assert list(result) == ['initData', 'carState']
+    np.testing.assert_array_equal(result['carState']['t'], [1.0, 2.0])
+
+  @pytest.mark.parametrize("service", FUZZ_SERVICES)
+  @given(data=st.data())
+  @settings(phases=[Phase.generate], max_examples=MAX_EXAMPLES, deadline=None,
+            suppress_health_check=[HealthCheck.too_slow, HealthCheck.data_too_large])
+  def test_fuzzy(self, service, data):
+    msgs = [FuzzyGenerator.get_random_event_msg(data.draw, events=[service], real_floats=True)[0] for _ in range(3)]
+    assert_matches_to_dict([log.Event.new_message(**msg).as_reader() for msg in msgs])
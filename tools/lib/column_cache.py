@@ -0,0 +1,136 @@
+import glob
+import json
+import os
+import pickle
+import shutil
+import struct
+from hashlib import md5
+from functools import cache
+
+import numpy as np
+
+from cereal import CEREAL_PATH
+from openpilot.common.basedir import BASEDIR
+from openpilot.common.utils import atomic_write
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
+from openpilot.tools.lib.filereader import file_length, resolve_name
+
+# bump when the layout of cached columns changes
+CACHE_VERSION = 2
+CACHE_SIZE = 4 * 1024 * 1024 * 1024  # least recently used segments are removed past this total size
+
+# cached columns are extracted from migrated logs, so a change to the migrations invalidates them too
+MIGRATION_PATH = os.path.join(BASEDIR, "selfdrive/test/process_replay/migration.py")
+
+MAGIC = b"OPCOLS01"
+ALIGN = 64
+
+
+@cache
+def schema_hash() -> str:
+  """Hash of the cereal schema and the log migrations, cached columns are invalidated when either changes"""
+  h = md5(str(CACHE_VERSION).encode())
+  for fn in sorted(glob.glob(os.path.join(CEREAL_PATH, "*.capnp"))) + [MIGRATION_PATH]:
+    with open(fn, "rb") as f:
+      h.update(f.read())
+  return h.hexdigest()[:16]
+
+
+def source_version(fn: str) -> str:
+  """Size and modification time of a local log, or the length of a remote one, so a replaced log isn't served from the cache"""
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    return str(file_length(fn))
+  st = os.stat(fn)
+  return f"{st.st_size}_{st.st_mtime_ns}"
+
+
+def segment_cache_dir(identifier: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+  fn = identifier.split("?")[0]
+  key = md5(f"{fn}:{source_version(identifier)}".encode()).hexdigest()
+  return os.path.join(cache_dir, "columns", f"{key}_{schema_hash()}")
+
+
+def touch_segment(path: str) -> None:
+  """Marks a cached segment as used, its metadata file's mtime is the access time pruning goes by"""
+  os.utime(os.path.join(path, "meta.json"))
+
+
+def prune_columns(cache_dir: str = DEFAULT_CACHE_DIR, max_size: int = CACHE_SIZE) -> None:
+  """Removes the least recently used segments until the cached columns are under max_size"""
+  entries = []
+  try:
+    segments = list(os.scandir(os.path.join(cache_dir, "columns")))
+  except FileNotFoundError:
+    return
+  for segment in segments:
+    try:
+      files = list(os.scandir(segment.path))
+      size = sum(f.stat().st_size for f in files)
+      # entries still being written have no metadata yet, the directory's mtime stands in for it
+      atime = next((f.stat().st_mtime for f in files if f.name == "meta.json"), segment.stat().st_mtime)
+    except OSError:
+      continue
+    entries.append((atime, size, segment.path))
+
+  total = sum(size for _, size, _ in entries)
+  for _, size, path in sorted(entries):
+    if total <= max_size:
+      break
+    shutil.rmtree(path, ignore_errors=True)
+    total -= size
+
+
+def _padding(n: int) -> int:
+  return -n % ALIGN
+
+
+def save_columns(path: str, columns: dict[str, np.ndarray]) -> None:
+  """Writes named arrays to a single file, laid out so numeric columns can be memory-mapped back"""
+  entries, blobs = [], []
+  offset = 0
+  for name, arr in columns.items():
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject:
+      blob = pickle.dumps(arr, protocol=pickle.HIGHEST_PROTOCOL)
+      entries.append({"name": name, "pickle": True, "offset": offset, "size": len(blob)})
+    else:
+      arr = np.ascontiguousarray(arr)
+      blob = arr.tobytes()
+      entries.append({"name": name, "dtype": arr.dtype.str, "shape": arr.shape, "offset": offset, "size": len(blob)})
+    blobs.append(blob)
+    offset += len(blob) + _padding(len(blob))
+
+  header = json.dumps(entries).encode()
+  preamble = len(MAGIC) + 8 + len(header)
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    f.write(MAGIC)
+    f.write(struct.pack("<Q", len(header)))
+    f.write(header)
+    f.write(b"\x00" * _padding(preamble))
+    for blob in blobs:
+      f.write(blob)
+      f.write(b"\x00" * _padding(len(blob)))
+
+
+def load_columns(path: str) -> dict[str, np.ndarray]:
+  """Reads arrays written by save_columns. Numeric columns are read-only views of a memory-mapped file"""
+  buf = np.memmap(path, dtype=np.uint8, mode="r")
+  if bytes(buf[:len(MAGIC)]) != MAGIC:
+    raise ValueError(f"not a column file: {path}")
+
+  header_len = struct.unpack("<Q", bytes(buf[len(MAGIC):len(MAGIC) + 8]))[0]
+  header_end = len(MAGIC) + 8 + header_len
+  data_start = header_end + _padding(header_end)
+
+  columns = {}
+  for entry in json.loads(bytes(buf[len(MAGIC) + 8:header_end])):
+    start = data_start + entry["offset"]
+    if entry.get("pickle"):
+      columns[entry["name"]] = pickle.loads(buf[start:start + entry["size"]])
+    elif entry["size"] == 0:
+      columns[entry["name"]] = np.empty(entry["shape"], dtype=entry["dtype"])
+    else:
+      dtype = np.dtype(entry["dtype"])
+      columns[entry["name"]] = np.frombuffer(buf, dtype=dtype, count=entry["size"] // dtype.itemsize, offset=start).reshape(entry["shape"])
+  return columns
@@ -6,7 +6,8 @@ from functools import cache
 from openpilot.common.utils import retry
 from urllib.parse import urlparse
 
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.url_file import URLFile, hash_url
 
 DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://data-raw.comma.internal/")
 
@@ -35,6 +36,26 @@ def resolve_name(fn):
   return fn
 
 
+def file_length(fn: str) -> int:
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    return URLFile(fn).get_length()
+  try:
+    return os.path.getsize(fn)
+  except OSError:
+    return -1
+
+
+def derived_cache_path(fn: str, suffix: str) -> str | None:
+  """Path in the download cache for data derived from fn, like indexes. None if caching is disabled"""
+  if not fn or int(os.environ.get("DISABLE_FILEREADER_CACHE", "0")) == 1:
+    return None
+  fn = resolve_name(fn)
+  if not fn.startswith(("http://", "https://")):
+    fn = os.path.abspath(fn)
+  return os.path.join(Paths.download_cache_root(), hash_url(fn) + suffix)
+
+
 @cache
 def file_exists(fn):
   fn = resolve_name(fn)
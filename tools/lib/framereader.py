@@ -2,12 +2,19 @@ import os
 import subprocess
 import json
 import logging
+import multiprocessing
 from collections.abc import Iterator
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
 
+import av
 import numpy as np
-from openpilot.tools.lib.filereader import FileReader, resolve_name
+from av.codec.hwaccel import HWAccel
+from openpilot.common.utils import atomic_write
+from openpilot.system.camerad.cameras.nv12_info import get_nv12_info
+from openpilot.tools.lib.filereader import FileReader, derived_cache_path, file_length, resolve_name
 from openpilot.tools.lib.exceptions import DataUnreadableError
+from openpilot.tools.lib.url_file import prune_cache
 from openpilot.tools.lib.vidindex import hevc_index
 
 logger = logging.getLogger("tools")
@@ -16,6 +23,9 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the format of cached video indexes changes
+VIDEO_INDEX_VERSION = 1
+
 class LRUCache:
   def __init__(self, capacity: int):
     self._cache: OrderedDict = OrderedDict()
@@ -33,6 +43,13 @@ class LRUCache:
   def __contains__(self, key):
     return key in self._cache
 
+def nv12_planes(buf: np.ndarray, w: int, h: int) -> tuple[np.ndarray, np.ndarray]:
+  """Views of the visible Y and interleaved UV planes of a stride-padded NV12 buffer laid out like camerad's (get_nv12_info)"""
+  stride, y_height, _, _ = get_nv12_info(w, h)
+  y = buf[:stride * h].reshape(h, stride)[:, :w]
+  uv = buf[stride * y_height:stride * (y_height + h // 2)].reshape(h // 2, stride)[:, :w]
+  return y, uv
+
 def assert_hvec(fn: str) -> None:
   with FileReader(fn) as f:
     header = f.read(4)
@@ -42,30 +59,6 @@ def assert_hvec(fn: str) -> None:
     if 'hevc' not in fn:
       raise NotImplementedError(fn)
 
-def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc', hwaccel="auto", loglevel="info") -> np.ndarray:
-  threads = os.getenv("FFMPEG_THREADS", "0")
-  args = ["ffmpeg", "-v", loglevel,
-          "-threads", threads,
-          "-hwaccel", hwaccel,
-          "-c:v", "hevc",
-          "-vsync", "0",
-          "-f", vid_fmt,
-          "-flags2", "showall",
-          "-i", "-",
-          "-f", "rawvideo",
-          "-pix_fmt", pix_fmt,
-          "-"]
-  dat = subprocess.check_output(args, input=rawdat)
-
-  ret: np.ndarray
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt in ["nv12", "yuv420p"]:
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  else:
-    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
-  return ret
-
 def ffprobe(fn, fmt=None):
   fn = resolve_name(fn)
   cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams"]
@@ -88,18 +81,61 @@ def get_index_data(fn: str, index_data: dict|None = None):
   stream = index_data["probe"]["streams"][0]
   return index_data["index"], index_data["global_prefix"], stream["width"], stream["height"]
 
+def load_video_index(fn: str) -> dict | None:
+  """Returns the cached index of a video file, or None if it's missing or stale"""
+  path = derived_cache_path(fn, "_vidindex")
+  if path is None or not os.path.exists(path):
+    return None
+
+  try:
+    with np.load(path) as f:
+      version, length = f['version'].item(), f['length'].item()
+      index_data = {
+        'index': f['index'],
+        'global_prefix': f['global_prefix'].tobytes(),
+        'probe': json.loads(f['probe'].item()),
+      }
+  except (OSError, ValueError, KeyError):
+    return None
+
+  if version != VIDEO_INDEX_VERSION or length != file_length(fn):
+    return None
+  return index_data
+
+def save_video_index(fn: str, index_data: dict) -> None:
+  path = derived_cache_path(fn, "_vidindex")
+  if path is None:
+    return
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    np.savez(f, version=VIDEO_INDEX_VERSION, length=index_data['index'][-1, 1], index=index_data['index'],
+             global_prefix=np.frombuffer(index_data['global_prefix'], dtype=np.uint8), probe=json.dumps(index_data['probe']))
+  prune_cache({os.path.basename(path): os.path.getsize(path)})
+
 def get_video_index(fn):
+  index_data = load_video_index(fn)
+  if index_data is not None:
+    return index_data
+
   assert_hvec(fn)
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  save_video_index(fn, index_data)
+  return index_data
 
 class FfmpegDecoder:
+  """
+  Decodes frames of an HEVC file with a single decoder session.
+
+  hwaccel: "auto" (or None, "none") decodes in software, so frames are the same on every machine. A device type
+    like "cuda" or "vaapi" decodes with that hardware device, falling back to software if it's not available.
+  """
   def __init__(self, fn: str, index_data: dict|None = None,
                pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet"):
     self.fn = fn
@@ -108,6 +144,28 @@ class FfmpegDecoder:
     self.iframes = np.where(self.index[:, 0] == HEVC_SLICE_I)[0]
     self.pix_fmt = pix_fmt
     self.loglevel, self.hwaccel = loglevel, hwaccel
+    if pix_fmt == "rgb24":
+      self.frame_shape: tuple[int, ...] = (self.h, self.w, 3)
+    elif pix_fmt in ["nv12", "yuv420p"]:
+      self.frame_shape = (self.h*self.w*3//2,)
+    else:
+      raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+
+    # one decoder session is reused for every GOP. get_frame keeps decoding where it stopped, as long as the
+    # session isn't used for another GOP in between
+    self._codec: av.CodecContext | None = None
+    self._frames: Iterator[av.VideoFrame] | None = None
+    self._frames_gop = -1
+    self._next_fidx = 0
+
+  def _codec_context(self) -> av.CodecContext:
+    if self._codec is None:
+      hwaccel = HWAccel(device_type=self.hwaccel) if self.hwaccel not in (None, "auto", "none") else None
+      self._codec = av.CodecContext.create("hevc", "r", hwaccel=hwaccel)
+      self._codec.options = {"flags2": "+showall"}
+      self._codec.thread_count = int(os.getenv("FFMPEG_THREADS", "0"))
+      self._codec.thread_type = "AUTO"
+    return self._codec
 
   def _gop_bounds(self, frame_idx: int):
     f_b = frame_idx
@@ -118,23 +176,86 @@ class FfmpegDecoder:
       f_e += 1
     return f_b, f_e, self.index[f_b, 1], self.index[f_e, 1]
 
-  def _decode_gop(self, raw: bytes) -> Iterator[np.ndarray]:
-    yield from decompress_video_data(raw, self.w, self.h, pix_fmt=self.pix_fmt, hwaccel=self.hwaccel, loglevel=self.loglevel)
+  def __getstate__(self):
+    # FrameReaders get pickled with their decoded frames, the decoder session can't be
+    state = self.__dict__.copy()
+    state['_codec'] = None
+    state['_frames'] = None
+    return state
+
+  def _to_ndarray(self, frame: av.VideoFrame) -> np.ndarray:
+    if self.pix_fmt == "rgb24":
+      # match the default scaler of the ffmpeg cli
+      return frame.to_ndarray(format="rgb24", interpolation="BICUBIC")
+    return frame.to_ndarray(format=self.pix_fmt).reshape(self.frame_shape)
+
+  def _copy_nv12(self, frame: av.VideoFrame, y: np.ndarray, uv: np.ndarray) -> None:
+    # copy straight from the decoder's planes, interleaving U and V on the way
+    if frame.format.name not in ("yuv420p", "nv12"):
+      frame = frame.reformat(format="nv12")
+    planes = [np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size) for plane in frame.planes]
+    y[:] = planes[0][:self.h, :self.w]
+    if frame.format.name == "nv12":
+      uv[:] = planes[1][:self.h // 2, :self.w]
+    else:
+      uv[:, 0::2] = planes[1][:self.h // 2, :self.w // 2]
+      uv[:, 1::2] = planes[2][:self.h // 2, :self.w // 2]
+
+  def _decode_gop(self, f_b: int, f_e: int) -> Iterator[np.ndarray]:
+    self._frames = None  # the session is taken over, get_frame has to start over
+    for frame in self._decode_gop_frames(f_b, f_e):
+      yield self._to_ndarray(frame)
+
+  def _decode_gop_frames(self, f_b: int, f_e: int) -> Iterator[av.VideoFrame]:
+    off_b, off_e = self.index[f_b, 1], self.index[f_e, 1]
+    with FileReader(self.fn) as f:
+      f.seek(off_b)
+      raw = f.read(off_e - off_b)
+
+    codec = self._codec_context()
+    codec.flush_buffers()  # a previous GOP may not have been decoded to the end
+    for i in range(f_b, f_e):
+      packet = raw[self.index[i, 1] - off_b:self.index[i + 1, 1] - off_b]
+      if i == f_b:
+        packet = self.prefix + packet
+      yield from codec.decode(av.Packet(packet))
+    yield from codec.decode(None)
 
   def get_gop_start(self, frame_idx: int):
     return self.iframes[np.searchsorted(self.iframes, frame_idx, side="right") - 1]
 
+  def decode_to(self, frame_idx: int) -> Iterator[tuple[int, av.VideoFrame]]:
+    """
+    Decodes the GOP containing frame_idx up to that frame, yielding every frame decoded on the way. Reading forward
+    within a GOP continues from the last frame, anything else starts decoding again from the GOP's I-frame.
+    """
+    f_b, f_e, _, _ = self._gop_bounds(frame_idx)
+    if self._frames is None or self._frames_gop != f_b or self._next_fidx > frame_idx:
+      self._frames = self._decode_gop_frames(f_b, f_e)
+      self._frames_gop = f_b
+      self._next_fidx = f_b
+
+    for frame in self._frames:
+      fidx = self._next_fidx
+      self._next_fidx += 1
+      yield fidx, frame
+      if fidx >= frame_idx:
+        return
+    self._frames = None
+    raise DataUnreadableError(f"{self.fn}: failed to decode frame {frame_idx}")
+
+  def get_frame(self, frame_idx: int) -> av.VideoFrame:
+    """Decodes the GOP containing frame_idx up to that frame, see decode_to"""
+    return deque(self.decode_to(frame_idx), maxlen=1)[0][1]
+
   def get_iterator(self, start_fidx: int = 0, end_fidx: int|None = None,
                    frame_skip: int = 1) -> Iterator[tuple[int, np.ndarray]]:
     end_fidx = end_fidx or self.frame_count
     fidx = start_fidx
     while fidx < end_fidx:
-      f_b, f_e, off_b, off_e = self._gop_bounds(fidx)
-      with FileReader(self.fn) as f:
-        f.seek(off_b)
-        raw = self.prefix + f.read(off_e - off_b)
+      f_b, f_e, _, _ = self._gop_bounds(fidx)
       # number of frames to discard inside this GOP before the wanted one
-      for i, frm in enumerate(decompress_video_data(raw, self.w, self.h, self.pix_fmt, hwaccel=self.hwaccel, loglevel=self.loglevel)):
+      for i, frm in enumerate(self._decode_gop(f_b, f_e)):
         fidx = f_b + i
         if fidx >= end_fidx:
           return
@@ -142,6 +263,75 @@ class FfmpegDecoder:
           yield fidx, frm
       fidx += 1
 
+  def get_parallel_iterator(self, start_fidx: int = 0, end_fidx: int|None = None, frame_skip: int = 1,
+                            num_workers: int|None = None) -> Iterator[tuple[int, np.ndarray]]:
+    """Like get_iterator, but decodes GOPs ahead in a process pool.
+
+    Frames are read-only views of shared memory, not copies. They are only valid until the
+    iterator moves on to the next GOP, copy them to keep them around."""
+    end_fidx = end_fidx or self.frame_count
+    gops = []
+    fidx = start_fidx
+    while fidx < end_fidx:
+      f_b, f_e, _, _ = self._gop_bounds(fidx)
+      gops.append((f_b, f_e))
+      fidx = f_e
+    if not gops:
+      return
+
+    num_workers = num_workers or os.cpu_count() or 1
+    frame_size = int(np.prod(self.frame_shape))
+    max_gop_size = max(f_e - f_b for f_b, f_e in gops)
+    buffers = [shared_memory.SharedMemory(create=True, size=max_gop_size * frame_size) for _ in range(min(len(gops), 2 * num_workers))]
+    index_data = {'index': self.index, 'global_prefix': self.prefix, 'probe': {'streams': [{'width': self.w, 'height': self.h}]}}
+
+    try:
+      with multiprocessing.Pool(num_workers, initializer=_init_gop_worker, initargs=(self.fn, index_data, self.pix_fmt, self.hwaccel)) as pool:
+        pending = deque(pool.apply_async(_decode_gop_to_shm, (buf.name, *gop)) for buf, gop in zip(buffers, gops, strict=False))
+        for i, (f_b, _) in enumerate(gops):
+          buf = buffers[i % len(buffers)]
+          frames = np.ndarray((pending.popleft().get(), *self.frame_shape), dtype=np.uint8, buffer=buf.buf)
+          frames.flags.writeable = False
+          for j in range(len(frames)):
+            fidx = f_b + j
+            if fidx >= end_fidx:
+              return
+            elif fidx >= start_fidx and (fidx - start_fidx) % frame_skip == 0:
+              yield fidx, frames[j]
+          del frames
+
+          # the buffer is free again, decode the next GOP into it
+          if i + len(buffers) < len(gops):
+            pending.append(pool.apply_async(_decode_gop_to_shm, (buf.name, *gops[i + len(buffers)])))
+    finally:
+      for buf in buffers:
+        try:
+          buf.close()
+        except BufferError:
+          pass  # frames are still referenced, the mapping goes away with them
+        buf.unlink()
+
+# decoder of each process in the get_parallel_iterator pool
+_gop_worker_decoder: FfmpegDecoder | None = None
+
+def _init_gop_worker(fn: str, index_data: dict, pix_fmt: str, hwaccel: str) -> None:
+  global _gop_worker_decoder
+  _gop_worker_decoder = FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt, hwaccel=hwaccel)
+
+def _decode_gop_to_shm(shm_name: str, f_b: int, f_e: int) -> int:
+  assert _gop_worker_decoder is not None
+  # pool workers share the resource tracker of the parent, which owns and unlinks the buffer
+  shm = shared_memory.SharedMemory(name=shm_name)
+  num_frames = 0
+  try:
+    frames = np.ndarray((f_e - f_b, *_gop_worker_decoder.frame_shape), dtype=np.uint8, buffer=shm.buf)
+    for num_frames, frm in enumerate(_gop_worker_decoder._decode_gop(f_b, f_e), start=1):
+      frames[num_frames - 1] = frm
+    del frames
+  finally:
+    shm.close()
+  return num_frames
+
 def FrameIterator(fn: str, index_data: dict|None=None, pix_fmt: str = "rgb24",
                   start_fidx:int=0, end_fidx=None, frame_skip:int=1, hwaccel="auto", loglevel="quiet") -> Iterator[np.ndarray]:
   dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data, hwaccel=hwaccel, loglevel=loglevel)
@@ -149,25 +339,53 @@ def FrameIterator(fn: str, index_data: dict|None=None, pix_fmt: str = "rgb24",
     yield frame
 
 class FrameReader:
+  """
+  Random access to the frames of an HEVC file, keeping the last cache_size frames decoded, and the decoded frames
+  of the last gop_cache_size GOPs by their I-frame index. See FfmpegDecoder for hwaccel
+  """
   def __init__(self, fn: str, index_data: dict|None = None, cache_size: int = 30,
-               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet"):
+               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet", gop_cache_size: int = 2, nv12_buffers: int = 2):
     self.decoder = FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt, hwaccel=hwaccel, loglevel=loglevel)
     self.iframes = self.decoder.iframes
     self._cache: LRUCache = LRUCache(cache_size)
+    self._gop_cache: LRUCache = LRUCache(gop_cache_size)
     self.w, self.h, self.frame_count, = self.decoder.w, self.decoder.h, self.decoder.frame_count
     self.pix_fmt = pix_fmt
 
-    self.it: Iterator[tuple[int, np.ndarray]] | None = None
-    self.fidx = -1
+    # stride-padded NV12 buffers handed out by get_nv12 in turn
+    self.nv12_buffers = nv12_buffers
+    self._nv12_pool: list[np.ndarray] = []
+    self._nv12_idx = 0
 
   def get(self, fidx:int):
     if fidx in self._cache:  # If frame is cached, return it
       return self._cache[fidx]
-    read_start = self.decoder.get_gop_start(fidx)
-    if not self.it or fidx < self.fidx or read_start != self.decoder.get_gop_start(self.fidx):  # If the frame is in a different GOP, reset the iterator
-      self.it = self.decoder.get_iterator(read_start)
-      self.fidx = -1
-    while self.fidx < fidx:
-      self.fidx, frame = next(self.it)
-      self._cache[self.fidx] = frame
-    return self._cache[fidx]
+    # frames decoded on the way are kept too, so seeking back within a cached GOP doesn't decode it again
+    gop_start = self.decoder.get_gop_start(fidx)
+    frames = self._gop_cache[gop_start] if gop_start in self._gop_cache else {}
+    if fidx not in frames:
+      for i, frame in self.decoder.decode_to(fidx):
+        if i not in frames:
+          frames[i] = self.decoder._to_ndarray(frame)
+        self._cache[i] = frames[i]
+    self._gop_cache[gop_start] = frames
+    self._cache[fidx] = frames[fidx]
+    return frames[fidx]
+
+  def get_nv12(self, fidx: int) -> np.ndarray:
+    """Returns the frame as a stride-padded NV12 buffer with the size and layout of get_nv12_info, ready for VisionIpcServer.send.
+
+    Buffers come from a pool of nv12_buffers that is reused, so the frame is only valid until as many more calls."""
+    if not self._nv12_pool:
+      self._nv12_pool = [np.zeros(get_nv12_info(self.w, self.h)[3], dtype=np.uint8) for _ in range(self.nv12_buffers)]
+    buf = self._nv12_pool[self._nv12_idx]
+    y, uv = nv12_planes(buf, self.w, self.h)
+    self._nv12_idx = (self._nv12_idx + 1) % len(self._nv12_pool)
+
+    if fidx in self._cache and self.pix_fmt == "nv12":
+      img = self._cache[fidx]
+      y[:] = img[:self.h * self.w].reshape(self.h, self.w)
+      uv[:] = img[self.h * self.w:].reshape(self.h // 2, self.w)
+    else:
+      self.decoder._copy_nv12(self.decoder.get_frame(fidx), y, uv)
+    return buf
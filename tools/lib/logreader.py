@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 import bz2
 from functools import partial
+import heapq
+import json
 import multiprocessing
 import capnp
 import enum
 import os
 import pathlib
+import struct
 import sys
 import tqdm
 import urllib.parse
@@ -17,15 +20,21 @@ from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
 from openpilot.common.swaglog import cloudlog
-from openpilot.tools.lib.filereader import FileReader
+from openpilot.common.utils import atomic_write
+from openpilot.tools.lib.filereader import FileReader, derived_cache_path, file_length
 from openpilot.tools.lib.file_sources import comma_api_source, internal_source, openpilotci_source, comma_car_segments_source, Source
 from openpilot.tools.lib.route import SegmentRange, FileName
 from openpilot.tools.lib.log_time_series import msgs_to_time_series
+from openpilot.tools.lib.url_file import prune_cache
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
+STREAM_CHUNK_SIZE = 1024 * 1024  # compressed bytes read per step in streaming mode
+SORT_WINDOW = 4096  # events held back to reorder by logMonoTime in streaming mode
+INDEX_VERSION = 1
+
 
 def save_log(dest, log_msgs, compress=True):
   dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
@@ -49,6 +58,144 @@ def decompress_stream(data: bytes):
   return decompressed_data
 
 
+def iter_decompressed(f, ext: str | None = None, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+  """Incrementally decompresses a bz2, zstd or raw log from a file-like object"""
+  chunk = f.read(chunk_size)
+  if ext == ".bz2" or chunk.startswith(b'BZh9'):
+    dec = bz2.BZ2Decompressor()
+    while chunk:
+      yield dec.decompress(chunk)
+      if dec.eof:
+        # bz2.decompress handles concatenated streams, so do the same here
+        chunk, dec = dec.unused_data, bz2.BZ2Decompressor()
+        if chunk:
+          continue
+      chunk = f.read(chunk_size)
+  elif ext == ".zst" or chunk.startswith(b'\x28\xB5\x2F\xFD'):
+    # like decompress_stream, only the first frame is read
+    dobj = zstd.ZstdDecompressor().decompressobj()
+    while chunk and not dobj.eof:
+      yield dobj.decompress(chunk)
+      chunk = f.read(chunk_size)
+  else:
+    while chunk:
+      yield chunk
+      chunk = f.read(chunk_size)
+
+
+def message_offsets(dat: bytes) -> Iterator[tuple[int, int]]:
+  """Yields the (start, end) byte range of each complete capnp message in dat"""
+  pos = 0
+  while pos + 4 <= len(dat):
+    num_segments = struct.unpack_from("<I", dat, pos)[0] + 1
+    header_len = 4 + 4 * num_segments
+    header_len += header_len % 8  # segment table is padded to a word boundary
+    if pos + header_len > len(dat):
+      break
+    msg_len = header_len + 8 * sum(struct.unpack_from(f"<{num_segments}I", dat, pos + 4))
+    if pos + msg_len > len(dat):
+      break
+    yield pos, pos + msg_len
+    pos += msg_len
+
+
+def complete_messages_length(dat: bytes) -> int:
+  """Returns the length of the longest prefix of dat made up of complete capnp messages"""
+  return max((end for _, end in message_offsets(dat)), default=0)
+
+
+def iter_events(chunks: Iterable[bytes]) -> Iterator[capnp._DynamicStructReader]:
+  """Parses events out of a stream of decompressed chunks, only holding on to the current chunk"""
+  buf = b""
+  for chunk in chunks:
+    buf = buf + chunk if buf else chunk
+    end = complete_messages_length(buf)
+    if end > 0:
+      yield from capnp_log.Event.read_multiple_bytes(buf[:end])
+      buf = buf[end:]
+  if buf:
+    raise capnp.KjException("truncated event at end of log")
+
+
+def sorted_window(events: Iterable, window: int = SORT_WINDOW) -> Iterator:
+  """Sorts events by logMonoTime, assuming no event is more than window events out of place"""
+  heap: list = []
+  for i, evt in enumerate(events):
+    heapq.heappush(heap, (evt.logMonoTime, i, evt))
+    if len(heap) > window:
+      yield heapq.heappop(heap)[2]
+  while heap:
+    yield heapq.heappop(heap)[2]
+
+
+def index_path(fn: str) -> str | None:
+  return derived_cache_path(fn, "_index")
+
+
+def summary_path(fn: str) -> str | None:
+  return derived_cache_path(fn, "_summary")
+
+
+def _load_cached(path: str | None, fn: str, length: int | None) -> dict | None:
+  if path is None or not os.path.exists(path):
+    return None
+
+  try:
+    with open(path, "rb") as f:
+      cached = json.loads(zstd.decompress(f.read()))
+  except (OSError, ValueError, zstd.ZstdError):
+    return None
+
+  if length is None:
+    length = file_length(fn)
+  if cached.get("version") != INDEX_VERSION or cached.get("length") != length:
+    return None
+  return cached
+
+
+def _save_cached(path: str | None, data: dict) -> None:
+  if path is None:
+    return
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  dat = zstd.compress(json.dumps(data).encode(), 3)
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    f.write(dat)
+  prune_cache({os.path.basename(path): len(dat)})
+
+
+def load_index(fn: str, length: int | None = None) -> dict | None:
+  """Returns the cached message type index of a log file, or None if it's missing or stale"""
+  return _load_cached(index_path(fn), fn, length)
+
+
+def save_index(fn: str, index: dict) -> None:
+  _save_cached(index_path(fn), index)
+
+
+def load_summary(fn: str, length: int | None = None) -> dict | None:
+  """Returns the cached message types of a log file with their count and time range, or None if it's missing or stale"""
+  return _load_cached(summary_path(fn), fn, length)
+
+
+def save_summary(fn: str, summary: dict) -> None:
+  _save_cached(summary_path(fn), summary)
+
+
+def index_summary(index: dict) -> dict:
+  """The index without the offsets of every event, enough to tell which segments to read"""
+  types = {typ: {"count": t["count"], "min": t["min"], "max": t["max"]} for typ, t in index["types"].items()}
+  return {"version": index["version"], "length": index["length"], "types": types}
+
+
+def summary_may_contain(summary: dict | None, msg_type: str, start_time: int | None = None, end_time: int | None = None) -> bool:
+  if summary is None:
+    return True
+  t = summary["types"].get(msg_type)
+  if t is None:
+    return False
+  return (start_time is None or t["max"] >= start_time) and (end_time is None or t["min"] < end_time)
+
+
 class CachedEventReader:
   __slots__ = ('_evt', '_enum')
 
@@ -87,9 +234,15 @@ class CachedEventReader:
 
 
 class _LogFileReader:
-  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None, streaming=False):
     self.data_version = None
+    self.index: dict | None = None
+    self._fn = fn
     self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._streaming = streaming and not dat
+    self._length = -1
+    self._ents: list[CachedEventReader] | None = None
 
     ext = None
     if not dat:
@@ -97,30 +250,85 @@ class _LogFileReader:
       if ext not in ('', '.bz2', '.zst'):
         # old rlogs weren't compressed
         raise ValueError(f"unknown extension {ext}")
+      self._ext = ext
+
+      # events are read on every iteration in streaming mode
+      if self._streaming:
+        return
 
       with FileReader(fn) as f:
         dat = f.read()
+      self._length = len(dat)
+      self.index = load_index(fn, self._length)
+      # indexes cached before summaries existed get one, so later reads can skip this segment without loading it
+      if self.index is not None and (path := summary_path(fn)) is not None and not os.path.exists(path):
+        save_summary(fn, index_summary(self.index))
 
     if ext == ".bz2" or dat.startswith(b'BZh9'):
       dat = bz2.decompress(dat)
     elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
       # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
       dat = decompress_stream(dat)
+    self._dat: bytes | None = dat
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+    # with a valid index, events are only parsed once needed
+    if self.index is None:
+      self._parse()
+
+  def _parse(self) -> None:
+    assert self._dat is not None
+    build_index = self._length != -1 and index_path(self._fn) is not None
+    types: dict[str, dict[str, list[int]]] = {}
 
     self._ents = []
     try:
-      for e in ents:
-        self._ents.append(CachedEventReader(e))
+      for e, (start, end) in zip(capnp_log.Event.read_multiple_bytes(self._dat), message_offsets(self._dat), strict=False):
+        ent = CachedEventReader(e)
+        self._ents.append(ent)
+        if build_index:
+          try:
+            t = types.setdefault(ent.which(), {"offsets": [], "sizes": [], "times": []})
+          except capnp.KjException:
+            continue
+          t["offsets"].append(start)
+          t["sizes"].append(end - start)
+          t["times"].append(ent.logMonoTime)
     except capnp.KjException:
       warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
-    if sort_by_time:
+    if self._sort_by_time:
       self._ents.sort(key=lambda x: x.logMonoTime)
 
+    if build_index and self.index is None:
+      for t in types.values():
+        t.update(count=len(t["times"]), min=min(t["times"]), max=max(t["times"]))
+      self.index = {"version": INDEX_VERSION, "length": self._length, "types": types}
+      save_index(self._fn, self.index)
+      save_summary(self._fn, index_summary(self.index))
+
+    # parsed events keep their own reference to the data
+    self._dat = None
+
+  def _stream(self) -> Iterator[CachedEventReader]:
+    with FileReader(self._fn) as f:
+      try:
+        for e in iter_events(iter_decompressed(f, self._ext)):
+          yield CachedEventReader(e)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    ents: Iterable[CachedEventReader]
+    if self._streaming:
+      ents = self._stream()
+      if self._sort_by_time:
+        ents = sorted_window(ents)
+    else:
+      if self._ents is None:
+        self._parse()
+      ents = self._ents
+
+    for ent in ents:
       if self._only_union_types:
         try:
           ent.which()
@@ -130,6 +338,28 @@ class _LogFileReader:
       else:
         yield ent
 
+  def filter(self, msg_type: str, start_time: int | None = None, end_time: int | None = None) -> Iterator[CachedEventReader]:
+    """Yields events of msg_type with start_time <= logMonoTime < end_time, only parsing those events if indexed"""
+    def in_window(t: int) -> bool:
+      return (start_time is None or t >= start_time) and (end_time is None or t < end_time)
+
+    if self._streaming or self._ents is not None:
+      yield from (ent for ent in self if ent.which() == msg_type and in_window(ent.logMonoTime))
+      return
+
+    assert self.index is not None and self._dat is not None
+    t = self.index["types"].get(msg_type)
+    if t is None:
+      return
+
+    matches = [(time, start, size) for start, size, time in zip(t["offsets"], t["sizes"], t["times"], strict=True) if in_window(time)]
+    if self._sort_by_time:
+      matches.sort(key=lambda x: x[0])
+    for _, start, size in matches:
+      with capnp_log.Event.from_bytes(self._dat[start:start + size]) as evt:
+        ent = CachedEventReader(evt, msg_type)
+      yield ent
+
 
 class ReadMode(enum.StrEnum):
   RLOG = "r"  # only read rlogs
@@ -244,7 +474,12 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               sources: list[Source] | None = None, sort_by_time=False, only_union_types=False):
+               sources: list[Source] | None = None, sort_by_time=False, only_union_types=False, streaming=False):
+    """
+    streaming: decompress and parse segments incrementally on each iteration instead of loading them into memory.
+      Memory is bounded per segment and filter()/first() stop reading early. With sort_by_time, events are
+      reordered within a window of SORT_WINDOW events.
+    """
     if sources is None:
       sources = [internal_source, comma_api_source, openpilotci_source, comma_car_segments_source]
 
@@ -256,13 +491,16 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.streaming = streaming
 
     self.__lrs: dict[int, _LogFileReader] = {}
+    self.__summaries: dict[int, dict | None] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                                     streaming=self.streaming)
     return self.__lrs[i]
 
   def __iter__(self):
@@ -281,6 +519,7 @@ class LogReader:
       return ret
 
   def reset(self):
+    self.__summaries.clear()
     self.logreader_identifiers = []
     for identifier in self.identifier:
       self.logreader_identifiers.extend(self._parse_identifier(identifier))
@@ -289,8 +528,23 @@ class LogReader:
   def from_bytes(dat):
     return _LogFileReader("", dat=dat)
 
-  def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+  def _summary(self, i: int) -> dict | None:
+    # only use summaries that are already cached, building one requires downloading the segment anyway.
+    # they're kept for the lifetime of the reader, so repeated filter() calls don't check the file length again
+    summary = self.__summaries.get(i)
+    if summary is None and i in self.__lrs and self.__lrs[i].index is not None:
+      summary = self.__summaries[i] = index_summary(self.__lrs[i].index)
+    elif i not in self.__summaries:
+      summary = self.__summaries[i] = load_summary(self.logreader_identifiers[i])
+    return summary
+
+  def _may_contain(self, i: int, msg_type: str, start_time: int | None, end_time: int | None) -> bool:
+    return summary_may_contain(self._summary(i), msg_type, start_time, end_time)
+
+  def filter(self, msg_type: str, start_time: int | None = None, end_time: int | None = None):
+    for i in range(len(self.logreader_identifiers)):
+      if self._may_contain(i, msg_type, start_time, end_time):
+        yield from (getattr(m, msg_type) for m in self._get_lr(i).filter(msg_type, start_time, end_time))
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
@@ -3,6 +3,8 @@ import os
 import shutil
 import socket
 import tempfile
+import time
+from concurrent.futures import wait
 import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
@@ -30,6 +32,33 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeTestRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = bytes(i % 251 for i in range(3 * url_file_module.CHUNK_SIZE + 1234))
+
+  def do_GET(self):
+    start, end = 0, len(self.DATA) - 1
+    if "Range" in self.headers:
+      start, end = (int(x) for x in self.headers["Range"].removeprefix("bytes=").split("-"))
+    data = self.DATA[start:end + 1]
+    self.send_response(206 if "Range" in self.headers else 200)
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
+class SlowReadaheadRequestHandler(RangeTestRequestHandler):
+  def do_GET(self):
+    # everything past the first chunk, which is only fetched by readahead here, is slow
+    if "Range" in self.headers and int(self.headers["Range"].removeprefix("bytes=").split("-")[0]) >= url_file_module.CHUNK_SIZE:
+      time.sleep(0.3)
+    super().do_GET()
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
@@ -135,12 +164,68 @@ class TestFileDownload:
     assert length == 4
 
 
+  def test_parallel_chunks(self, monkeypatch):
+    os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+    data = RangeTestRequestHandler.DATA
+    with tempfile.TemporaryDirectory() as tmpdir, http_server_context(handler=RangeTestRequestHandler) as (host, port):
+      monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
+      url = f"http://{host}:{port}/test.bin"
+
+      # whole file in one read, all chunks fetched together
+      assert URLFile(url).read() == data
+      entries = url_file_module.cache_index().execute("SELECT name, size FROM entries").fetchall()
+      assert sorted(size for name, size in entries if not name.endswith("_length")) == [1234] + [url_file_module.CHUNK_SIZE] * 3
+
+      # sequential reads across chunk boundaries hit the cache and readahead
+      shutil.rmtree(tmpdir)
+      os.mkdir(tmpdir)
+      f = URLFile(url)
+      f.seek(100)
+      pos = 100
+      while pos < len(data):
+        assert f.read(ll=300_000) == data[pos:pos + 300_000]
+        pos += 300_000
+      assert f.read(ll=10) == b""
+
+  def test_readahead_indexed(self, monkeypatch):
+    # reading stops before readahead is done, the chunks it still downloads have to end up in the index
+    os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+    with tempfile.TemporaryDirectory() as tmpdir, http_server_context(handler=SlowReadaheadRequestHandler) as (host, port):
+      monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
+      def cached():
+        files = {name for name in os.listdir(tmpdir) if not name.startswith("cache.db")}
+        entries = {name for name, in url_file_module.cache_index().execute("SELECT name FROM entries")}
+        return files, entries
+
+      f = URLFile(f"http://{host}:{port}/test.bin")
+      f.read(ll=300_000)
+      f.read(ll=300_000)
+      readahead = list(f._readahead.values())
+      assert len(readahead) == 3 and not any(future.done() for future in readahead)
+      wait(readahead)
+      files, entries = cached()
+      assert len(files) == 5  # the length and all 4 chunks
+      assert files == entries
+
+      # leaving the context drops or finishes readahead, whatever is on disk is indexed
+      shutil.rmtree(tmpdir)
+      os.mkdir(tmpdir)
+      url_file_module._reset_cache_index()
+      with URLFile(f"http://{host}:{port}/test.bin") as f:
+        f.read(ll=300_000)
+        f.read(ll=300_000)
+        readahead = list(f._readahead.values())
+      assert not f._readahead and all(future.done() for future in readahead)
+      files, entries = cached()
+      assert files == entries
+
+
 class TestCache:
   def test_prune_cache(self, monkeypatch):
     with tempfile.TemporaryDirectory() as tmpdir:
       monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
 
-      # setup test files and manifest
+      # setup test files and a manifest from an older version of the cache
       manifest_lines = []
       for i in range(3):
         fname = f"hash_{i}"
@@ -150,18 +235,26 @@ class TestCache:
       with open(tmpdir + "/manifest.txt", "w") as f:
         f.write('\n'.join(manifest_lines))
 
-      # under limit, shouldn't prune
-      assert len(os.listdir(tmpdir)) == 4
+      # under limit, shouldn't prune, manifest gets imported
       prune_cache()
-      assert len(os.listdir(tmpdir)) == 4
+      assert not os.path.exists(tmpdir + "/manifest.txt")
+      assert all(os.path.exists(tmpdir + f"/hash_{i}") for i in range(3))
+
+      # sizes are tracked per file, the small files are well under a single chunk
+      for i in range(3, 6):
+        with open(tmpdir + f"/hash_{i}", "wb") as f:
+          f.truncate(url_file_module.CHUNK_SIZE // 2)
+      prune_cache({f"hash_{i}": url_file_module.CHUNK_SIZE // 2 for i in range(3, 6)})
+      assert all(os.path.exists(tmpdir + f"/hash_{i}") for i in range(6))
+
+      # accessing a file makes it the most recently used
+      prune_cache({"hash_0": 1000})
 
       # set a tiny cache limit to force eviction (1.5 chunks worth)
       monkeypatch.setattr(url_file_module, 'CACHE_SIZE', url_file_module.CHUNK_SIZE + url_file_module.CHUNK_SIZE // 2)
 
       # prune_cache should evict oldest files to get under limit
       prune_cache()
-      remaining = os.listdir(tmpdir)
-      # should have evicted at least one file + manifest
-      assert len(remaining) < 4
-      # newest file should remain
-      assert manifest_lines[2].split()[0] in remaining
+      remaining = [f for f in os.listdir(tmpdir) if f.startswith("hash_")]
+      assert sorted(remaining) == ["hash_0", "hash_4", "hash_5"]
+      assert url_file_module.cache_index().execute("SELECT size FROM total").fetchone()[0] == 1000 + url_file_module.CHUNK_SIZE
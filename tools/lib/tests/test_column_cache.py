@@ -0,0 +1,98 @@
+import os
+import tempfile
+import numpy as np
+
+import openpilot.tools.lib.column_cache as column_cache
+from openpilot.tools.lib.column_cache import load_columns, prune_columns, save_columns, schema_hash, segment_cache_dir, touch_segment
+
+
+def write_segment(cache_dir: str, name: str, size: int, mtime: float) -> str:
+  path = os.path.join(cache_dir, "columns", name)
+  os.makedirs(path)
+  with open(os.path.join(path, "carState.cols"), "wb") as f:
+    f.write(bytes(size))
+  with open(os.path.join(path, "meta.json"), "w") as f:
+    f.write("{}")
+  os.utime(os.path.join(path, "meta.json"), (mtime, mtime))
+  return path
+
+
+class TestColumnCache:
+  def test_roundtrip(self):
+    columns = {
+      't': np.linspace(0, 60, 1200),
+      'a/b': np.arange(1200, dtype=np.int16),
+      'flags': np.zeros(3, dtype=np.bool_),
+      'matrix': np.arange(12, dtype=np.float32).reshape(4, 3),
+      'empty': np.array([], dtype=np.uint64),
+      'text': np.array(['a', 'bc', None], dtype=object),
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, "test.cols")
+      save_columns(path, columns)
+      loaded = load_columns(path)
+
+      assert loaded.keys() == columns.keys()
+      for name, arr in columns.items():
+        assert loaded[name].dtype == arr.dtype
+        assert loaded[name].shape == arr.shape
+        assert np.array_equal(loaded[name], arr)
+
+      # numeric columns are read-only views of the file
+      assert not loaded['t'].flags.writeable
+
+  def test_cache_key(self, monkeypatch):
+    monkeypatch.setattr(column_cache, 'file_length', lambda fn: 1000)
+    assert segment_cache_dir("https://a.com/rlog.zst?sig=1") == segment_cache_dir("https://a.com/rlog.zst?sig=2")
+    assert segment_cache_dir("https://a.com/0/rlog.zst") != segment_cache_dir("https://a.com/1/rlog.zst")
+    key = segment_cache_dir("https://a.com/0/rlog.zst")
+    monkeypatch.setattr(column_cache, 'file_length', lambda fn: 2000)
+    assert segment_cache_dir("https://a.com/0/rlog.zst") != key
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, "rlog.zst")
+      with open(fn, "wb") as f:
+        f.write(b"a" * 10)
+      os.utime(fn, ns=(0, 1_000_000_000))
+      key = segment_cache_dir(fn)
+      assert segment_cache_dir(fn) == key
+
+      # a log replaced by one of the same size is told apart by its mtime
+      with open(fn, "wb") as f:
+        f.write(b"b" * 10)
+      os.utime(fn, ns=(0, 2_000_000_000))
+      assert segment_cache_dir(fn) != key
+      key = segment_cache_dir(fn)
+      with open(fn, "ab") as f:
+        f.write(b"b")
+      os.utime(fn, ns=(0, 2_000_000_000))
+      assert segment_cache_dir(fn) != key
+
+  def test_migration_version(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      migration = os.path.join(tmpdir, "migration.py")
+      monkeypatch.setattr(column_cache, 'MIGRATION_PATH', migration)
+      hashes = []
+      for source in ("def migrate_all(lr): pass", "def migrate_all(lr): return lr"):
+        with open(migration, "w") as f:
+          f.write(source)
+        schema_hash.cache_clear()
+        hashes.append(schema_hash())
+      schema_hash.cache_clear()
+      assert hashes[0] != hashes[1]
+
+  def test_prune(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      prune_columns(tmpdir, 0)
+      paths = [write_segment(tmpdir, f"segment{i}", 1000, 1000 + i) for i in range(4)]
+      # an entry still being written only has its directory's mtime
+      os.makedirs(os.path.join(tmpdir, "columns", "incomplete"))
+
+      touch_segment(paths[0])
+      prune_columns(tmpdir, 2500)
+      assert sorted(os.listdir(os.path.join(tmpdir, "columns"))) == ["incomplete", "segment0", "segment3"]
+
+      prune_columns(tmpdir, 10_000)
+      assert len(os.listdir(os.path.join(tmpdir, "columns"))) == 3
+      prune_columns(tmpdir, 0)
+      assert os.listdir(os.path.join(tmpdir, "columns")) == []
@@ -0,0 +1,119 @@
+import fractions
+import random
+
+import av
+import numpy as np
+import pytest
+
+from openpilot.system.camerad.cameras.nv12_info import get_nv12_info
+from openpilot.tools.lib.framereader import FfmpegDecoder, FrameReader
+from openpilot.tools.lib.vidindex import hevc_index
+
+W, H = 160, 96
+NUM_FRAMES = 60
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+  fn = str(tmp_path_factory.mktemp("video") / "fcamera.hevc")
+  codec = av.CodecContext.create("libx265", "w")
+  codec.width, codec.height, codec.pix_fmt = W, H, "yuv420p"
+  codec.time_base = fractions.Fraction(1, 20)
+  codec.options = {"x265-params": "keyint=10:min-keyint=10:bframes=0:scenecut=0:repeat-headers=1:log-level=error"}
+  with open(fn, "wb") as f:
+    for i in range(NUM_FRAMES):
+      img = np.zeros((H, W, 3), dtype=np.uint8)
+      img[..., 0] = i * 4
+      img[i % H, :, 1] = 255
+      frame = av.VideoFrame.from_ndarray(img, format="rgb24").reformat(format="yuv420p")
+      frame.pts = i
+      for packet in codec.encode(frame):
+        f.write(bytes(packet))
+    for packet in codec.encode(None):
+      f.write(bytes(packet))
+
+  frame_types, dat_len, prefix = hevc_index(fn)
+  index_data = {
+    'index': np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32),
+    'global_prefix': prefix,
+    'probe': {'streams': [{'width': W, 'height': H}]},
+  }
+  return fn, index_data
+
+
+def count_decoded(fr: FrameReader, monkeypatch) -> list[int]:
+  """Indexes of the frames fr decodes from now on"""
+  decoded = []
+  decode_gop_frames = fr.decoder._decode_gop_frames
+  def counting_decode(f_b, f_e):
+    for i, frame in enumerate(decode_gop_frames(f_b, f_e)):
+      decoded.append(f_b + i)
+      yield frame
+  monkeypatch.setattr(fr.decoder, "_decode_gop_frames", counting_decode)
+  return decoded
+
+
+@pytest.mark.parametrize("pix_fmt", ["rgb24", "nv12"])
+class TestFrameReader:
+  def test_random_access(self, video, pix_fmt):
+    fn, index_data = video
+    frames = [frm.copy() for _, frm in FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt).get_iterator()]
+    assert len(frames) == NUM_FRAMES
+
+    fr = FrameReader(fn, index_data=index_data, pix_fmt=pix_fmt, cache_size=5)
+    order = list(range(NUM_FRAMES))
+    random.Random(0).shuffle(order)
+    for fidx in order + order[::-1]:
+      assert np.array_equal(fr.get(fidx), frames[fidx])
+
+  def test_parallel_iterator(self, video, pix_fmt):
+    fn, index_data = video
+    decoder = FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt)
+    expected = [(fidx, frm.copy()) for fidx, frm in decoder.get_iterator(7, 43, frame_skip=3)]
+    frames = [(fidx, frm.copy()) for fidx, frm in decoder.get_parallel_iterator(7, 43, frame_skip=3, num_workers=2)]
+    assert [fidx for fidx, _ in frames] == list(range(7, 43, 3))
+    assert all(np.array_equal(a, b) for (_, a), (_, b) in zip(expected, frames, strict=True))
+
+  def test_get_nv12(self, video, pix_fmt):
+    fn, index_data = video
+    nv12 = FrameReader(fn, index_data=index_data, pix_fmt="nv12", cache_size=NUM_FRAMES)
+    fr = FrameReader(fn, index_data=index_data, pix_fmt=pix_fmt)
+    stride, y_height, _, yuv_size = get_nv12_info(W, H)
+    for fidx in [0, 13, 59, 12]:
+      img = nv12.get(fidx)
+      expected = np.zeros(yuv_size, dtype=np.uint8)
+      expected[:stride * H].reshape(H, stride)[:, :W] = img[:H * W].reshape(H, W)
+      expected[stride * y_height:stride * (y_height + H // 2)].reshape(H // 2, stride)[:, :W] = img[H * W:].reshape(H // 2, W)
+      # decoded straight from the GOP and from the cached frame
+      assert np.array_equal(fr.get_nv12(fidx), expected)
+      assert np.array_equal(nv12.get_nv12(fidx), expected)
+
+  def test_decodes_up_to_frame(self, video, pix_fmt, monkeypatch):
+    fn, index_data = video
+    frames = [frm.copy() for _, frm in FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt).get_iterator()]
+    fr = FrameReader(fn, index_data=index_data, pix_fmt=pix_fmt, cache_size=1, gop_cache_size=0)
+    decoded = count_decoded(fr, monkeypatch)
+
+    # reading forward within a GOP continues where the last frame left off
+    for fidx in [12, 13, 15]:
+      assert np.array_equal(fr.get(fidx), frames[fidx])
+    assert decoded == list(range(10, 16))
+
+    # going back restarts from the I-frame, and so does using the session for anything else in between
+    assert np.array_equal(fr.get(11), frames[11])
+    assert decoded[6:] == [10, 11]
+    next(fr.decoder.get_iterator(40))
+    for fidx in [12, 30, 59]:
+      assert np.array_equal(fr.get(fidx), frames[fidx])
+
+  @pytest.mark.parametrize("cache_size", [1, 30])
+  def test_reverse_scan(self, video, pix_fmt, cache_size, monkeypatch):
+    fn, index_data = video
+    frames = [frm.copy() for _, frm in FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt).get_iterator()]
+    fr = FrameReader(fn, index_data=index_data, pix_fmt=pix_fmt, cache_size=cache_size)
+    decoded = count_decoded(fr, monkeypatch)
+
+    # a GOP is decoded once when reading it backwards, and stays cached while reading another one
+    for fidx in [19, 18, 17, 14, 10, 35, 31, 16, 11]:
+      assert np.array_equal(fr.get(fidx), frames[fidx])
+    assert decoded == list(range(10, 20)) + list(range(30, 36))
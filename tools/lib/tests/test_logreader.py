@@ -1,3 +1,4 @@
+import bz2
 import capnp
 import contextlib
 import io
@@ -6,12 +7,15 @@ import tempfile
 import os
 import pytest
 import requests
+import zstandard as zstd
 
 from openpilot.common.parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, parse_indirect, ReadMode
+from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, parse_indirect, ReadMode, index_path, load_index, \
+                                           load_summary, summary_path
 from openpilot.tools.lib.file_sources import comma_api_source, InternalUnavailableException
+from openpilot.tools.lib.filereader import file_length
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -261,3 +265,60 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  def test_streaming(self, ext):
+    compress = {"": lambda d: d, ".bz2": bz2.compress, ".zst": lambda d: zstd.compress(d, 10)}[ext]
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, f"rlog{ext}")
+      num_msgs = 1000
+      with open(fn, "wb") as f:
+        f.write(compress(b"".join(capnp_log.Event.new_message(logMonoTime=(i * 7919) % num_msgs, valid=True).to_bytes() for i in range(num_msgs))))
+
+      for sort_by_time in (False, True):
+        msgs = [m.logMonoTime for m in LogReader(fn, sort_by_time=sort_by_time)]
+        streamed = [m.logMonoTime for m in LogReader(fn, sort_by_time=sort_by_time, streaming=True)]
+        assert len(msgs) == num_msgs
+        assert msgs == streamed
+
+  def test_index(self, mocker):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      mocker.patch.dict(os.environ, {"COMMA_CACHE": tmpdir})
+      os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+      fn = os.path.join(tmpdir, "rlog.zst")
+      num_msgs = 1000
+      with open(fn, "wb") as f:
+        msgs = [capnp_log.Event.new_message(logMonoTime=i, **({"clocks": {"wallTimeNanos": i}} if i % 100 == 0 else {"deviceState": {}}))
+                for i in range(num_msgs)]
+        f.write(zstd.compress(b"".join(m.to_bytes() for m in msgs), 10))
+
+      # first read builds the index
+      assert len(list(LogReader(fn))) == num_msgs
+      assert os.path.exists(index_path(fn))
+
+      msgs = [m.logMonoTime for m in LogReader(fn) if m.which() == "clocks"]
+      assert [m.wallTimeNanos for m in LogReader(fn).filter("clocks")] == msgs
+      assert len(list(LogReader(fn).filter("clocks", start_time=250, end_time=500))) == 2
+
+      # indexes cached without a summary get one when they're loaded
+      os.remove(summary_path(fn))
+      assert len(list(LogReader(fn).filter("clocks"))) == 10
+
+      # the summary only has the types and their time range, it's loaded once per reader
+      assert load_summary(fn)["types"]["clocks"] == {"count": 10, "min": 0, "max": 900}
+      lr = LogReader(fn)
+      length_mock = mocker.patch("openpilot.tools.lib.logreader.file_length", wraps=file_length)
+      lfr_mock = mocker.patch("openpilot.tools.lib.logreader._LogFileReader")
+      for _ in range(3):
+        assert list(lr.filter("carParams")) == []
+        assert list(lr.filter("clocks", start_time=num_msgs)) == []
+      assert length_mock.call_count == 1
+
+      # segments without the type are skipped without being read
+      assert list(LogReader(fn).filter("carParams")) == []
+      assert lfr_mock.call_count == 0
+
+      # index is invalidated when the file changes
+      with open(fn, "ab") as f:
+        f.write(b"\x00" * 8)
+      assert load_index(fn) is None
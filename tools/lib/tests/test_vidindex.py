@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+from openpilot.tools.lib.framereader import load_video_index, save_video_index
+from openpilot.tools.lib.vidindex import HevcIndexer, HevcNalUnitType, VideoFileInvalid, hevc_index
+
+
+def nal_unit(nal_unit_type: HevcNalUnitType, rbsp_bits: str, payload: bytes = b"") -> bytes:
+  rbsp_bits += "1" + "0" * (-(len(rbsp_bits) + 1) % 8)  # rbsp stop bit and alignment
+  rbsp = int(rbsp_bits, 2).to_bytes(len(rbsp_bits) // 8, "big")
+  return b"\x00\x00\x00\x01" + bytes([nal_unit_type << 1, 1]) + rbsp + payload
+
+
+def make_hevc(num_frames: int, gop_size: int = 20) -> tuple[bytes, list[tuple[int, int]], bytes]:
+  rnd = random.Random(0)
+  dat, frame_types, prefix = b"", [], b""
+  for i in range(num_frames):
+    if i % gop_size == 0:
+      parameter_sets = b"".join(nal_unit(t, "", b"\xaa" * 16) for t in (HevcNalUnitType.VPS_NUT, HevcNalUnitType.SPS_NUT, HevcNalUnitType.PPS_NUT))
+      # NAL units start after the first zero byte of the 4 byte start code and run up to the next one
+      prefix += parameter_sets[1:] + b"\x00"
+      dat += parameter_sets
+      # first_slice_segment_in_pic_flag, no_output_of_prior_pics_flag, pps id 0, slice_type I
+      frame = nal_unit(HevcNalUnitType.IDR_W_RADL, "10" + "1" + "011", bytes(rnd.randrange(2, 256) for _ in range(1000)))
+      slice_type = 2
+    else:
+      slice_type = rnd.choice([0, 1])
+      frame = nal_unit(HevcNalUnitType.TRAIL_R, "1" + "1" + ("1" if slice_type == 0 else "010"), bytes(rnd.randrange(2, 256) for _ in range(500)))
+      # second slice of the same picture
+      frame += nal_unit(HevcNalUnitType.TRAIL_R, "0", b"\x55" * 8)
+    frame_types.append((slice_type, len(dat) + 1))
+    dat += frame + nal_unit(HevcNalUnitType.PREFIX_SEI_NUT, "", b"\x11" * 4)
+  return dat, frame_types, prefix
+
+
+class TestVidIndex:
+  def test_hevc_index(self, tmp_path):
+    dat, frame_types, prefix = make_hevc(100)
+    fn = str(tmp_path / "fcamera.hevc")
+    with open(fn, "wb") as f:
+      f.write(dat)
+    assert hevc_index(fn) == (frame_types, len(dat), prefix)
+
+  @pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 1000, 4096])
+  def test_streaming(self, chunk_size):
+    dat, frame_types, prefix = make_hevc(50)
+    indexer = HevcIndexer()
+    for i in range(0, len(dat), chunk_size):
+      indexer.feed(dat[i:i + chunk_size])
+    assert indexer.finish() == (frame_types, len(dat), prefix)
+
+  @pytest.mark.parametrize("dat", [b"\x01\x00\x00\x01\x40\x01", b"\x00\x00", b"\x00\x00\x00\x02\x40\x01"])
+  def test_invalid(self, dat):
+    indexer = HevcIndexer()
+    with pytest.raises(VideoFileInvalid):
+      indexer.feed(dat)
+      indexer.finish()
+
+  def test_index_cache(self, tmp_path, mocker):
+    mocker.patch.dict("os.environ", {"COMMA_CACHE": str(tmp_path / "cache")})
+    dat, frame_types, prefix = make_hevc(40)
+    fn = str(tmp_path / "fcamera.hevc")
+    with open(fn, "wb") as f:
+      f.write(dat)
+
+    assert load_video_index(fn) is None
+    index_data = {
+      'index': np.array(frame_types + [(0xFFFFFFFF, len(dat))], dtype=np.uint32),
+      'global_prefix': prefix,
+      'probe': {'streams': [{'width': 1928, 'height': 1208}]},
+    }
+    save_video_index(fn, index_data)
+    cached = load_video_index(fn)
+    assert np.array_equal(cached['index'], index_data['index'])
+    assert cached['global_prefix'] == prefix
+    assert cached['probe'] == index_data['probe']
+
+    # stale once the file changes length
+    with open(fn, "ab") as f:
+      f.write(b"\x00\x00\x01")
+    assert load_video_index(fn) is None
@@ -2,7 +2,12 @@ import logging
 import os
 import re
 import socket
+import sqlite3
+import threading
 import time
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from hashlib import md5
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -16,6 +21,9 @@ from urllib3.exceptions import MaxRetryError
 K = 1000
 CHUNK_SIZE = 1000 * K
 CACHE_SIZE = 10 * 1024 * 1024 * 1024  # total cache size in GB
+MAX_PARALLEL_CHUNKS = 8  # concurrent chunk downloads across all URLFiles
+READAHEAD_CHUNKS = 4  # chunks fetched ahead of sequential reads
+TOUCH_INTERVAL = 60  # seconds between access time updates of a cached file
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -24,31 +32,99 @@ def hash_url(link: str) -> str:
   return md5((link.split("?")[0]).encode('utf-8')).hexdigest()
 
 
-def prune_cache(new_entry: str | None = None) -> None:
-  """Evicts oldest cache files (LRU) until cache is under the size limit."""
-  # we use a manifest to avoid tons of os.stat syscalls (slow)
-  manifest = {}
-  manifest_path = Paths.download_cache_root() + "manifest.txt"
-  if os.path.exists(manifest_path):
-    with open(manifest_path) as f:
-      manifest = {parts[0]: int(parts[1]) for line in f if (parts := line.strip().split()) and len(parts) == 2}
-
-  if new_entry:
-    manifest[new_entry] = int(time.time())  # noqa: TID251
-
-  # evict the least recently used files until under limit
-  sorted_items = sorted(manifest.items(), key=lambda x: x[1])
-  while len(manifest) * CHUNK_SIZE > CACHE_SIZE and sorted_items:
-    key, _ = sorted_items.pop(0)
+CACHE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, size INTEGER NOT NULL, atime REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+CREATE TABLE IF NOT EXISTS total (size INTEGER NOT NULL);
+INSERT INTO total SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM total);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN UPDATE total SET size = size + new.size; END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN UPDATE total SET size = size - old.size + new.size; END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN UPDATE total SET size = size - old.size; END;
+"""
+
+# one connection per thread, sqlite connections can't be shared across threads or forks
+_cache_index_local = threading.local()
+_last_touch: dict[str, float] = {}
+
+
+def _reset_cache_index() -> None:
+  global _cache_index_local
+  _cache_index_local = threading.local()
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+  # take the write lock up front, so concurrent processes queue instead of failing to upgrade their lock
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    yield
+  except BaseException:
+    conn.execute("ROLLBACK")
+    raise
+  conn.execute("COMMIT")
+
+
+def _migrate_manifest(conn: sqlite3.Connection, root: str) -> None:
+  """Imports the manifest.txt used by older versions, so existing cache files stay accounted for"""
+  manifest_path = os.path.join(root, "manifest.txt")
+  if not os.path.exists(manifest_path):
+    return
+
+  with open(manifest_path) as f:
+    manifest = [(parts[0], int(parts[1])) for line in f if (parts := line.strip().split()) and len(parts) == 2]
+  entries = []
+  for name, atime in manifest:
     try:
-      os.remove(Paths.download_cache_root() + key)
+      entries.append((name, os.path.getsize(os.path.join(root, name)), atime))
     except OSError:
       pass
-    manifest.pop(key, None)
+  conn.executemany("INSERT OR IGNORE INTO entries (name, size, atime) VALUES (?, ?, ?)", entries)
+  os.remove(manifest_path)
+
+
+def cache_index() -> sqlite3.Connection:
+  """Index of the files in the download cache with their size and last access time"""
+  root = Paths.download_cache_root()
+  if getattr(_cache_index_local, "root", None) != root:
+    os.makedirs(root, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(root, "cache.db"), timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _transaction(conn):
+      for statement in CACHE_INDEX_SCHEMA.strip().splitlines():
+        conn.execute(statement)
+      _migrate_manifest(conn, root)
+    _cache_index_local.root, _cache_index_local.conn = root, conn
+  return _cache_index_local.conn
+
+
+def prune_cache(entries: dict[str, int] | None = None) -> None:
+  """Records new or accessed cache files with their size, then evicts the least recently used files until the cache is under the size limit."""
+  conn = cache_index()
+  now = time.time()  # noqa: TID251
+  with _transaction(conn):
+    if entries:
+      conn.executemany("INSERT INTO entries (name, size, atime) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET size = excluded.size, atime = excluded.atime",
+                       [(name, size, now) for name, size in entries.items()])
+
+    excess = conn.execute("SELECT size FROM total").fetchone()[0] - CACHE_SIZE
+    while excess > 0:
+      evicted = []
+      for name, size in conn.execute("SELECT name, size FROM entries ORDER BY atime LIMIT 64"):
+        evicted.append((name,))
+        excess -= size
+        if excess <= 0:
+          break
+      if not evicted:
+        break
+
+      conn.executemany("DELETE FROM entries WHERE name = ?", evicted)
+      for name, in evicted:
+        try:
+          os.remove(os.path.join(Paths.download_cache_root(), name))
+        except OSError:
+          pass
 
-  # write out manifest
-  with atomic_write(manifest_path, mode="w", overwrite=True) as f:
-    f.write('\n'.join(f"{k} {v}" for k, v in manifest.items()))
 
 class URLFileException(Exception):
   pass
@@ -56,10 +132,12 @@ class URLFileException(Exception):
 
 class URLFile:
   _pool_manager: PoolManager | None = None
+  _executor: ThreadPoolExecutor | None = None
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -69,11 +147,21 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_CHUNKS, thread_name_prefix="urlfile")
+    return URLFile._executor
+
   def __init__(self, url: str, timeout: int = 10, cache: bool | None = None):
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
     self._length: int | None = None
+    self._last_read_end: int | None = None
+    self._readahead: dict[int, Future] = {}
+    self._cache_entries: dict[str, int] = {}
+    self._lock = threading.Lock()
     #  Caching enabled by default, can be disabled with DISABLE_FILEREADER_CACHE=1, or overwritten by the cache input
     self._force_download = int(os.environ.get("DISABLE_FILEREADER_CACHE", "0")) == 1
     if cache is not None:
@@ -86,7 +174,11 @@ class URLFile:
     return self
 
   def __exit__(self, exc_type, exc_value, traceback) -> None:
-    pass
+    # readahead that hasn't started is dropped, chunks still downloading are finished so they're written and indexed
+    running = [future for future in self._readahead.values() if not future.cancel()]
+    self._readahead.clear()
+    wait(running)
+    self._flush_cache_entries()
 
   def _request(self, method: str, url: str, headers: dict[str, str] | None = None) -> BaseHTTPResponse:
     try:
@@ -110,14 +202,66 @@ class URLFile:
       with open(file_length_path) as file_length:
         content = file_length.read()
         self._length = int(content)
-        return self._length
+      self._touch(os.path.basename(file_length_path), len(content))
+      self._flush_cache_entries()
+      return self._length
 
     self._length = self.get_length_online()
     if not self._force_download and self._length != -1:
       with atomic_write(file_length_path, mode="w", overwrite=True) as file_length:
         file_length.write(str(self._length))
+      with self._lock:
+        self._cache_entries[os.path.basename(file_length_path)] = len(str(self._length))
+      self._flush_cache_entries()
     return self._length
 
+  def _chunk_name(self, chunk: int) -> str:
+    return hash_url(self._url) + "_" + str(chunk * CHUNK_SIZE / CHUNK_SIZE)
+
+  def _download_chunk(self, chunk: int) -> bytes:
+    data = self.get_multi_range([(chunk * CHUNK_SIZE, (chunk + 1) * CHUNK_SIZE)])[0]
+    file_name = self._chunk_name(chunk)
+    with atomic_write(os.path.join(Paths.download_cache_root(), file_name), mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    # indexed right away, readahead chunks can finish after the last read that would have flushed them
+    prune_cache({file_name: len(data)})
+    return data
+
+  def _touch(self, file_name: str, size: int) -> None:
+    # hits only bump the access time every TOUCH_INTERVAL, so reading from the cache doesn't write to the index every time
+    now = time.monotonic()
+    if now - _last_touch.get(file_name, -TOUCH_INTERVAL) >= TOUCH_INTERVAL:
+      _last_touch[file_name] = now
+      with self._lock:
+        self._cache_entries[file_name] = size
+
+  def _get_chunk(self, chunk: int) -> Future | bytes:
+    future = self._readahead.pop(chunk, None)
+    if future is not None and not (future.done() and future.exception() is not None):
+      return future
+
+    file_name = self._chunk_name(chunk)
+    full_path = os.path.join(Paths.download_cache_root(), file_name)
+    if os.path.exists(full_path):
+      with open(full_path, "rb") as cached_file:
+        data = cached_file.read()
+      self._touch(file_name, len(data))
+      return data
+    return URLFile.executor().submit(self._download_chunk, chunk)
+
+  def _start_readahead(self, first_chunk: int) -> None:
+    num_chunks = -(-self.get_length() // CHUNK_SIZE)
+    for chunk in range(first_chunk, min(first_chunk + READAHEAD_CHUNKS, num_chunks)):
+      if chunk not in self._readahead and not os.path.exists(os.path.join(Paths.download_cache_root(), self._chunk_name(chunk))):
+        self._readahead[chunk] = URLFile.executor().submit(self._download_chunk, chunk)
+
+  def _flush_cache_entries(self) -> None:
+    # cache hits are indexed once per read, not once per chunk
+    with self._lock:
+      entries, self._cache_entries = self._cache_entries, {}
+    if entries:
+      prune_cache(entries)
+
   def read(self, ll: int | None = None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
@@ -125,31 +269,32 @@ class URLFile:
     file_begin = self._pos
     file_end = self._pos + ll if ll is not None else self.get_length()
     assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_url(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write(full_path, mode="wb", overwrite=True) as new_cached_file:
-          new_cached_file.write(data)
-        prune_cache(file_name)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    if ll is not None and self.get_length() != -1:
+      # don't request chunks past the end of the file when reading in fixed size blocks
+      file_end = min(file_end, self.get_length())
+    if file_end <= file_begin:
+      return b""
+
+    #  We have to align with chunks we store. Missing chunks are downloaded in parallel
+    first_chunk, last_chunk = file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE
+    chunks = [self._get_chunk(chunk) for chunk in range(first_chunk, last_chunk + 1)]
+
+    # keep the next chunks downloading while a sequential reader processes this one
+    if file_begin == self._last_read_end:
+      self._start_readahead(last_chunk + 1)
+
+    try:
+      response = []
+      for chunk, data in enumerate(chunks, start=first_chunk):
+        if isinstance(data, Future):
+          data = data.result()
+        position = chunk * CHUNK_SIZE
+        response.append(data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+    finally:
+      self._flush_cache_entries()
+
+    self._pos = self._last_read_end = file_end
+    return b"".join(response)
 
   def read_aux(self, ll: int | None = None) -> bytes:
     if ll is None:
@@ -218,3 +363,4 @@ class URLFile:
 
 
 os.register_at_fork(after_in_child=URLFile.reset)
+os.register_at_fork(after_in_child=_reset_cache_index)
@@ -4,6 +4,8 @@ import os
 import struct
 from enum import IntEnum
 
+import numpy as np
+
 from openpilot.tools.lib.filereader import FileReader
 
 DEBUG = int(os.getenv("DEBUG", "0"))
@@ -17,6 +19,7 @@ DEBUG = int(os.getenv("DEBUG", "0"))
 NAL_UNIT_START_CODE = b"\x00\x00\x01"
 NAL_UNIT_START_CODE_SIZE = len(NAL_UNIT_START_CODE)
 NAL_UNIT_HEADER_SIZE = 2
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 class HevcNalUnitType(IntEnum):
   TRAIL_N = 0         # RBSP structure: slice_segment_layer_rbsp( )
@@ -258,38 +261,100 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
+def find_nal_unit_starts(dat: bytes | bytearray | memoryview, start: int = 0) -> np.ndarray:
+  """Positions of all NAL unit start codes in dat at or after start"""
+  arr = np.frombuffer(dat, dtype=np.uint8)[start:]
+  # a start code ends in 0x01, which is rare in compressed data, so only check the bytes before those
+  ones = np.flatnonzero(arr[2:] == 1)
+  ones = ones[(arr[ones] == 0) & (arr[ones + 1] == 0)]
+  return ones + start
+
+class HevcIndexer:
+  """Builds the frame index of an hevc stream that is fed in chunks of any size.
+
+  Only the NAL unit currently being parsed is kept in memory, not the whole stream."""
+  def __init__(self, allow_corrupt: bool = False):
+    self.allow_corrupt = allow_corrupt
+    self.frame_types: list[tuple[int, int]] = []
+    self.prefix_dat = b""
+    self._buf = bytearray()
+    self._offset = 0  # stream position of self._buf[0]
+    self._nal_unit_start: int | None = None  # position in self._buf of the NAL unit being collected
+    self._search_start = 0
+    self._failed = False
+
+  def _index_nal_unit(self, begin: int, end: int) -> None:
+    i = self._offset + begin
+    try:
+      with memoryview(self._buf)[begin:end] as nal_unit:
+        nal_unit_type = get_hevc_nal_unit_type(nal_unit, 0)
+        if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+          self.prefix_dat += nal_unit
+        elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+          slice_type, is_first_slice = get_hevc_slice_type(nal_unit, 0, nal_unit_type)
+          if is_first_slice:
+            self.frame_types.append((slice_type, i))
+    except Exception as e:
+      if not self.allow_corrupt:
+        raise
+      print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
+      self._failed = True
+
+  def _first_nal_unit(self, starts: np.ndarray) -> None:
+    if self._buf[0] != 0x00:
+      raise VideoFileInvalid("first byte must be 0x00")
+    self._nal_unit_start = 1 # skip past first byte 0x00
+    if len(starts) == 0 or starts[0] != 1:
+      try:
+        require_nal_unit_start(self._buf, 1)
+      except Exception as e:
+        if not self.allow_corrupt:
+          raise
+        print("ERROR: NAL unit skipped @ 1\n", str(e))
+        self._failed = True
+
+  def feed(self, dat: bytes) -> None:
+    if self._failed:
+      return
+    self._buf += dat
+    starts = find_nal_unit_starts(self._buf, self._search_start)
+    # a start code can be split across chunks, search the tail again next time
+    self._search_start = max(len(self._buf) - (NAL_UNIT_START_CODE_SIZE - 1), 0)
+
+    if self._nal_unit_start is None:
+      if len(self._buf) < NAL_UNIT_START_CODE_SIZE + 1:
+        return
+      self._first_nal_unit(starts)
+      if self._failed:
+        return
+      starts = starts[1:]
+
+    # a NAL unit is complete once the next start code is found
+    for start in starts.tolist():
+      self._index_nal_unit(self._nal_unit_start, start)
+      self._nal_unit_start = start
+      if self._failed:
+        return
+
+    del self._buf[:self._nal_unit_start]
+    self._offset += self._nal_unit_start
+    self._search_start -= self._nal_unit_start
+    self._nal_unit_start = 0
+
+  def finish(self) -> tuple[list, int, bytes]:
+    dat_len = self._offset + len(self._buf)
+    if dat_len < NAL_UNIT_START_CODE_SIZE + 1:
+      raise VideoFileInvalid("data is too short")
+    if not self._failed and self._nal_unit_start is not None:
+      self._index_nal_unit(self._nal_unit_start, len(self._buf))
+    return self.frame_types, dat_len, self.prefix_dat
+
 def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
+  indexer = HevcIndexer(allow_corrupt)
   with FileReader(hevc_file_name) as f:
-    dat = f.read()
-
-  if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
-    raise VideoFileInvalid("data is too short")
-
-  if dat[0] != 0x00:
-    raise VideoFileInvalid("first byte must be 0x00")
-
-  prefix_dat = b""
-  frame_types = list()
-
-  i = 1 # skip past first byte 0x00
-  try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
-  except Exception as e:
-    if not allow_corrupt:
-      raise
-    print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
-
-  return frame_types, len(dat), prefix_dat
+    while dat := f.read(STREAM_CHUNK_SIZE):
+      indexer.feed(dat)
+  return indexer.finish()
 
 def main() -> None:
   parser = argparse.ArgumentParser()